@@ -0,0 +1,96 @@
+"""
+Measures the startup time of the CLI and the import time of a step 1 (get_frequencies) run.
+
+Run from the repository root, e.g.:
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 10 --top 15
+
+Each command is run in a fresh interpreter with -X importtime, and the slowest imports are listed.
+Exits with an error if a command takes longer than its budget.
+"""
+import os
+import subprocess
+import sys
+import time
+
+import click
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Startup budgets in seconds (fastest of the repeats)
+BUDGETS = {'cli --help': 0.3, 'step 1 imports': 2.0}
+
+# Imports a step 1 run makes before its first stage runs: main, then each stage it needs. Stages that
+# fail to import are reported rather than stopping the measurement
+STEP_1_IMPORTS = """
+import sys
+sys.path[:0] = [{repo_dir!r}, {rhythmo_dir!r}]
+import main
+for name, step in main.STAGES:
+    if step <= 1:
+        try:
+            main.load_stage(name)
+        except Exception as e:
+            print(f"stage {{name}} could not be imported: {{e!r}}")
+"""
+
+COMMANDS = {
+    'cli --help': [os.path.join(REPO_DIR, 'cli.py'), '--help'],
+    'step 1 imports': ['-c', STEP_1_IMPORTS.format(repo_dir=REPO_DIR,
+                                                    rhythmo_dir=os.path.join(REPO_DIR, 'rhythmo'))],
+}
+
+
+def time_command(arguments):
+    """
+    Runs python with -X importtime and the arguments
+
+    Returns
+    -------
+    wall time (s), dict of top-level module name to cumulative import time (s), stdout
+    """
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', *arguments], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=False)
+    wall_time = time.perf_counter() - started
+
+    # Lines are "import time: self [us] | cumulative | <indent>module", indented by nesting depth
+    imports = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        if not module.startswith('  '):
+            imports[module.strip()] = int(cumulative) / 10 ** 6
+    return wall_time, imports, completed.stdout
+
+
+@click.command(help="Measures the startup time of the CLI and the imports of a step 1 run.")
+@click.option("-n", "--repeat", default=5, type=click.IntRange(min=1),
+              help="Number of times each command is run (the fastest run is recorded).")
+@click.option("-t", "--top", default=10, help="Number of slowest top-level imports listed.")
+def main(repeat, top) -> None:
+    over_budget = []
+    for name, arguments in COMMANDS.items():
+        runs = [time_command(arguments) for _ in range(repeat)]
+        wall_time, imports, stdout = min(runs, key=lambda run: run[0])
+
+        click.echo(f"{name}: {wall_time:.3f}s (budget {BUDGETS[name]:.3f}s)")
+        for line in stdout.splitlines():
+            if line.startswith('stage '):
+                click.echo(f"  {line}")
+        for module, cumulative in sorted(imports.items(), key=lambda item: -item[1])[:top]:
+            click.echo(f"  {cumulative:>8.3f}s  {module}")
+
+        if wall_time > BUDGETS[name]:
+            over_budget.append(name)
+
+    if over_budget:
+        click.echo(f"Over budget: {', '.join(over_budget)}")
+        sys.exit(1)
+    click.echo("All commands within budget.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+"""
+Times and memory-profiles the rhythmo engine functions (the wavelet transform, significance tables, best
+segment search, filter bank, blocked Hilbert phases and resampling) and each rhythmo stage on synthetic
+recordings.
+
+Run from the repository root, e.g.:
+
+    python benchmarks/run_benchmarks.py --durations 90,365 --rates 1H,1D --output results.json
+    python benchmarks/run_benchmarks.py --baseline results.json
+
+Results are written to a json file, and compared against a previous results file if one is given.
+"""
+import copy
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import click
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'rhythmo'), os.path.dirname(os.path.abspath(__file__))]
+
+# pylint: disable=wrong-import-position
+from dataclass import Parameters, RhythmoOutput
+from main import STAGES, load_stage
+from synthetic import DEFAULT_CYCLES, synthetic_heart_rate
+
+def measure(function, *args):
+    """
+    Runs a function, returning its result, wall time (s), cpu time (s) and peak traced memory (MB)
+    """
+    tracemalloc.start()
+    started_wall = time.perf_counter()
+    started_cpu = time.process_time()
+    try:
+        result = function(*args)
+    finally:
+        wall_time = time.perf_counter() - started_wall
+        cpu_time = time.process_time() - started_cpu
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, wall_time, cpu_time, peak / 1024 ** 2
+
+
+def timed(result: dict, function, args, repeat: int) -> dict:
+    """Runs function(*args) repeat times, adding the fastest timings (or the error) to result"""
+    try:
+        timings = [measure(function, *args)[1:] for _ in range(repeat)]
+    except Exception as e:
+        return {**result, 'status': 'failed', 'error': repr(e)}
+    wall_time, cpu_time, peak_memory = min(timings)
+    return {**result, 'status': 'ok', 'wall_time': wall_time, 'cpu_time': cpu_time,
+            'peak_memory_mb': peak_memory}
+
+
+def benchmark_engine(duration_days: float, rate: str, repeat: int, seed: int):
+    """
+    Runs each engine function directly on a synthetic recording, resampled and standardised by process,
+    at the known cycles of the recording (see synthetic.DEFAULT_CYCLES). Repeats hit the caches (wavelet
+    kernels, significance tables, filter designs), so the fastest run is the warm time.
+
+    Returns
+    -------
+    list of dict, one per engine function
+    """
+    # pylint: disable=import-outside-toplevel
+    import pycwt as cwt
+    from decomp import wavelet_periods
+    from process import resample_inputs
+    from selection import CYCLE_REPEATS, best_segments
+    from track import chunked_phases, filter_bank
+    from wavelet import significance, wavelet_transform
+
+    rhythmo_inputs = synthetic_heart_rate(duration_days, seed=seed)
+    parameters = Parameters(data_resampling_rate=rate)
+    result = {'duration_days': duration_days, 'rate': rate, 'num_inputs': len(rhythmo_inputs)}
+
+    results = [timed({**result, 'stage': 'resample_inputs'}, resample_inputs,
+                     (rhythmo_inputs, parameters.data_resampling_rate), repeat)]
+
+    rhythmo_outputs = load_stage('process')(rhythmo_inputs, RhythmoOutput.build_empty(), parameters)
+    if rhythmo_outputs is None:
+        return results + [{**result, 'stage': 'engine', 'status': 'failed', 'error': 'insufficient data'}]
+    y = rhythmo_outputs.resampled_data['value'].to_numpy(dtype=float)
+    samples_per_day = pd.Timedelta(days=1) / pd.Timedelta(rate)
+    dt = 1 / samples_per_day
+    periods = wavelet_periods(y, dt, (len(y) - 1) * dt / 3, parameters)
+    # Known cycles of the recording the transform can resolve (in days)
+    cycle_periods = np.array([period for period, _ in DEFAULT_CYCLES if periods[0] <= period <= periods[-1]])
+    if len(periods) < 3 or not len(cycle_periods):
+        return results + [{**result, 'stage': 'engine', 'status': 'failed', 'error': 'recording too short'}]
+
+    wave, scales = wavelet_transform(y, dt, 1 / periods, parameters.wavelet_waveform)[:2]
+    power = np.abs(wave) ** 2
+    alpha = cwt.ar1(y)[0]
+    peak_locs = np.searchsorted(periods, cycle_periods)
+    filtered_cycles = filter_bank(y, cycle_periods * samples_per_day, parameters.bandpass_cutoff_percentage)
+
+    benchmarks = [
+        ('wavelet_transform', wavelet_transform, (y, dt, 1 / periods, parameters.wavelet_waveform)),
+        ('significance', significance, (y.var(), dt, scales, 1, alpha, 0.95, y.size - scales,
+                                        parameters.wavelet_waveform)),
+        ('best_segments', best_segments, (power, peak_locs,
+                                          (periods[peak_locs] * CYCLE_REPEATS / dt).astype(int))),
+        ('filter_bank', filter_bank, (y, cycle_periods * samples_per_day, parameters.bandpass_cutoff_percentage)),
+        ('chunked_phases', chunked_phases, (filtered_cycles, cycle_periods.max() * samples_per_day)),
+    ]
+    for name, function, args in benchmarks:
+        results.append(timed({**result, 'stage': name}, function, args, repeat))
+    return results
+
+
+def benchmark_stages(duration_days: float, rate: str, repeat: int, seed: int):
+    """
+    Runs each stage in order on a synthetic recording, stopping at the first stage that is unavailable
+    or fails (later stages depend on its outputs).
+
+    Returns
+    -------
+    list of dict, one per stage
+    """
+    rhythmo_inputs = synthetic_heart_rate(duration_days, seed=seed)
+    parameters = Parameters(data_resampling_rate=rate)
+    rhythmo_outputs = RhythmoOutput.build_empty()
+
+    results = []
+    for stage, _ in STAGES:
+        result = {'duration_days': duration_days, 'rate': rate, 'stage': stage,
+                  'num_inputs': len(rhythmo_inputs)}
+        try:
+            stage_function = load_stage(stage)
+        except Exception as e:
+            results.append({**result, 'status': 'unavailable', 'error': repr(e)})
+            break
+
+        timings = []
+        try:
+            for _ in range(repeat):
+                # Stages update the outputs in place, so every repeat starts from the previous stage's outputs
+                stage_outputs, *timing = measure(stage_function, rhythmo_inputs,
+                                                 copy.copy(rhythmo_outputs), parameters)
+                timings.append(timing)
+        except Exception as e:
+            results.append({**result, 'status': 'failed', 'error': repr(e)})
+            break
+
+        if stage_outputs is None:
+            results.append({**result, 'status': 'failed', 'error': 'stage returned no outputs'})
+            break
+
+        wall_time, cpu_time, peak_memory = min(timings)
+        results.append({**result, 'status': 'ok', 'wall_time': wall_time, 'cpu_time': cpu_time,
+                        'peak_memory_mb': peak_memory})
+        rhythmo_outputs = stage_outputs
+
+    return results
+
+
+def compare(results, baseline, tolerance: float):
+    """
+    Compares wall times and peak memory against a baseline.
+
+    Returns
+    -------
+    list of str describing each regression larger than tolerance (as a proportion)
+    """
+    baseline_by_key = {(b['duration_days'], b['rate'], b['stage']): b for b in baseline['results']
+                       if b['status'] == 'ok'}
+    regressions = []
+    for result in results:
+        base = baseline_by_key.get((result['duration_days'], result['rate'], result['stage']))
+        if base is None or result['status'] != 'ok':
+            continue
+        for metric in ['wall_time', 'peak_memory_mb']:
+            if base[metric] > 0 and result[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{result['stage']} ({result['duration_days']} days, {result['rate']}): {metric} "
+                    f"{base[metric]:.3f} -> {result[metric]:.3f} ({result[metric] / base[metric] - 1:+.0%})")
+    return regressions
+
+
+def print_results(results) -> None:
+    """Prints results as a table"""
+    click.echo(f"{'days':>6} {'rate':>5} {'stage':<18} {'status':<12} {'wall (s)':>9} {'cpu (s)':>9} {'peak (MB)':>10}")
+    for result in results:
+        if result['status'] == 'ok':
+            click.echo(f"{result['duration_days']:>6} {result['rate']:>5} {result['stage']:<18} {'ok':<12} "
+                       f"{result['wall_time']:>9.3f} {result['cpu_time']:>9.3f} {result['peak_memory_mb']:>10.1f}")
+        else:
+            click.echo(f"{result['duration_days']:>6} {result['rate']:>5} {result['stage']:<18} "
+                       f"{result['status']:<12} {result['error'][:60]}")
+
+
+@click.command(help="Times and memory-profiles the rhythmo engine functions and stages on synthetic recordings.")
+@click.option("-d", "--durations", default="90,365,1825",
+              help="Comma separated list of recording durations in days.")
+@click.option("-r", "--rates", default="1Min,5Min,1H,1D",
+              help="Comma separated list of data_resampling_rate values.")
+@click.option("-n", "--repeat", default=1, type=click.IntRange(min=1),
+              help="Number of times each stage is run (the fastest run is recorded).")
+@click.option("--engine/--no-engine", default=True,
+              help="Whether to benchmark the engine functions directly as well as the stages.")
+@click.option("-s", "--seed", default=0, help="Random seed of the synthetic recordings.")
+@click.option("-o", "--output", default=os.path.join(REPO_DIR, 'benchmarks', 'results.json'),
+              help="Json file the results are written to.")
+@click.option("-b", "--baseline", default=None,
+              help="Json results file to compare against. Exits with an error if anything regressed.")
+@click.option("-t", "--tolerance", default=0.2,
+              help="Allowed increase over the baseline, as a proportion (default 0.2 = 20%).")
+def main(durations, rates, repeat, engine, seed, output, baseline, tolerance) -> None:
+    results = []
+    for duration_days in [float(d) for d in durations.split(',')]:
+        for rate in rates.split(','):
+            # Stages first, so their timings do not depend on the caches warmed by the engine benchmarks
+            results.extend(benchmark_stages(duration_days, rate, repeat, seed))
+            if engine:
+                results.extend(benchmark_engine(duration_days, rate, repeat, seed))
+
+    print_results(results)
+
+    report = {'meta': {'time': datetime.now(timezone.utc).isoformat(),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'platform': platform.platform(),
+                       'repeat': repeat,
+                       'seed': seed},
+              'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=True)
+    click.echo(f"Results written to {output}")
+
+    if baseline:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        if regressions:
+            click.echo("Regressions against the baseline:")
+            for regression in regressions:
+                click.echo(f"  {regression}")
+            sys.exit(1)
+        click.echo("No regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
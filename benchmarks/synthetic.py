@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+
+MINUTES_PER_DAY = 24 * 60
+MS_PER_DAY = 24 * 60 * 60 * 1000
+
+# (period in days, amplitude in beats per minute) of the cycles in the synthetic heart rate
+DEFAULT_CYCLES = (
+    (90 / MINUTES_PER_DAY, 2.0), # ultradian (90 minutes)
+    (1.0, 8.0), # circadian
+    (7.0, 3.0), # about-weekly multiday
+    (30.0, 2.0), # about-monthly multiday
+)
+
+
+def synthetic_heart_rate(duration_days: float,
+                         sampling_interval: str = '1Min',
+                         cycles=DEFAULT_CYCLES,
+                         baseline: float = 65.0,
+                         noise: float = 4.0,
+                         gap_fraction: float = 0.15,
+                         mean_gap_hours: float = 10.0,
+                         dropout: float = 0.05,
+                         jitter: float = 0.3,
+                         start: str = '2020-01-01',
+                         seed: int = 0) -> pd.DataFrame:
+    """
+    Generates a heart-rate-like recording with known cycles, in the rhythmo input format.
+
+    Parameters
+    ------------
+    duration_days: float
+        length of the recording (in days)
+    sampling_interval: str (default = '1Min')
+        nominal interval between samples
+    cycles: sequence of (period in days, amplitude)
+        cycles added to the signal, with a random phase each
+    baseline: float (default = 65)
+        mean heart rate
+    noise: float (default = 4)
+        standard deviation of the added white noise
+    gap_fraction: float (default = 0.15)
+        approximate proportion of the recording covered by NaN gaps (e.g., device not worn)
+    mean_gap_hours: float (default = 10)
+        mean length of a NaN gap (exponentially distributed)
+    dropout: float (default = 0.05)
+        proportion of individual samples that are missing entirely
+    jitter: float (default = 0.3)
+        random offset of each sample time, as a proportion of the sampling interval
+    seed: int (default = 0)
+        random seed
+
+    Returns
+    -------
+    dataframe with columns: timestamp (milliseconds since epoch) and value
+    """
+    rng = np.random.default_rng(seed)
+    interval = pd.Timedelta(sampling_interval).value // 10 ** 6 # in milliseconds
+    num_samples = int(duration_days * MS_PER_DAY // interval)
+
+    # Irregular sampling: jittered sample times with some samples dropped
+    offsets = np.arange(num_samples) * interval + rng.uniform(-jitter / 2, jitter / 2, num_samples) * interval
+    offsets = np.sort(offsets[rng.random(num_samples) >= dropout])
+    days = offsets / MS_PER_DAY
+
+    values = baseline + noise * rng.standard_normal(len(days))
+    for period, amplitude in cycles:
+        values += amplitude * np.sin(2 * np.pi * days / period + rng.uniform(0, 2 * np.pi))
+
+    # NaN gaps of random length until about gap_fraction of the recording is covered
+    gap_days = 0.0
+    while gap_days < gap_fraction * duration_days:
+        length = rng.exponential(mean_gap_hours / 24)
+        gap_start = rng.uniform(0, duration_days)
+        values[(days >= gap_start) & (days < gap_start + length)] = np.nan
+        gap_days += length
+
+    timestamps = pd.Timestamp(start).value // 10 ** 6 + offsets.astype(np.int64)
+    return pd.DataFrame({'timestamp': timestamps, 'value': values})
@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import pickle
+from typing import Optional
+
+from logger.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Bumped whenever the stages or the stored outputs change, so older entries are never reused
+CACHE_VERSION = 3
+
+# Parameters read by each stage, in stage order. The outputs of a stage depend on its own parameters and
+# on those of every stage before it
+STAGE_PARAMETERS = {
+    'process': ['data_resampling_rate'],
+    'decomp': ['wavelet_waveform', 'period_grid'],
+    'selection': ['cycle_selection_method', 'cycle_period', 'number_of_cycles'],
+    'track': ['bandpass_cutoff_percentage'],
+    'project': ['projection_method', 'projection_duration'],
+    'forecast': ['timing_of_future_phases', 'number_of_future_phases'],
+}
+
+HASH_CHUNK_SIZE = 1024 ** 2 # bytes read at a time when hashing input files
+
+
+def file_hash(file_path: str) -> str:
+    """Gets the sha256 hash of the contents of a file"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def stage_parameters(parameters, stage: str) -> dict:
+    """Gets the parameters that the outputs of a stage depend on (its own and every earlier stage's)"""
+    values = parameters.to_dict()
+    names = []
+    for name, stage_names in STAGE_PARAMETERS.items():
+        names.extend(stage_names)
+        if name == stage:
+            break
+    return {name: values.get(name) for name in names}
+
+
+class ResultCache:
+    """
+    On-disk cache of the outputs of each stage, keyed by the hash of the input file contents and the
+    parameters the stage depends on, so unchanged inputs (or stages whose parameters did not change)
+    are not recomputed.
+
+    Entries are pickled RhythmoOutputs, one file per (input, stage, parameters). The least recently
+    used entries are removed once the cache is larger than max_bytes. The size of the cache is kept as
+    a running total (from a scan of the folder on the first put), so the folder is only scanned again
+    when the total goes over max_bytes. Entries written by other processes are only counted from then.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """
+        Parameters
+        ----------
+        cache_dir: str, folder the entries are saved in
+        max_bytes: int, maximum total size of the entries
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.nbytes = None # running total size of the entries, None until the folder is first scanned
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def stage_key(self, input_hash: str, parameters, stage: str) -> str:
+        """Gets the key of the outputs of a stage for an input (by its hash)"""
+        description = json.dumps({'version': CACHE_VERSION,
+                                  'input': input_hash,
+                                  'stage': stage,
+                                  'parameters': stage_parameters(parameters, stage)},
+                                 sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        """Gets the location of an entry"""
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def get(self, key: str):
+        """Loads the outputs saved under key, returning None if there are none"""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                rhythmo_outputs = pickle.load(f)
+            os.utime(path) # mark as recently used
+            return rhythmo_outputs
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache entry {path}: {e}")
+            return None
+
+    def put(self, key: str, rhythmo_outputs) -> None:
+        """Saves outputs under key, then evicts the least recently used entries if over max_bytes"""
+        if self.nbytes is None:
+            self.nbytes = sum(size for _, size, _ in self._entries())
+
+        path = self.path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            pickle.dump(rhythmo_outputs, f, protocol=pickle.HIGHEST_PROTOCOL)
+            size = f.tell()
+        try:
+            replaced_size = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced_size = 0
+        os.replace(temporary_path, path)
+
+        self.nbytes += size - replaced_size
+        if self.nbytes > self.max_bytes:
+            self.evict()
+
+    def _entries(self):
+        """Gets the (last used time, size, path) of every entry"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError: # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache is at most max_bytes"""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug("Evicted cache entry %s", path)
+        self.nbytes = total
+
+    def info(self) -> dict:
+        """Returns the number of entries and their total size in bytes"""
+        sizes = [size for _, size, _ in self._entries()]
+        return {'items': len(sizes), 'nbytes': sum(sizes)}
+
+
+def open_cache(cache_dir: Optional[str], max_mb: float) -> Optional[ResultCache]:
+    """Creates the result cache, or returns None if no cache_dir is given"""
+    if cache_dir is None:
+        return None
+    return ResultCache(cache_dir, int(max_mb * 1024 ** 2))
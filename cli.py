@@ -1,6 +1,9 @@
 import click
 from logger.logger import get_logger
-from main import Run
+
+# Run (and through it pandas, scipy and pycwt) is imported by each command rather than here, so that
+# --help and argument errors don't wait for the heavy imports
+# pylint: disable=import-outside-toplevel
 
 logger = get_logger(__name__)
 
@@ -20,12 +23,48 @@ def cli() -> None:
               help="Comma separated list of outputs.")
 @click.option("-p", "--parameters", default=None,
               help="Location of parameters file name in json format (e.g., ), allowing default paramters to be overwritten.")
-def run(inputs, outputs, parameters) -> None:
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=1),
+              help="Number of processes used to run the inputs in parallel (default 1, sequential).")
+@click.option("--trace-memory", is_flag=True, default=False,
+              help="Measure the peak memory allocated by each stage and output handler (slower).")
+@click.option("--profile-dir", default=None,
+              help="Folder to save a cProfile profile (.prof) of each input to.")
+@click.option("--profile-inputs", default=None,
+              help="Comma separated list of input file names to profile (default all, requires --profile-dir).")
+@click.option("--batch", is_flag=True, default=False,
+              help="Analyse all inputs together, stacking series with the same number of samples.")
+@click.option("--batch-key", default=None,
+              help="Column identifying the subject (or channel) of each row of long-format inputs (implies --batch).")
+@click.option("--cache-dir", default=None,
+              help="Folder to cache the outputs of each stage in, so unchanged inputs and stages are not rerun.")
+@click.option("--cache-size", default=1024.0, type=click.FloatRange(min=0),
+              help="Maximum size of the cache in MB (default 1024). Least recently used outputs are removed first.")
+@click.option("--pipeline-depth", default=0, type=click.IntRange(min=0),
+              help="Run output handlers on a background thread while the next input is analysed, with at most "
+                   "this many inputs waiting for their outputs (default 0, run handlers before the next input).")
+@click.option("--coverage", is_flag=True, default=False,
+              help="Keep a coverage index next to each input, so inputs with insufficient data are skipped without being loaded.")
+@click.option("--coverage-dir", default=None,
+              help="Folder to keep the coverage index of each input in (implies --coverage).")
+def run(inputs, outputs, parameters, workers, trace_memory, profile_dir, profile_inputs, batch, batch_key,
+        cache_dir, cache_size, pipeline_depth, coverage, coverage_dir) -> None:
     logger.debug("=== Running command ===")
+    from main import Run
     runtime = Run(
         inputs.split(',') if inputs else None,
         outputs.split(',') if outputs else ["predict_future_phases"],
-        parameters if parameters else None)
+        parameters if parameters else None,
+        workers=workers,
+        trace_memory=trace_memory,
+        profile_dir=profile_dir,
+        profile_inputs=profile_inputs.split(',') if profile_inputs else None,
+        batch=batch,
+        batch_key=batch_key,
+        cache_dir=cache_dir,
+        cache_size=cache_size,
+        pipeline_depth=pipeline_depth,
+        coverage=coverage,
+        coverage_dir=coverage_dir)
     logger.debug("Runtime initialised, starting runtime.run()")
     try:
         runtime.run()
@@ -35,3 +74,136 @@ def run(inputs, outputs, parameters) -> None:
     except Exception as e:
         logger.error(f"Task failed due to: {e}", exc_info=True)
         raise e
+
+
+@cli.command(
+    help=
+    "Updates the predicted future phases of each input from the data appended since its last run, using saved per-input state.")
+@click.option(
+    "-i", "--inputs", required=True,
+    help="Comma separated list of data inputs, or a folder location containing data inputs.")
+@click.option("-o", "--outputs", default="predict_future_phases",
+              help="Comma separated list of outputs.")
+@click.option("-p", "--parameters", default=None,
+              help="Location of parameters file name in json format (e.g., ), allowing default paramters to be overwritten.")
+@click.option("-s", "--state-dir", required=True,
+              help="Folder where the state of each input is saved between runs.")
+@click.option("--full-inputs", is_flag=True, default=False,
+              help="Give the output handlers the full input of each updated input, rather than only the rows read for the update.")
+def update(inputs, outputs, parameters, state_dir, full_inputs) -> None:
+    logger.debug("=== Running update command ===")
+    from main import Run
+    runtime = Run(
+        inputs.split(',') if inputs else None,
+        outputs.split(',') if outputs else ["predict_future_phases"],
+        parameters if parameters else None)
+    try:
+        runtime.update(state_dir, full_inputs)
+    except Exception as e:
+        logger.error(f"Task failed due to: {e}", exc_info=True)
+        raise e
+
+
+
+@cli.command(
+    help=
+    "Runs every combination of a grid of parameter overrides, sharing the stages each combination has in common, and writes a table comparing them.")
+@click.option(
+    "-i", "--inputs", required=True,
+    help="Comma separated list of data inputs, or a folder location containing data inputs.")
+@click.option("-g", "--grid", required=True,
+              help="Location of the grid in json format: parameter names mapped to lists of values (every combination is run), or a list of parameter overrides.")
+@click.option("-o", "--outputs", default="predict_future_phases",
+              help="Output whose step is the last one run (the output handlers themselves are not run).")
+@click.option("-p", "--parameters", default=None,
+              help="Location of parameters file name in json format, setting the parameters the grid does not override.")
+@click.option("-t", "--table", default="sweep.csv", help="Location the comparison table is written to (csv).")
+def sweep(inputs, grid, outputs, parameters, table) -> None:
+    logger.debug("=== Running sweep command ===")
+    from main import Run
+    from utils import read_json
+    runtime = Run(
+        inputs.split(',') if inputs else None,
+        outputs.split(',') if outputs else ["predict_future_phases"],
+        parameters if parameters else None)
+    try:
+        results = runtime.sweep(read_json(grid))
+        if results is None:
+            return
+        results.to_csv(table, index=False)
+        logger.info(f"Wrote the comparison of {len(results)} runs to {table}")
+    except Exception as e:
+        logger.error(f"Task failed due to: {e}", exc_info=True)
+        raise e
+
+
+
+@cli.command(
+    help=
+    "Serves rhythmo on a local port (or Unix socket), keeping the stages and their caches warm between requests. POST /predict runs an input path or inline data with parameter overrides, GET /health returns the queue depth and latencies.")
+@click.option("-o", "--outputs", default="predict_future_phases",
+              help="Comma separated list of outputs run for every request.")
+@click.option("-p", "--parameters", default=None,
+              help="Location of parameters file name in json format, overridden by the parameters of each request.")
+@click.option("-w", "--workers", default=1, type=click.IntRange(min=1),
+              help="Number of worker processes running requests concurrently (default 1).")
+@click.option("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1, local only).")
+@click.option("--port", default=8350, type=click.IntRange(min=0), help="Port to listen on (default 8350).")
+@click.option("--socket", "socket_path", default=None, help="Unix socket to listen on instead of a port.")
+@click.option("--max-queue", default=64, type=click.IntRange(min=1),
+              help="Maximum number of pending requests, further requests are rejected with 503 (default 64).")
+@click.option("--cache-dir", default=None,
+              help="Folder to cache the outputs of each stage in, so unchanged inputs and stages are not rerun.")
+@click.option("--cache-size", default=1024.0, type=click.FloatRange(min=0),
+              help="Maximum size of the cache in MB (default 1024). Least recently used outputs are removed first.")
+@click.option("--coverage-dir", default=None,
+              help="Folder to keep the coverage index of each input in, to skip inputs with insufficient data.")
+def serve(outputs, parameters, workers, host, port, socket_path, max_queue, cache_dir, cache_size,
+          coverage_dir) -> None:
+    logger.debug("=== Running serve command ===")
+    import server
+    rhythmo = server.RhythmoServer(outputs.split(','), parameters, workers=workers, max_queue=max_queue,
+                                   cache_dir=cache_dir, cache_size=cache_size, coverage_dir=coverage_dir)
+    server.serve(rhythmo, host=host, port=port, socket_path=socket_path)
+
+
+
+@cli.command(
+    help=
+    "Converts csv, parquet or json inputs to the memory-mapped rhythmo binary format (.rhy), which is read without parsing.")
+@click.option(
+    "-i", "--inputs", required=True,
+    help="Comma separated list of data inputs, or a folder location containing data inputs.")
+@click.option("-o", "--output-dir", default=None,
+              help="Folder to write the .rhy files to (default next to each input).")
+@click.option("--coverage", is_flag=True, default=False,
+              help="Also build the coverage index of each .rhy file (see run --coverage).")
+def convert(inputs, output_dir, coverage) -> None:
+    logger.debug("=== Running convert command ===")
+    import os
+    from utils import convert_input, read_input
+
+    input_files = inputs.split(',')
+    if len(input_files) == 1 and os.path.isdir(input_files[0]):
+        input_files = [os.path.join(input_files[0], file) for file in sorted(os.listdir(input_files[0]))
+                       if file.endswith(('.csv', '.parquet', '.json'))]
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    for input_file in input_files:
+        output_file = None
+        if output_dir:
+            output_file = os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + '.rhy')
+        try:
+            output_file = convert_input(input_file, output_file)
+            logger.info(f"[{input_file}] Converted to {output_file}")
+            if coverage:
+                from coverage_index import build_coverage, save_coverage
+                index_file = save_coverage(output_file, build_coverage(read_input(output_file)))
+                logger.info(f"[{input_file}] Saved coverage index to {index_file}")
+        except Exception as e:
+            logger.error(f"[{input_file}] Failed to convert due to: {e}", exc_info=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -1,6 +1,7 @@
 from dataclasses import asdict, dataclass, field
-from typing import Optional, Sequence
+from typing import List, Optional
 
+import numpy as np
 import pandas as pd
 from logger.logger import get_logger
 
@@ -12,16 +13,18 @@ class Parameters:
     Parameters for rhythmo.
     Default values must be provided.
     """
-    data_type: str = "csv" # default is csv file, but can be "json" or "parquet"
+    data_type: str = "csv" # default is csv file, but can be "json", "parquet" or "rhy" (rhythmo binary, see cli.py convert)
     data_resampling_rate: str = '1H'  # default is hourly, but can be '1Min', '5Min', '1D', etc.
-    wavelet_waveform: str = "morlet" # default is morlet, but can be "gaussian", "mexican_hat", etc.. # TODO: add support for other waveforms
-    cycle_selection_method: str = 'prominence' # default is 'prominence', but can be 'power' or 'relative power'
+    wavelet_waveform: str = "morlet" # default is morlet, but can be "paul", "dog" (derivative of gaussian) or "mexican_hat"
+    period_grid: str = "linear" # default is linear (periods every 0.5 days), but can be "adaptive" (coarse log-spaced periods, refined every 0.5 days around the peaks of the global power)
+    cycle_selection_method: str = 'prominence' # default is 'prominence', but can be 'power', 'relative power' or 'segment_power' (highest average power over 3 cycles)
     cycle_period: Optional[float] = None # default is None (automatically selects strongest), but can be any float value (in days). This determines the cycle period to filter the signal at and project the cycle at etc.
     bandpass_cutoff_percentage: float = 33 # default is +/- 33%, but can be any float value (as a percentage). This determines the bandpass filter cutoff percentages either side of the cycle period.
     projection_method: str = "linear"  # default is linear projection, but can be "prophet" for Facebook Prophet method #TODO: add support for this and ohter projection methods
     projection_duration: Optional[int] = None # if None, it will automatically select 4 * period of cycle. Otherwise this can be any integer value (in days).
     timing_of_future_phases: str = "regular_sampling" # default is regular_sampling to capture all phases of the cycle, but can be "peak_trough" or "peak_trough_rising_falling"
     number_of_future_phases: int = 8 # by default, rhythmo will predict 8 future phase times. Must be at least 1
+    number_of_cycles: int = 1 # by default, rhythmo tracks the strongest cycle only, but can track the strongest n cycles (e.g., 3 for circadian, multiday and weekly cycles) through a bank of bandpass filters
 
     def sanity_check(self) -> bool:
         '''
@@ -41,6 +44,9 @@ class Parameters:
         if self.number_of_future_phases <= 0:
             raise_warning = True
             params.append('number_of_future_phases')
+        if self.number_of_cycles <= 0:
+            raise_warning = True
+            params.append('number_of_cycles')
 
         if raise_warning:
             logger.warning(
@@ -52,29 +58,231 @@ class Parameters:
         """Returns object of dataclass instance."""
         return asdict(self)
 
-# pylint: disable=too-many-instance-attributes
-# It doesn't make sense to split / merge any of these variables
-@dataclass
+# Columns of samples (one row per timestamp), the bulk of every output, stored as float32. Other float
+# columns (periods, powers and significance) keep full precision
+SAMPLE_COLUMNS = ('value', 'phase')
+
+
+def _intern_axis(timestamps, axes):
+    """
+    Returns timestamps (int64 nanoseconds) as a view of an identical run of one of the existing axes
+    if there is one, so the fields of an output share a single timestamp array.
+    """
+    for axis in axes:
+        if len(timestamps) == 0 or len(timestamps) > len(axis):
+            continue
+        start = int(np.searchsorted(axis, timestamps[0]))
+        if np.array_equal(axis[start:start + len(timestamps)], timestamps):
+            return axis[start:start + len(timestamps)]
+    return timestamps
+
+
+def _pack_frame(df: pd.DataFrame, axes):
+    """
+    Splits a dataframe into read-only column arrays: datetimes as int64 nanoseconds (shared with axes
+    where possible), sample columns (see SAMPLE_COLUMNS) as float32 and other floats as float64.
+
+    Returns
+    -------
+    columns: dict of column name to array
+    index: range (for the default index) or array of the index
+    datetimes: dict of the timezone (or None) of each datetime column
+    """
+    columns = {}
+    datetimes = {}
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            datetimes[name] = getattr(column.dt, 'tz', None)
+            values = _intern_axis(np.array(pd.DatetimeIndex(column).asi8), axes)
+        elif pd.api.types.is_float_dtype(column):
+            values = np.array(column, dtype=np.float32 if name in SAMPLE_COLUMNS else np.float64)
+        else:
+            values = np.array(column)
+        values.flags.writeable = False
+        columns[name] = values
+
+    index = df.index
+    if isinstance(index, pd.RangeIndex):
+        index = range(index.start, index.stop, index.step)
+    else:
+        index = np.array(index)
+        index.flags.writeable = False
+    return columns, index, datetimes
+
+
+def _unpack_frame(columns, index, datetimes) -> pd.DataFrame:
+    """Builds a dataframe over the arrays of _pack_frame, without copying them (so it is read-only)"""
+    data = {}
+    for name, values in columns.items():
+        if name in datetimes:
+            # Timezone aware columns are stored as UTC, which is how pandas holds them
+            dtype = None if datetimes[name] is None else pd.DatetimeTZDtype(tz=datetimes[name])
+            data[name] = pd.arrays.DatetimeArray(values.view('M8[ns]'), dtype=dtype, copy=False)
+        else:
+            data[name] = values
+    return pd.DataFrame(data, index=pd.RangeIndex(index.start, index.stop, index.step)
+                        if isinstance(index, range) else index, copy=False)
+
+
+def _frame_property(name: str, doc: str):
+    """Dataframe field of RhythmoOutput, stored as arrays and built when accessed"""
+    def getter(self):
+        frame = self._frames.get(name)
+        return None if frame is None else _unpack_frame(*frame)
+
+    def setter(self, df):
+        if df is None:
+            self._frames.pop(name, None)
+            return
+        self._frames[name] = _pack_frame(df, self._axes())
+        # Earlier fields whose timestamps are a run of this field's now share its array
+        axes = [values for values in self._frames[name][0].values() if values.dtype == np.int64]
+        for other, (columns, index, datetimes) in list(self._frames.items()):
+            if other != name:
+                columns = {**columns, **{column: _intern_axis(columns[column], axes) for column in datetimes}}
+                self._frames[other] = (columns, index, datetimes)
+
+    return property(getter, setter, doc=doc)
+
+
 class RhythmoOutput:
     """
     Output data from Rhythmo
+
+    The dataframes are stored as column arrays rather than dataframes: timestamp columns as int64
+    nanoseconds, shared between fields (a field whose timestamps are a run of another's holds a view
+    of it), and the value and phase columns as float32. Dataframes are built over the stored (read-only)
+    arrays each time a field is read, without copying them, so update a field by assigning a new
+    dataframe rather than modifying the one returned.
+
+    cycle_period, filtered_cycle and future_phases are those of the strongest cycle. When more than one
+    cycle is tracked (see Parameters.number_of_cycles), cycle_periods, filtered_cycles and
+    cycle_future_phases hold every cycle, strongest first.
     """
-    resampled_data: Optional[pd.DataFrame] = None # dataframe with columns: timestamp and value
-    best_segment: Optional[pd.DataFrame] = None # dataframe with columns: timestamp and value
-    wavelet_data: Optional[pd.DataFrame] = None # dataframe with columns: period, power, significance, peak (1 or 0)
-    cycle_period: Optional[float] = None # float value (in days)
-    filtered_cycle: Optional[pd.DataFrame] = None # dataframe with columns: timestamp and value
+    __slots__ = ('_frames', 'cycle_period', 'cycle_periods', 'notes')
+
+    resampled_data = _frame_property('resampled_data', "dataframe with columns: timestamp and value")
+    best_segment = _frame_property('best_segment', "dataframe with columns: timestamp and value")
+    wavelet_data = _frame_property('wavelet_data', "dataframe with columns: period, power, significance, peak (1 or 0)")
+    filtered_cycle = _frame_property('filtered_cycle', "dataframe with columns: timestamp and value")
+    projected_cycle = _frame_property('projected_cycle', "dataframe with columns: timestamp and value")
+    future_phases = _frame_property('future_phases', "dataframe with columns: timestamp and phase")
+    filtered_cycles = _frame_property('filtered_cycles', "dataframe with columns: cycle_period, timestamp and value")
+    cycle_future_phases = _frame_property('cycle_future_phases', "dataframe with columns: cycle_period, timestamp and phase")
+
+    FIELDS = ('resampled_data', 'best_segment', 'wavelet_data', 'cycle_period', 'filtered_cycle',
+              'projected_cycle', 'future_phases', 'cycle_periods', 'filtered_cycles', 'cycle_future_phases',
+              'notes')
+
+    def __init__(self,
+                 resampled_data: Optional[pd.DataFrame] = None,
+                 best_segment: Optional[pd.DataFrame] = None,
+                 wavelet_data: Optional[pd.DataFrame] = None,
+                 cycle_period: Optional[float] = None, # float value (in days)
+                 filtered_cycle: Optional[pd.DataFrame] = None,
+                 projected_cycle: Optional[pd.DataFrame] = None,
+                 future_phases: Optional[pd.DataFrame] = None,
+                 cycle_periods: Optional[List[float]] = None, # float values (in days), strongest first
+                 filtered_cycles: Optional[pd.DataFrame] = None,
+                 cycle_future_phases: Optional[pd.DataFrame] = None,
+                 notes: str = ''): # str, comments about the cycle
+        self._frames = {}
+        self.resampled_data = resampled_data
+        self.best_segment = best_segment
+        self.wavelet_data = wavelet_data
+        self.cycle_period = cycle_period
+        self.filtered_cycle = filtered_cycle
+        self.projected_cycle = projected_cycle
+        self.future_phases = future_phases
+        self.cycle_periods = cycle_periods
+        self.filtered_cycles = filtered_cycles
+        self.cycle_future_phases = cycle_future_phases
+        self.notes = notes
+
+    def _axes(self):
+        """Timestamp arrays of the stored fields"""
+        return [columns[column] for columns, _, datetimes in self._frames.values() for column in datetimes]
+
+    def __repr__(self):
+        fields = ', '.join(f"{name}={'<dataframe>' if name in self._frames else repr(getattr(self, name))}"
+                           for name in self.FIELDS)
+        return f"RhythmoOutput({fields})"
 
-    projected_cycle: Optional[pd.DataFrame] = None # dataframe with columns: timestamp and value
-    future_phases: Optional[pd.DataFrame] = None # dataframe with columns: timestamp and phase
+    def __getstate__(self):
+        return self._frames, self.cycle_period, self.cycle_periods, self.notes
 
-    # str, comments about the cycle
-    notes: str = ''
+    def __setstate__(self, state):
+        frames, self.cycle_period, self.cycle_periods, self.notes = state
+        # Unpickled arrays are writeable copies, so make them read-only and share the timestamps again
+        # (longest field first, so the shorter runs are views of it)
+        self._frames = {}
+        for name, (columns, index, datetimes) in sorted(frames.items(), key=lambda item: -len(item[1][1])):
+            for values in [*columns.values(), index]:
+                if isinstance(values, np.ndarray):
+                    values.flags.writeable = False
+            axes = self._axes()
+            self._frames[name] = ({column: _intern_axis(values, axes) if column in datetimes else values
+                                   for column, values in columns.items()}, index, datetimes)
+        self._frames = {name: self._frames[name] for name in frames}
 
     @staticmethod
     def build_empty():
         return RhythmoOutput()
 
+    def copy(self):
+        """Returns a copy sharing the (read-only) arrays of this output"""
+        rhythmo_outputs = RhythmoOutput.build_empty()
+        rhythmo_outputs._frames = dict(self._frames)
+        rhythmo_outputs.cycle_period = self.cycle_period
+        rhythmo_outputs.cycle_periods = None if self.cycle_periods is None else list(self.cycle_periods)
+        rhythmo_outputs.notes = self.notes
+        return rhythmo_outputs
+
+    __copy__ = copy
+
     def to_dict(self):
-        """Returns object of dataclass instance."""
-        return asdict(self)
+        """Returns the fields of the output, with dataframes built from the stored arrays."""
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+# pylint: disable=too-many-instance-attributes
+@dataclass
+class SubjectState:
+    """
+    Persisted state of a subject between runs, so appended data can update the predicted phases
+    without reprocessing the whole history.
+    """
+    data_resampling_rate: str # rate the state was resampled at
+    resampled_data: pd.DataFrame # dataframe with columns: timestamp and value (resampled, before standardising)
+    num_samples: int # number of resampled samples
+    num_nans: int # number of resampled samples without data
+    value_mean: float # mean of the (non NaN) resampled values, used to fill NaNs before filtering
+    cycle_period: float # float value (in days)
+
+    # Running sums of the unwrapped phase (in radians) against time (in days since phase_origin), which
+    # give the least squares phase line in closed form
+    phase_origin: pd.Timestamp
+    phase_count: int = 0
+    sum_time: float = 0.0
+    sum_phase: float = 0.0
+    sum_time_squared: float = 0.0
+    sum_time_phase: float = 0.0
+    last_phase_timestamp: Optional[pd.Timestamp] = None # last resampled timestamp included in the sums
+    last_phase: float = 0.0 # unwrapped phase at last_phase_timestamp
+    # Parameters the selected cycle and its phases depend on (see cache.stage_parameters), the state is
+    # rebuilt when any of them change
+    stage_parameters: Optional[dict] = None
+
+
+@dataclass
+class FileResult:
+    """
+    Result of running Rhythmo on a single input file
+    """
+    input_file: str
+    status: str = 'finished' # 'finished', 'skipped' (input not in the correct format) or 'failed'
+    duration: float = 0.0 # seconds taken to run rhythmo and the output handlers
+    error: Optional[str] = None # reason the file was skipped or failed
+    rhythmo_outputs: Optional[RhythmoOutput] = None
+    metrics: List[dict] = field(default_factory=list) # wall time, cpu time and memory of each stage and output handler
@@ -0,0 +1,115 @@
+import cProfile
+import hashlib
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from logger.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# tracemalloc's peak is process-wide, so a peak is only recorded for measurements that no other
+# measurement (e.g. output handlers on the pipeline thread) overlapped
+_TRACE_LOCK = threading.Lock()
+_TRACE_STATE = {'active': 0, 'starts': 0}
+
+
+def max_rss_mb() -> Optional[float]:
+    """Gets the peak resident memory of this process so far, in MB"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return max_rss / 1024 ** 2 if sys.platform == 'darwin' else max_rss / 1024
+
+
+class Instrumentation:
+    """
+    Records the wall time, CPU time and memory of each stage and output handler run on an input.
+
+    Every measurement is logged with its values as structured fields (stage, kind, wall_time,
+    cpu_time, max_rss_mb and, when tracing memory, peak_memory_mb), and kept in records. cpu_time is
+    that of the measuring thread. peak_memory_mb is None for measurements that overlapped another one
+    running on a different thread, as allocations can't be told apart by thread.
+    """
+
+    def __init__(self, context: str, trace_memory: bool = False):
+        """
+        Parameters
+        ----------
+        context: str, the input being run (used as the log context)
+        trace_memory: bool, whether to measure the peak memory allocated within each stage with
+            tracemalloc (slower). Otherwise only the process' peak resident memory is recorded.
+        """
+        self.context = context
+        self.trace_memory = trace_memory
+        self.records: List[dict] = []
+
+    @contextmanager
+    def measure(self, stage: str, kind: str = 'stage'):
+        """Measures the code run within the context as the given stage (or output handler)"""
+        if self.trace_memory:
+            with _TRACE_LOCK:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                overlapped = _TRACE_STATE['active'] > 0
+                if not overlapped:
+                    tracemalloc.reset_peak()
+                started_traced = tracemalloc.get_traced_memory()[0]
+                _TRACE_STATE['active'] += 1
+                _TRACE_STATE['starts'] += 1
+                starts = _TRACE_STATE['starts']
+
+        started_wall = time.perf_counter()
+        started_cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            record = {'stage': stage,
+                      'kind': kind,
+                      'wall_time': time.perf_counter() - started_wall,
+                      'cpu_time': time.thread_time() - started_cpu,
+                      'max_rss_mb': max_rss_mb()}
+            if self.trace_memory:
+                with _TRACE_LOCK:
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                    _TRACE_STATE['active'] -= 1
+                    overlapped = overlapped or _TRACE_STATE['starts'] != starts
+                # Peak above what was already allocated when the stage started
+                record['peak_memory_mb'] = None if overlapped else (peak_memory - started_traced) / 1024 ** 2
+            self.records.append(record)
+            logger.info(f"[{self.context}] {kind} {stage} took {record['wall_time']:.3f}", extra=record)
+
+
+@contextmanager
+def profile(context: str, profile_dir: Optional[str]):
+    """
+    Profiles the code run within the context with cProfile, if profile_dir is given.
+    Stats are saved as profile_dir/<input file name>.<path hash>.prof (viewable with pstats or snakeviz),
+    so inputs with the same name in different folders get their own profile.
+    """
+    if profile_dir is None:
+        yield
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        os.makedirs(profile_dir, exist_ok=True)
+        name = hashlib.sha256(os.path.abspath(context).encode()).hexdigest()[:16]
+        path = os.path.join(profile_dir, f"{os.path.basename(context)}.{name}.prof")
+        profiler.dump_stats(path)
+        logger.info(f"[{context}] Saved profile to {path}")
@@ -1,65 +1,274 @@
+import atexit
 import logging
+import logging.handlers
+import queue
 import threading
 import sys
 import os
-import urllib3  # type: ignore
+import warnings
+from contextlib import contextmanager
 from json_log_formatter import JSONFormatter
 
+# Per-thread log context (e.g. the input file being run), added to every record as 'context'
 ls = threading.local()
 
-# Set logger levels
-LOCAL_LEVEL = logging.DEBUG
-DD_LEVEL = logging.DEBUG
+# Names of loggers created through get_logger, so captured records can be re-emitted
+_LOGGER_NAMES = set()
+# Buffer that collects records while capture_logs is active (e.g. inside a worker process),
+# and the handlers to restore once capturing finishes
+_capture = None
+_saved_handlers = {}
+
+# Levels LOG_LEVEL can be set to
+LOG_LEVELS = ('CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG')
+
+
+def log_level(name: str) -> int:
+    """Gets a logging level by name (in any case), falling back to DEBUG with a warning for unknown names"""
+    level = name.strip().upper()
+    if level == 'WARN':
+        level = 'WARNING'
+    if level not in LOG_LEVELS:
+        warnings.warn(f"Unknown LOG_LEVEL {name!r}, expected one of {', '.join(LOG_LEVELS)}. Using DEBUG")
+        level = 'DEBUG'
+    return getattr(logging, level)
+
+
+# Set logger levels (LOG_LEVEL, e.g. INFO, skips building debug records altogether)
+LOCAL_LEVEL = log_level(os.environ.get('LOG_LEVEL', 'DEBUG'))
+DD_LEVEL = LOCAL_LEVEL
+
+# Most records the writer formats before each write and flush
+MAX_BATCH = 512
+
+# Same as urllib3.disable_warnings(InsecureRequestWarning), without importing urllib3 at startup
+warnings.filterwarnings('ignore', message='Unverified HTTPS request', module='urllib3')
 
 
 class CustomFormatter(JSONFormatter):
     def to_json(self, record):
-        if not hasattr(ls, 'task'):
-            ls.task = None
-
         log = {'app_name': 'risk_algo'}
         log.update(record)
         return super().to_json(log)
 
     def json_record(self, message: str, extra: dict, record: logging.LogRecord) -> dict:
         extra['level'] = record.levelname
-        if '[' in message and ']' in message:
-            context_start = message.index('[')
-            context_end = message.index(']')
-            context = message[context_start + 1:context_end]
-            message = message[context_end + 1:]
-            extra['context'] = context
+        # Messages starting with "[context]" take their context from the message
+        if message.startswith('['):
+            context_end = message.find(']')
+            if context_end > 0:
+                extra['context'] = message[1:context_end]
+                message = message[context_end + 1:]
 
-        return super().json_record(message, extra, record)
+        json_record = super().json_record(message, extra, record)
+        if record.exc_text and not record.exc_info:
+            # Records replayed from worker processes (and queued records) carry the formatted traceback only
+            json_record['exc_info'] = record.exc_text
+        return json_record
 
 
-def get_logger(name: str):
+class ContextFilter(logging.Filter):
+    """Adds the context of the current thread (see log_context) to records that don't have one"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = getattr(ls, 'task', None)
+        if context is not None and not hasattr(record, 'context'):
+            record.context = context
+        return True
+
+
+_CONTEXT_FILTER = ContextFilter()
+
+
+@contextmanager
+def log_context(context: str):
+    """
+    Sets the context (e.g. the input file being run) of every record logged by this thread within the
+    block. Records keep their context when captured in a worker process and replayed by the parent.
+    """
+    previous = getattr(ls, 'task', None)
+    ls.task = context
+    try:
+        yield
+    finally:
+        ls.task = previous
+
+
+def prepare_record(record: logging.LogRecord) -> logging.LogRecord:
+    """
+    Formats the message and traceback of a record in place, so it can be formatted later on another
+    thread or pickled to another process (arguments and tracebacks are not always picklable).
+    """
+    if record.exc_info:
+        record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+    record.msg = record.getMessage()
+    record.args = None
+    return record
+
+
+class LogWriter:
+    """
+    Single background thread that formats and writes queued records through a handler, writing and
+    flushing once per batch of up to MAX_BATCH records rather than once per record.
+    """
+
+    def __init__(self, handler: logging.Handler):
+        self.handler = handler
+        self.queue = queue.SimpleQueue()
+        self.pid = os.getpid()
+        self._thread = threading.Thread(target=self._write, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def _write(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = [self.queue.get()]
+            while len(batch) < MAX_BATCH:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = []
+            for record in batch:
+                if record is None: # queued by stop()
+                    stopping = True
+                    continue
+                if record.levelno >= self.handler.level and self.handler.filter(record):
+                    try:
+                        lines.append(self.handler.format(record) + '\n')
+                    except Exception:
+                        self.handler.handleError(record)
+            if lines:
+                try:
+                    self.handler.stream.write(''.join(lines))
+                    self.handler.flush()
+                except Exception:
+                    self.handler.handleError(batch[-1])
+
+    def stop(self) -> None:
+        """Writes every queued record, then stops the thread"""
+        self.queue.put(None)
+        self._thread.join()
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
     """
-    Creates logger with stream and file handlers for datadog and local use respecively.
+    Queues records for the log writer, so logging never waits on the output stream. Shared by every
+    rhythmo logger.
     """
-    urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-    logger_location = os.environ.get('LOGGER_LOCATION')
 
-    if logger_location == 'local':
+    def __init__(self):
+        super().__init__(None)
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def writer(self) -> LogWriter:
+        """Gets the log writer of this process (a forked process needs its own thread)"""
+        if self._writer is None or self._writer.pid != os.getpid():
+            with self._lock:
+                if self._writer is None or self._writer.pid != os.getpid():
+                    self._writer = LogWriter(_output_handler())
+        return self._writer
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return prepare_record(record)
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        self.writer().queue.put(record)
+
+    def close(self) -> None:
+        """Writes every queued record (called at exit)"""
+        if self._writer is not None and self._writer.pid == os.getpid():
+            self._writer.stop()
+            self._writer = None
+        super().close()
+
+
+def _output_handler() -> logging.Handler:
+    """Creates the handler the log writer writes through: a file for local use, otherwise stdout for datadog"""
+    if os.environ.get('LOGGER_LOCATION') == 'local':
         dir_path = os.path.dirname(os.path.abspath(__file__))
-        file_handler = logging.FileHandler(filename=os.path.join(dir_path, 'dev_output.json'))
-        file_handler.setFormatter(
+        handler = logging.FileHandler(filename=os.path.join(dir_path, 'dev_output.json'))
+        handler.setFormatter(
             logging.Formatter("%(asctime)s - %(levelname)s - %(message)s", datefmt="%H:%M:%S"))
-        file_handler.setLevel(LOCAL_LEVEL)
-        _logger = logging.getLogger(name)
-        _logger.setLevel(LOCAL_LEVEL)
-        _logger.addHandler(file_handler)
-
+        handler.setLevel(LOCAL_LEVEL)
     else:
-        logging.root.handlers = []
-        formatter = CustomFormatter()
-        stream_handler = logging.StreamHandler(stream=sys.stdout)
-        stream_handler.setFormatter(formatter)
-        stream_handler.setLevel(DD_LEVEL)
-        _logger = logging.getLogger(name)
-        _logger.setLevel(logging.DEBUG)
-        _logger.addHandler(stream_handler)
-        _logger.getEffectiveLevel()
-        _logger.propagate = False
+        handler = logging.StreamHandler(stream=sys.stdout)
+        handler.setFormatter(CustomFormatter())
+        handler.setLevel(DD_LEVEL)
+    return handler
+
+
+_QUEUE_HANDLER = QueueLogHandler()
+atexit.register(_QUEUE_HANDLER.close)
+
+
+class RecordBuffer(logging.Handler):
+    """
+    Collects log records in memory so they can be replayed by another process.
+    """
+
+    def __init__(self):
+        super().__init__(logging.DEBUG)
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.records.append(prepare_record(record))
+
+
+@contextmanager
+def capture_logs():
+    """
+    Redirects all rhythmo loggers into an in-memory buffer.
+    Yields the list of captured records, which can be passed to replay_logs.
+    """
+    global _capture  # pylint: disable=global-statement
+    buffer = RecordBuffer()
+    for name in _LOGGER_NAMES:
+        _saved_handlers[name] = logging.getLogger(name).handlers
+        logging.getLogger(name).handlers = [buffer]
+    _capture = buffer
+    try:
+        yield buffer.records
+    finally:
+        _capture = None
+        for name, handlers in _saved_handlers.items():
+            logging.getLogger(name).handlers = handlers
+        _saved_handlers.clear()
+
+
+def replay_logs(records) -> None:
+    """
+    Re-emits records captured by capture_logs through this process' handlers.
+    """
+    for record in records:
+        if record.name not in _LOGGER_NAMES:
+            get_logger(record.name)
+        logging.getLogger(record.name).handle(record)
+
+
+def get_logger(name: str):
+    """
+    Gets a logger whose records are written by the background log writer (to a file for local use, or
+    to stdout for datadog). Calling it again with the same name returns the same logger without adding
+    handlers.
+    """
+    _logger = logging.getLogger(name)
+    if name in _LOGGER_NAMES:
+        return _logger
+
+    logging.root.handlers = []
+    _logger.setLevel(LOCAL_LEVEL if os.environ.get('LOGGER_LOCATION') == 'local' else DD_LEVEL)
+    _logger.propagate = False
+    _logger.addFilter(_CONTEXT_FILTER)
+    _logger.handlers = [_QUEUE_HANDLER]
+
+    if _capture is not None:
+        _saved_handlers.setdefault(name, []).extend(
+            handler for handler in _logger.handlers if handler is not _capture)
+        _logger.handlers = [_capture]
+    _LOGGER_NAMES.add(name)
 
     return _logger
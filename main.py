@@ -1,27 +1,42 @@
+import copy
+import logging
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 from typing import List, Optional
 from importlib import import_module
 
-import pandas as pd
-from logger.logger import get_logger
-from dataclass import Parameters, RhythmoOutput
+from logger.logger import capture_logs, get_logger, log_context, replay_logs
+from dataclass import FileResult, Parameters, RhythmoOutput
+from instrumentation import Instrumentation, profile
 from utils import check_input, read_input, read_json
 
-from process import process
-from decomp import decomp
-from selection import selection
-from track import track
-from project import project
-from forecast import forecast
+from cache import file_hash, open_cache
+from pipeline import OutputPipeline
+
+# The stages (in rhythmo/) and the batch and update modules import pandas, scipy and pycwt, so they are
+# only imported once a run needs them. This keeps the CLI quick to start.
+# pylint: disable=import-outside-toplevel
 
 logger = get_logger(__name__)
 
 STEPS = {"get_frequencies": 1, "track_cycle": 2, "project_cycle": 3, "predict_future_phases": 4}
+# Stages in order, with the first step that needs each of them
+STAGES = [('process', 1), ('decomp', 1), ('selection', 2), ('track', 2), ('project', 3), ('forecast', 4)]
+
+
+def load_stage(name: str):
+    """Imports a stage function by name (each stage is a function of the same name in rhythmo/)"""
+    return getattr(import_module(name), name)
 
 class Run:
 
-    def __init__(self, inputs: List[str], outputs: List[str], parameters: Optional[str]) -> None:
+    def __init__(self, inputs: List[str], outputs: List[str], parameters: Optional[str],
+                 workers: int = 1, trace_memory: bool = False, profile_dir: Optional[str] = None,
+                 profile_inputs: Optional[List[str]] = None, batch: bool = False,
+                 batch_key: Optional[str] = None, cache_dir: Optional[str] = None,
+                 cache_size: float = 1024, pipeline_depth: int = 0, coverage: bool = False,
+                 coverage_dir: Optional[str] = None) -> None:
         """
         Creates a new runtime by reading in arguments from the namespace.
         Validates the arguments.
@@ -29,15 +44,52 @@ class Run:
         Parameters
         ----------
         args: args parsed by Namespace
+        workers: int (default = 1)
+            number of processes used to run input files in parallel
+        trace_memory: bool (default = False)
+            measure the peak memory allocated by each stage and output handler (slower). With workers,
+            each worker process traces its own inputs; in batch mode, the batch is measured as a whole
+        profile_dir: str, optional
+            folder to save a cProfile profile of each input file to
+        profile_inputs: list of str, optional
+            names of the input files to profile (all inputs if not given)
+        batch: bool (default = False)
+            analyse all the series together (stacked along a batch axis) rather than file by file
+        batch_key: str, optional
+            column identifying the subject (or channel) of each row of long-format inputs (implies batch)
+        cache_dir: str, optional
+            folder to cache the outputs of each stage in, so unchanged inputs and stages are not rerun
+        cache_size: float (default = 1024)
+            maximum size of the cache in MB (least recently used outputs are removed first)
+        pipeline_depth: int (default = 0)
+            if above 0, output handlers run on a background thread while the next input is analysed,
+            with at most this many inputs waiting for their output handlers
+        coverage: bool (default = False)
+            keep a coverage index of each input (days and bins with data), built the first time the input
+            is read, so inputs with insufficient data are skipped on later runs without loading them
+        coverage_dir: str, optional
+            folder to keep the coverage indexes in (implies coverage), otherwise next to each input
         """
-        logger.debug(
-            f"Inputs: data inputs(first 5) {inputs[:5]} outputs: {outputs}"
-            f"Parameters files: {parameters}")  # log_revert
+        logger.debug("Inputs: data inputs(first 5) %s outputs: %s Parameters files: %s workers: %s",
+                     inputs[:5], outputs, parameters, workers)  # log_revert
 
         self.inputs = inputs
+        self.workers = max(1, workers)
+        self.trace_memory = trace_memory
+        self.profile_dir = profile_dir
+        self.profile_inputs = profile_inputs
+        self.batch = batch or batch_key is not None
+        self.batch_key = batch_key
+        self.cache = open_cache(cache_dir, cache_size)
+        self.pipeline_depth = pipeline_depth
+        self.coverage = coverage or coverage_dir is not None
+        self.coverage_dir = coverage_dir
         self.outputs = list(filter(None, (Run.get_handler(handler_name) for handler_name in outputs)))
         self.parameters = Run.get_parameters(parameters)
         self.step = max([STEPS[output] for output in outputs])
+        if self.pipeline_depth > 0 and (self.batch or self.workers > 1):
+            logger.warning("Output handlers only run on a pipeline thread when inputs are run one at a time, "
+                           "ignoring the pipeline depth with workers or batch")
 
         # If input is a directory not a filename, get all possible data files in the directory
         if len(self.inputs) == 1:
@@ -95,7 +147,7 @@ class Run:
         default = Parameters()
 
         if parameters_file is None:
-            return default()
+            return default
 
         # Load specified json
         try:
@@ -105,82 +157,450 @@ class Run:
             raise e
 
         # update parameters
-        updated = default()
+        updated = default
         for key in new_params:
             updated.__dict__[key] = new_params[key]
 
         return updated
 
 
-    def run(self) -> None:
+    def run(self) -> List[FileResult]:
         """
         Runs Rythmo.
+
+        Input files are run one at a time, or across a pool of processes when more than one
+        worker is requested. Each file is isolated, so a failure does not stop the others.
+
+        Returns
+        -------
+        List of FileResult, one per input file in the order of self.inputs
         """
 
         if not self.inputs:
             logger.error('Aborting rhythmo - no data inputs specified', exc_info=True)
-            return
+            return []
 
         # Print parameters that are being used
-        logger.debug(f"Parameters: {self.parameters}")
+        logger.debug("Parameters: %s", self.parameters)
 
         overall_start = time.perf_counter()
 
-        for input_file in self.inputs:
-            started = time.perf_counter()
-            logger.info(f"[{input_data}] START rhythmo (S000)")
+        if self.batch:
+            results = self._run_batch()
+        elif self.workers > 1 and len(self.inputs) > 1:
+            results = self._run_parallel()
+        else:
+            results = self._run_sequential()
+
+        logger.debug("Finished running rhythmo in %s secs", time.perf_counter() - overall_start)
+        return results
+
+    def _run_sequential(self) -> List[FileResult]:
+        """
+        Runs the input files one at a time. With a pipeline depth, the output handlers of each file run
+        on a background thread while the next file is analysed, and every pending handler is finished
+        before returning. Files whose output handlers failed are marked as failed.
+        """
+        if self.pipeline_depth <= 0:
+            return [self._run_file(input_file) for input_file in self.inputs]
+
+        results = []
+        job_indices = [] # index of the output handler job of each file on the pipeline, if one was submitted
+        with OutputPipeline(self.pipeline_depth) as pipeline:
+            for input_file in self.inputs:
+                submitted = pipeline.submitted
+                results.append(self._run_file(input_file, pipeline))
+                job_indices.append(submitted if pipeline.submitted > submitted else None)
+
+        for result, index in zip(results, job_indices):
+            if index in pipeline.errors:
+                result.status = 'failed'
+                result.error = pipeline.errors[index]
+        return results
+
+    def _run_parallel(self) -> List[FileResult]:
+        """
+        Runs the input files on a process pool. Logs from each worker are buffered per file
+        and replayed in input order, so the output reads the same as a sequential run.
+        """
+        logger.info(f"Running {len(self.inputs)} inputs on {self.workers} workers")
+
+        # Each worker gets the runtime once, without the inputs, and each task only its input file
+        runtime = copy.copy(self)
+        runtime.inputs = []
+
+        results = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                 initargs=(runtime, self.workers)) as executor:
+            futures = [executor.submit(_run_file_captured, input_file) for input_file in self.inputs]
+
+            for input_file, future in zip(self.inputs, futures):
+                try:
+                    result, records = future.result()
+                except Exception as e:
+                    # The worker itself died (e.g. killed for memory), so there are no logs to replay
+                    logger.error(f"[{input_file}] Worker failed to run Rhythmo due to: {e}",
+                                 exc_info=True)
+                    result, records = FileResult(input_file, status='failed', error=str(e)), []
+
+                replay_logs(records)
+                results.append(result)
 
-            # Open input data
-            input_data = read_input(input_file)
-            logger.debug(f"Opened input data from {input_file}")
+        return results
 
-            # Check input data
-            if not check_input(input_data):
-                logger.warning(
-                    f'[{input_file}] Skipping input - Not in correct format'
-                    '(E001)', exc_info=True)
+    def _run_batch(self) -> List[FileResult]:
+        """
+        Runs every series of the inputs (one per input file, or one per batch_key value) as a batch,
+        then the output handlers for each series.
+
+        Returns
+        -------
+        List of FileResult, one per series (named "<input file>[<key>]" for long-format inputs)
+        """
+        from batch import read_batch, run_batch
+
+        started = time.perf_counter()
+        instrumentation = Instrumentation('batch', self.trace_memory)
+        logger.info(f"[batch] START rhythmo batch of {len(self.inputs)} inputs (S002)")
+
+        try:
+            with instrumentation.measure('read_input'):
+                series = read_batch(self.inputs, self.batch_key)
+            with instrumentation.measure('batch'):
+                batch_outputs = run_batch(series, self.parameters)
+            if self.step >= STEPS['predict_future_phases']:
+                # Future phase times from the projected phases, as a run of each file would
+                forecast = load_stage('forecast')
+                with instrumentation.measure('forecast'):
+                    batch_outputs = {subject: None if rhythmo_outputs is None else
+                                     forecast(series[subject], rhythmo_outputs, self.parameters)
+                                     for subject, rhythmo_outputs in batch_outputs.items()}
+        except Exception as e:
+            logger.error(f"[batch] Failed to finish Rhythmo batch due to: {e}", exc_info=True)
+            return [FileResult(input_file, status='failed', duration=time.perf_counter() - started,
+                               error=str(e), metrics=instrumentation.records) for input_file in self.inputs]
+
+        results = []
+        for subject, rhythmo_outputs in batch_outputs.items():
+            if rhythmo_outputs is None:
+                results.append(FileResult(subject, status='skipped', error='Insufficient data'))
+                continue
+
+            subject_instrumentation = Instrumentation(subject, self.trace_memory)
+            try:
+                with log_context(subject):
+                    self._run_output_handlers(series[subject], rhythmo_outputs, subject_instrumentation)
+            except Exception as e:
+                logger.error(f"[{subject}] Failed to run output handlers due to: {e}", exc_info=True)
+                results.append(FileResult(subject, status='failed', error=str(e),
+                                          rhythmo_outputs=rhythmo_outputs,
+                                          metrics=subject_instrumentation.records))
                 continue
+            results.append(FileResult(subject, rhythmo_outputs=rhythmo_outputs,
+                                      metrics=subject_instrumentation.records))
+
+        logger.info(f"[batch] FINISH Rhythmo batch of {len(results)} series in "
+                    f"{time.perf_counter() - started:.3f}")
+        return results
+
+    def _should_profile(self, input_file: str) -> bool:
+        """Whether the input file was selected for profiling"""
+        if self.profile_dir is None:
+            return False
+        return not self.profile_inputs or os.path.basename(input_file) in self.profile_inputs
 
-            # Drop all columns except timestamp and value
-            rhythmo_inputs = input_data.drop(columns = [col for col in input_data.columns if col not in ['timestamp', 'value']])
+    def _run_file(self, input_file: str, pipeline: Optional[OutputPipeline] = None,
+                  input_data=None) -> FileResult:
+        """
+        Runs rhythmo and the output handlers on a single input file. With a pipeline, the output
+        handlers are queued on it rather than run before returning. The input file is only read if
+        its data is not given.
+        """
+
+        with log_context(input_file):
+            started = time.perf_counter()
+            logger.info(f"[{input_file}] START rhythmo (S000)")
+            instrumentation = Instrumentation(input_file, self.trace_memory)
 
             try:
-                rhythmo_outputs = self._run_rhythmo(rhythmo_inputs)
-                logger.info(f"[{input_file}] Initiating output handlers.")
-                self._run_output_handlers(rhythmo_inputs, rhythmo_outputs)
+                with profile(input_file, self.profile_dir if self._should_profile(input_file) else None):
+                    return self._run_file_stages(input_file, started, instrumentation, pipeline, input_data)
 
-                logger.info(f"[{input_file}] FINISH Rhythmo in "
-                            f"{time.perf_counter() - started:.3f}")
             except Exception as e:
                 logger.error(f"[{input_file}] Failed to finish Rhythmo due to: {e}",
                              exc_info=True)
+                return FileResult(input_file, status='failed', duration=time.perf_counter() - started,
+                                  error=str(e), metrics=instrumentation.records)
+
+    def _run_file_stages(self, input_file: str, started: float, instrumentation: Instrumentation,
+                         pipeline: Optional[OutputPipeline] = None, input_data=None) -> FileResult:
+        """Reads an input file (unless its data is given), then runs rhythmo and the output handlers on it"""
+
+        # Skip inputs whose coverage index shows insufficient data, without loading them
+        coverage = None
+        if self.coverage:
+            from coverage_index import load_coverage
+            with instrumentation.measure('read_coverage'):
+                coverage = load_coverage(input_file, self.coverage_dir)
+            if coverage is not None and self._insufficient_coverage(input_file, coverage):
+                return FileResult(input_file, status='skipped', error='Insufficient data',
+                                  duration=time.perf_counter() - started, metrics=instrumentation.records)
+
+        # Open input data
+        if input_data is None:
+            with instrumentation.measure('read_input'):
+                input_data = read_input(input_file)
+            logger.debug("Opened input data from %s", input_file)
+
+        # Check input data
+        if not check_input(input_data):
+            logger.warning(
+                f'[{input_file}] Skipping input - Not in correct format'
+                '(E001)', exc_info=True)
+            return FileResult(input_file, status='skipped', error='Not in correct format',
+                              metrics=instrumentation.records)
+
+        # Drop all columns except timestamp and value (without copying inputs that only have those,
+        # e.g. memory-mapped .rhy files)
+        extra_columns = [col for col in input_data.columns if col not in ['timestamp', 'value']]
+        rhythmo_inputs = input_data.drop(columns = extra_columns) if extra_columns else input_data
+
+        if self.coverage and coverage is None:
+            from coverage_index import build_coverage, save_coverage
+            with instrumentation.measure('build_coverage'):
+                coverage = build_coverage(rhythmo_inputs)
+                save_coverage(input_file, coverage, self.coverage_dir)
+            if self._insufficient_coverage(input_file, coverage):
+                return FileResult(input_file, status='skipped', error='Insufficient data',
+                                  duration=time.perf_counter() - started, metrics=instrumentation.records)
+
+        input_hash = None
+        if self.cache is not None:
+            with instrumentation.measure('hash_input'):
+                input_hash = file_hash(input_file)
+
+        rhythmo_outputs = self._run_rhythmo(rhythmo_inputs, instrumentation, input_hash)
+        if rhythmo_outputs is None:
+            return FileResult(input_file, status='skipped', error='Insufficient data',
+                              duration=time.perf_counter() - started, metrics=instrumentation.records)
+
+        if pipeline is not None:
+            # Handler metrics are added to instrumentation.records (and so the result) once they run
+            logger.info(f"[{input_file}] Queueing output handlers.")
+            pipeline.submit(input_file, lambda: self._run_output_handlers(rhythmo_inputs, rhythmo_outputs,
+                                                                          instrumentation))
+        else:
+            logger.info(f"[{input_file}] Initiating output handlers.")
+            self._run_output_handlers(rhythmo_inputs, rhythmo_outputs, instrumentation)
+
+        duration = time.perf_counter() - started
+        logger.info(f"[{input_file}] FINISH Rhythmo in {duration:.3f}")
+        if logger.isEnabledFor(logging.DEBUG):
+            from wavelet import cache_report
+            logger.debug("[%s] Wavelet cache usage: %s", input_file, cache_report())
+        return FileResult(input_file, duration=duration, rhythmo_outputs=rhythmo_outputs,
+                          metrics=instrumentation.records)
+
+    def _insufficient_coverage(self, input_file: str, coverage: dict) -> bool:
+        """Checks the coverage index of an input for insufficient data at the resampling rate"""
+        from coverage_index import sufficient_coverage
+
+        if sufficient_coverage(coverage, self.parameters.data_resampling_rate) is False:
+            logger.warning(f"[{input_file}] Skipping input - Insufficient data (coverage index)")
+            return True
+        return False
+
+    def update(self, state_dir: str, full_inputs: bool = False) -> List[FileResult]:
+        """
+        Updates the predicted future phases of each input from the rows appended since its last run.
 
-        logger.debug(f"Finished running rhythmo in {time.perf_counter() - overall_start} secs")
+        A state per input (resampled data, NaN counts and the phase line of the selected cycle) is saved
+        in state_dir. Inputs without a saved state, or whose cycle period has drifted, are run in full
+        and their state is rebuilt. The state tracks the strongest cycle only, so every input is run in
+        full when more than one cycle is tracked (number_of_cycles).
 
-    def _run_rhythmo(self, rhythmo_inputs):
-        """Runs rhythmo and returns the outputs"""
+        Parameters
+        ----------
+        state_dir: str
+            folder to keep the state of each input in
+        full_inputs: bool (default = False)
+            give the output handlers of updated inputs the full input, as in a full run (read again
+            after the update), rather than only the rows read for the update
 
-        rhythmo_outputs = RhythmoOutput.build_empty()
+        Returns
+        -------
+        List of FileResult, one per input file in the order of self.inputs
+        """
+        if not self.inputs:
+            logger.error('Aborting rhythmo update - no data inputs specified', exc_info=True)
+            return []
 
-        rhythmo_outputs = process(rhythmo_inputs, rhythmo_outputs, self.parameters)
-        rhythmo_outputs = decomp(rhythmo_inputs, rhythmo_outputs, self.parameters)
-        if self.step == 1:
-            return rhythmo_outputs
+        os.makedirs(state_dir, exist_ok=True)
+        results = []
+        for input_file in self.inputs:
+            with log_context(input_file):
+                results.append(self._update_file(input_file, state_dir, full_inputs))
+        return results
 
-        rhythmo_outputs = selection(rhythmo_inputs, rhythmo_outputs, self.parameters)
-        rhythmo_outputs = track(rhythmo_inputs, rhythmo_outputs, self.parameters)
-        if self.step == 2:
-            return rhythmo_outputs
+    def sweep(self, grid):
+        """
+        Runs every variant of a grid of parameter overrides on each input. Each stage is computed once
+        per distinct set of the parameters it (and the stages before it) depends on, and its outputs are
+        shared by the variants that need them, e.g. the data is resampled once per resampling rate.
 
-        rhythmo_outputs = project(rhythmo_inputs, rhythmo_outputs, self.parameters)
-        if self.step == 3:
-            return rhythmo_outputs
+        Parameters
+        ----------
+        grid: dict of parameter name to the list of values to try (every combination is run), or a list
+            of dicts of overrides (one per variant). Parameters not in the grid keep their value from the
+            parameters file
+
+        Returns
+        -------
+        dataframe comparing the variants, with one row per (input file, variant), or None without inputs
+        """
+        from sweep import run_sweep
+
+        if not self.inputs:
+            logger.error('Aborting rhythmo sweep - no data inputs specified', exc_info=True)
+            return None
+        return run_sweep(self.inputs, self.parameters, grid, self.step)
 
-        rhythmo_outputs = forecast(rhythmo_inputs, rhythmo_outputs, self.parameters)
+    def _update_file(self, input_file: str, state_dir: str, full_inputs: bool = False) -> FileResult:
+        """Updates a single input file from its saved state, falling back to a full run"""
+
+        from update import (build_state, future_phases, load_state, matches_parameters, save_state, state_path,
+                            update_state)
+
+        started = time.perf_counter()
+        path = state_path(state_dir, input_file)
+        instrumentation = Instrumentation(input_file, self.trace_memory)
+
+        try:
+            # The saved state tracks the strongest cycle only
+            state = load_state(path) if self.parameters.number_of_cycles == 1 else None
+            if state is not None and not matches_parameters(state, self.parameters):
+                logger.info(f"[{input_file}] Parameters changed since the state was saved")
+                state = None
+            if state is not None:
+                logger.info(f"[{input_file}] START rhythmo update (S001)")
+
+                # Only read the rows from the start of the last resampled bin
+                last_bin_start = state.resampled_data['timestamp'].iloc[-1].value // 10 ** 6
+                with instrumentation.measure('read_input'):
+                    new_rows = read_input(input_file, start=last_bin_start)
+                check_input(new_rows)
+
+                with instrumentation.measure('update'):
+                    updated = update_state(state, new_rows, self.parameters)
+                if updated:
+                    rhythmo_outputs = RhythmoOutput(resampled_data=state.resampled_data,
+                                                    cycle_period=state.cycle_period,
+                                                    cycle_periods=[state.cycle_period],
+                                                    future_phases=future_phases(state, self.parameters),
+                                                    notes='Updated from saved state')
+                    if self.step >= STEPS['predict_future_phases']:
+                        with instrumentation.measure('forecast'):
+                            rhythmo_outputs = load_stage('forecast')(new_rows, rhythmo_outputs, self.parameters)
+                    save_state(state, path)
+
+                    if self.outputs:
+                        # Output handlers get the rows read for the update, unless they need the full input
+                        rhythmo_inputs = new_rows
+                        if full_inputs:
+                            with instrumentation.measure('read_input'):
+                                rhythmo_inputs = read_input(input_file)
+                        self._run_output_handlers(rhythmo_inputs, rhythmo_outputs, instrumentation)
+
+                    duration = time.perf_counter() - started
+                    logger.info(f"[{input_file}] FINISH Rhythmo update in {duration:.3f}")
+                    return FileResult(input_file, duration=duration, rhythmo_outputs=rhythmo_outputs,
+                                      metrics=instrumentation.records)
+
+                logger.info(f"[{input_file}] Saved state can't be updated, running on the full history")
+
+            # The full history is read once, for both the full run and the new state
+            with instrumentation.measure('read_input'):
+                input_data = read_input(input_file)
+
+        except Exception as e:
+            logger.error(f"[{input_file}] Failed to update Rhythmo due to: {e}", exc_info=True)
+            return FileResult(input_file, status='failed', duration=time.perf_counter() - started,
+                              error=str(e))
+
+        result = self._run_file(input_file, input_data=input_data)
+        result.metrics[:0] = instrumentation.records
+        if result.status != 'finished':
+            return result
+
+        cycle_period = result.rhythmo_outputs.cycle_period or self.parameters.cycle_period
+        if cycle_period is None:
+            logger.warning(f"[{input_file}] No cycle period selected, state not saved")
+            return result
+
+        try:
+            save_state(build_state(input_data, cycle_period, self.parameters), path)
+        except Exception as e:
+            logger.error(f"[{input_file}] Failed to save state due to: {e}", exc_info=True)
+        return result
+
+    def _run_rhythmo(self, rhythmo_inputs, instrumentation: Instrumentation, input_hash: Optional[str] = None):
+        """
+        Runs rhythmo and returns the outputs.
+
+        With a result cache and the hash of the input, the outputs of the last cached stage are loaded
+        and only the stages after it are run. The outputs of every stage that is run are cached.
+        Returns None if a stage found insufficient data.
+        """
+
+        stages = [(name, load_stage(name)) for name, step in STAGES if step <= self.step]
+        rhythmo_outputs = RhythmoOutput.build_empty()
+        use_cache = self.cache is not None and input_hash is not None
+
+        first_stage = 0
+        if use_cache:
+            for i in reversed(range(len(stages))):
+                cached = self.cache.get(self.cache.stage_key(input_hash, self.parameters, stages[i][0]))
+                if cached is not None:
+                    logger.info(f"[{instrumentation.context}] Using cached outputs up to {stages[i][0]}")
+                    rhythmo_outputs = cached
+                    first_stage = i + 1
+                    break
+
+        for name, stage in stages[first_stage:]:
+            with instrumentation.measure(name):
+                rhythmo_outputs = stage(rhythmo_inputs, rhythmo_outputs, self.parameters)
+            if rhythmo_outputs is None:
+                # The stage found insufficient data, so there is nothing for the later stages
+                return None
+            if use_cache:
+                self.cache.put(self.cache.stage_key(input_hash, self.parameters, name), rhythmo_outputs)
 
         return rhythmo_outputs
 
-    def _run_output_handlers(self, rhythmo_inputs, rhythmo_outputs):
+    def _run_output_handlers(self, rhythmo_inputs, rhythmo_outputs, instrumentation: Instrumentation):
         """Runs output handlers for a given set of inputs/outputs and metrics"""
         for handler in self.outputs:
-            handler(rhythmo_inputs, rhythmo_outputs, self.parameters)
+            with instrumentation.measure(handler.__module__.split('.')[-1], kind='output_handler'):
+                handler(rhythmo_inputs, rhythmo_outputs, self.parameters)
+
+
+# Runtime of each worker process of a parallel run, set once by _init_worker and reused for every file
+_RUNTIME = None
+
+
+def _init_worker(runtime: Run, workers: int) -> None:
+    """Keeps the runtime of a worker process, and gives the worker its share of the wavelet kernel cache"""
+    global _RUNTIME  # pylint: disable=global-statement
+    from wavelet import share_kernel_cache
+    _RUNTIME = runtime
+    share_kernel_cache(workers)
+
+
+def _run_file_captured(input_file: str):
+    """
+    Runs a single input file inside a worker process (with the runtime from _init_worker), returning
+    its result together with the log records it produced so the parent can replay them in order.
+    """
+    with capture_logs() as records:
+        result = _RUNTIME._run_file(input_file)  # pylint: disable=protected-access
+    return result, records
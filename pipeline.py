@@ -0,0 +1,77 @@
+import queue
+import threading
+from typing import Callable, Dict
+
+from logger.logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+_STOP = object() # queued by close() after the last job
+
+
+class OutputPipeline:
+    """
+    Runs jobs (the output handlers of an input) on a background thread, so that writing the outputs of
+    one input overlaps with the analysis of the next.
+
+    At most depth jobs wait in the queue: submit blocks while it is full, so the analysis can't run
+    further ahead of the output handlers than that (and hold every pending output in memory). Jobs run
+    in the order they were submitted. close() (or leaving the with block) waits for every pending job,
+    and the error of each job that failed is kept in errors, by the index the job was submitted at (so
+    jobs for the same input file are kept apart).
+    """
+
+    def __init__(self, depth: int):
+        """
+        Parameters
+        ----------
+        depth: int, maximum number of jobs waiting to run
+        """
+        self.errors: Dict[int, str] = {}
+        self.submitted = 0 # number of jobs submitted, and the index of the next one
+        self._queue = queue.Queue(maxsize=max(1, depth))
+        self._thread = threading.Thread(target=self._work, name='output-pipeline', daemon=True)
+        self._closed = False
+        self._thread.start()
+
+    def submit(self, input_file: str, job: Callable[[], None]) -> int:
+        """Queues a job for an input, waiting while the queue is full, and returns its index"""
+        if self._closed:
+            raise RuntimeError("Output pipeline is closed")
+        index = self.submitted
+        self._queue.put((index, input_file, job))
+        self.submitted += 1
+        return index
+
+    def close(self) -> Dict[int, str]:
+        """
+        Waits for every queued job to finish, then stops the thread
+
+        Returns
+        -------
+        dict of the index of each job that failed (see submit) to its error
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(_STOP)
+            self._thread.join()
+        return self.errors
+
+    def _work(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            index, input_file, job = item
+            try:
+                with log_context(input_file):
+                    job()
+            except Exception as e:
+                logger.error(f"[{input_file}] Failed to run output handlers due to: {e}", exc_info=True)
+                self.errors[index] = str(e)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
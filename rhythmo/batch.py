@@ -0,0 +1,329 @@
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pycwt as cwt # continuous wavelet spectral analysis
+from scipy.signal import find_peaks, peak_prominences
+
+from dataclass import RhythmoOutput
+from decomp import ALPHA_DECIMALS, wavelet_periods
+from process import longest_valid_segment
+from project import get_phases, get_phases_future, predict_cycle, projection_horizon
+from track import chunked_cycle_filter, rescale
+from utils import INPUT_COLUMNS, read_input
+from wavelet import global_wavelet_power, significance
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+DAY = pd.Timedelta(days=1)
+# Maximum proportion of NaNs in the whole series before the longest valid segment is looked for
+MAX_PROPORTION_NANS = 0.3
+# Selection methods that only need the global wavelet power
+BATCH_SELECTION_METHODS = ('prominence', 'power', 'relative_power')
+
+
+def read_batch(inputs: List[str], batch_key: Optional[str] = None) -> Dict[str, pd.DataFrame]:
+    """
+    Reads the series of every subject (or channel) in the inputs
+
+    Parameters
+    ------------
+    inputs: list of str
+        input files. Each file is one subject, unless batch_key is given
+    batch_key: str, optional
+        column of long-format inputs identifying the subject (or channel) of each row
+
+    Returns
+    -------
+    dict of subject name ("<input file>" or "<input file>[<key>]") to a dataframe with columns:
+    timestamp (milliseconds since epoch) and value
+    """
+    series = {}
+    for input_file in inputs:
+        if batch_key is None:
+            series[input_file] = read_input(input_file)
+            continue
+
+        data = read_input(input_file, columns=INPUT_COLUMNS + [batch_key])
+        for key, rows in data.groupby(batch_key, sort=False):
+            series[f"{input_file}[{key}]"] = rows[INPUT_COLUMNS].reset_index(drop=True)
+    return series
+
+
+def resample_batch(series: Dict[str, pd.DataFrame], data_resampling_rate: str):
+    """
+    Resamples every series at once, and stacks the series with the same number of samples.
+
+    Bins start at midnight of each series' first day, as in pandas resample, and the resampled value
+    is the mean of the (non NaN) values in each bin, from one bincount over all the series.
+
+    Parameters
+    ------------
+    series: dict of subject name to a dataframe with columns: timestamp (milliseconds) and value
+    data_resampling_rate: str
+        e.g. '1H' (must divide a day)
+
+    Returns
+    -------
+    list of (subjects, starts, values), one per number of samples:
+        subjects: list of subject names
+        starts: array of datetime64, first resampled timestamp of each subject
+        values: 2D array of float, subjects x samples (NaN in bins without data)
+    """
+    subjects = [subject for subject, data in series.items() if len(data)]
+    if not subjects:
+        return []
+
+    rate = pd.Timedelta(data_resampling_rate).value
+    lengths = np.array([len(series[subject]) for subject in subjects])
+    codes = np.repeat(np.arange(len(subjects)), lengths)
+    timestamps = np.concatenate([series[subject]['timestamp'].to_numpy(dtype=np.int64)
+                                 for subject in subjects]) * 10 ** 6 # nanoseconds
+    values = np.concatenate([series[subject]['value'].to_numpy(dtype=float) for subject in subjects])
+
+    # Bin of every row, counted from midnight of the first day of its series
+    first_day = np.full(len(subjects), np.iinfo(np.int64).max)
+    np.minimum.at(first_day, codes, timestamps)
+    first_day = first_day - first_day % DAY.value
+    bins = (timestamps - first_day[codes]) // rate
+    first_bin = np.full(len(subjects), np.iinfo(np.int64).max)
+    last_bin = np.zeros(len(subjects), dtype=np.int64)
+    np.minimum.at(first_bin, codes, bins)
+    np.maximum.at(last_bin, codes, bins)
+    num_bins = last_bin - first_bin + 1
+
+    # Means of every bin of every series, laid out one series after the other
+    offsets = np.concatenate(([0], np.cumsum(num_bins)))
+    flat_bins = offsets[codes] + bins - first_bin[codes]
+    has_value = ~np.isnan(values)
+    sums = np.bincount(flat_bins[has_value], weights=values[has_value], minlength=offsets[-1])
+    counts = np.bincount(flat_bins[has_value], minlength=offsets[-1])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+
+    starts = (first_day + first_bin * rate).astype('datetime64[ns]')
+    groups = []
+    for length in np.unique(num_bins):
+        rows = np.flatnonzero(num_bins == length)
+        groups.append(([subjects[row] for row in rows],
+                       starts[rows],
+                       np.stack([means[offsets[row]:offsets[row + 1]] for row in rows])))
+    return groups
+
+
+def sufficient_segment(timestamps, values):
+    """
+    Gets the rows (start, end inclusive) to use for a resampled series, with the same rules as
+    check_sufficient_data: the whole series if it has at most 30% NaNs, otherwise the longest segment
+    over 90 days with at most 30% NaNs. Returns None if there is no such segment.
+    """
+    is_nan = np.isnan(values)
+    if is_nan.mean() <= MAX_PROPORTION_NANS:
+        return 0, len(values) - 1
+    start, end = longest_valid_segment(timestamps, is_nan)
+    if start == end:
+        return None
+    return start, end
+
+
+def select_cycles(glbl_power, glbl_signif, periods, method: str):
+    """
+    Selects the strongest peak of the global wavelet power of each subject
+
+    Parameters
+    ------------
+    glbl_power: 2D array of float
+        subjects x periods global wavelet power (scaled by the variance)
+    glbl_signif: 2D array of float
+        subjects x periods significance levels of the global wavelet power
+    periods: array of float
+        periods of the global wavelet power (in days)
+    method: str
+        'prominence', 'power' or 'relative_power'
+
+    Returns
+    -------
+    cycle_periods: array of float
+        period of the strongest peak of each subject (NaN if there are no peaks)
+    peaks: 2D array of int
+        subjects x periods, 1 at every peak of the global wavelet power
+    """
+    cycle_periods = np.full(len(glbl_power), np.nan)
+    peaks = np.zeros(glbl_power.shape, dtype=int)
+    for row, power in enumerate(glbl_power):
+        ind_peaks = find_peaks(power)[0]
+        if len(ind_peaks) == 0:
+            continue
+        peaks[row, ind_peaks] = 1
+
+        if method == 'prominence':
+            strength = peak_prominences(power, ind_peaks)[0]
+        elif method == 'relative_power':
+            strength = (power - glbl_signif[row])[ind_peaks]
+        else:
+            strength = power[ind_peaks]
+        cycle_periods[row] = periods[ind_peaks[np.argmax(strength)]]
+    return cycle_periods, peaks
+
+
+def analyse_batch(subjects: List[str], starts, values, parameters) -> Dict[str, RhythmoOutput]:
+    """
+    Runs the wavelet transform, cycle selection, bandpass filtering and phase extraction on a stack
+    of resampled series with the same number of samples, as operations along the subject axis.
+
+    Every series is standardised and NaN filled as in process, and the wavelet transform uses the
+    period grid of decomp (parameters.period_grid, see wavelet_periods), shared by the stack: the
+    adaptive grid is refined around the peaks of every series. Cycles are selected by
+    parameters.cycle_selection_method from the global wavelet power ('segment_power' needs the power
+    over time and is replaced by 'prominence'), unless parameters.cycle_period is set. The series with
+    the same cycle period are filtered and their phases taken together, with the helpers (and so the
+    outputs) of track and project.
+
+    Parameters
+    ------------
+    subjects: list of str
+        subject names
+    starts: array of datetime64
+        first resampled timestamp of each subject
+    values: 2D array of float
+        subjects x samples resampled values
+    parameters: Parameters
+
+    Returns
+    -------
+    dict of subject name to RhythmoOutput (None for subjects with insufficient data)
+    """
+    outputs = {}
+    rate = pd.Timedelta(parameters.data_resampling_rate)
+    samples_per_day = DAY / rate
+    num_samples = values.shape[1]
+    offsets = np.arange(num_samples) * rate.value
+
+    # Sufficient data, with the same rules as process
+    segments = {}
+    for row, subject in enumerate(subjects):
+        segment = sufficient_segment(starts[row] + offsets, values[row])
+        if segment is None:
+            logger.error(f"[{subject}] Insufficient data for Rhythmo.")
+            outputs[subject] = None
+        else:
+            segments[row] = segment
+    rows = np.array(sorted(segments), dtype=int)
+    if len(rows) == 0:
+        return outputs
+
+    # Standardise and interpolate, as data_standardize and data_interpolate
+    raw = values[rows]
+    standardised = (raw - np.nanmean(raw, axis=1, keepdims=True)) / np.nanstd(raw, axis=1, ddof=1, keepdims=True)
+    standardised = np.where(np.isnan(standardised), np.nanmean(standardised, axis=1, keepdims=True), standardised)
+
+    # Wavelet transform of all subjects, at the periods of decomp (in days)
+    dt = 1 / samples_per_day
+    data_duration = (num_samples - 1) * dt / 3
+    periods = wavelet_periods(standardised, dt, data_duration, parameters)
+    if len(periods) < 3:
+        for row in rows:
+            logger.error(f"[{subjects[row]}] Recording too short for the wavelet transform.")
+            outputs[subjects[row]] = None
+        return outputs
+
+    glbl_power, scales = global_wavelet_power(standardised, dt, 1 / periods, parameters.wavelet_waveform)
+    variances = standardised.std(axis=1) ** 2
+    glbl_power *= variances[:, np.newaxis]
+    glbl_signif = np.stack([
+        significance(variance, dt, scales, 1, cwt.ar1(signal)[0], significance_level=0.95,
+                     dof=num_samples - scales, waveform=parameters.wavelet_waveform,
+                     alpha_decimals=ALPHA_DECIMALS)[0]
+        for signal, variance in zip(standardised, variances)])
+
+    # Cycle selection
+    method = parameters.cycle_selection_method.replace(' ', '_')
+    if method not in BATCH_SELECTION_METHODS:
+        logger.warning(f"Cycle selection method {parameters.cycle_selection_method} is not supported "
+                       f"in batch mode, using prominence")
+        method = 'prominence'
+    cycle_periods, peaks = select_cycles(glbl_power, glbl_signif, periods, method)
+    if parameters.cycle_period is not None:
+        cycle_periods[:] = parameters.cycle_period
+
+    # Bandpass filter the subjects with the same cycle period together (in blocks, as track), rescaled to
+    # the range of their best segment before it was standardised, then take their phases around the mean
+    # of the rescaled cycle (as project)
+    has_cycle = ~np.isnan(cycle_periods)
+    filtered = np.full(standardised.shape, np.nan)
+    phases = np.full(standardised.shape, np.nan)
+    for cycle_period in np.unique(cycle_periods[has_cycle]):
+        same_period = np.flatnonzero(cycle_periods == cycle_period)
+        cycles = chunked_cycle_filter(standardised[same_period],
+                                      cycle_period * samples_per_day,
+                                      parameters.bandpass_cutoff_percentage,
+                                      fs=1,
+                                      order=2)
+
+        # For reversing the normalising. min and max skip the NaNs
+        best_segments = [values[rows[i], segments[rows[i]][0]:segments[rows[i]][1] + 1] for i in same_period]
+        filtered[same_period] = rescale(cycles, np.array([np.nanmin(segment) for segment in best_segments]),
+                                        np.array([np.nanmax(segment) for segment in best_segments]), axis=1)
+
+        centred = filtered[same_period] - filtered[same_period].mean(axis=1, keepdims=True)
+        phases[same_period] = get_phases(centred, cycle_period * samples_per_day)
+
+    for i, row in enumerate(rows):
+        subject = subjects[row]
+        timestamps = pd.DatetimeIndex(starts[row] + offsets)
+        start, end = segments[row]
+
+        rhythmo_outputs = RhythmoOutput(
+            resampled_data=pd.DataFrame({'timestamp': timestamps, 'value': standardised[i]}),
+            best_segment=pd.DataFrame({'timestamp': timestamps[start:end + 1],
+                                       'value': values[row, start:end + 1]}),
+            wavelet_data=pd.DataFrame({'period': periods, 'power': glbl_power[i],
+                                       'significance': glbl_signif[i], 'peak': peaks[i]}))
+        if not has_cycle[i]:
+            rhythmo_outputs.notes = 'No cycle found'
+            outputs[subject] = rhythmo_outputs
+            continue
+
+        cycle_period = float(cycle_periods[i])
+        rhythmo_outputs.cycle_period = cycle_period
+        rhythmo_outputs.cycle_periods = [cycle_period]
+        rhythmo_outputs.filtered_cycle = pd.DataFrame({'timestamp': timestamps, 'value': filtered[i]})
+        rhythmo_outputs.filtered_cycles = pd.DataFrame({'cycle_period': cycle_period, 'timestamp': timestamps,
+                                                        'value': filtered[i]})
+
+        # Phase line projected for projection_duration days (4 cycle periods if not set), as project
+        time_in_past = (timestamps.asi8 // 10 ** 6).astype(float) # milliseconds since epoch
+        time_in_future, phases_future = get_phases_future(time_in_past, phases[i],
+                                                          projection_horizon(parameters, cycle_period))
+        future_phases = pd.DataFrame({'timestamp': pd.to_datetime(time_in_future, unit='ms'),
+                                      'phase': phases_future})
+        rhythmo_outputs.future_phases = future_phases
+        rhythmo_outputs.projected_cycle = pd.DataFrame({'timestamp': future_phases['timestamp'],
+                                                        'value': predict_cycle(filtered[i], phases_future)})
+        rhythmo_outputs.cycle_future_phases = pd.DataFrame({'cycle_period': cycle_period,
+                                                            'timestamp': future_phases['timestamp'],
+                                                            'phase': phases_future})
+        outputs[subject] = rhythmo_outputs
+
+    return outputs
+
+
+def run_batch(series: Dict[str, pd.DataFrame], parameters) -> Dict[str, RhythmoOutput]:
+    """
+    Resamples every series, then analyses the series with the same number of samples together
+
+    Returns
+    -------
+    dict of subject name to RhythmoOutput (None for subjects with insufficient data), in the order
+    of series
+    """
+    if parameters.number_of_cycles > 1:
+        raise ValueError(f"Batch mode tracks the strongest cycle only, not {parameters.number_of_cycles} "
+                         f"cycles (number_of_cycles), run the inputs without --batch")
+
+    outputs = {subject: None for subject in series}
+    for subjects, starts, values in resample_batch(series, parameters.data_resampling_rate):
+        logger.info(f"Analysing {len(subjects)} series of {values.shape[1]} samples together")
+        outputs.update(analyse_batch(subjects, starts, values, parameters))
+    return outputs
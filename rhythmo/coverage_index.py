@@ -0,0 +1,139 @@
+import hashlib
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from process import bin_values, longest_valid_segment
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+# Bumped whenever the contents of the index change, so older indexes are rebuilt
+COVERAGE_VERSION = 2
+# Rate of the bins the index records the coverage of. Coverage at any rate it divides (e.g. '5Min', '1H',
+# '1D') is derived from it
+COVERAGE_RATE = '1Min'
+# Same rule as check_sufficient_data
+MAX_PROPORTION_NANS = 0.3
+
+
+def coverage_path(input_file: str, coverage_dir: Optional[str] = None) -> str:
+    """Gets the location of the coverage index of an input: next to it, or in coverage_dir"""
+    if coverage_dir is None:
+        return input_file + '.coverage.npz'
+    name = hashlib.sha256(os.path.abspath(input_file).encode()).hexdigest()[:16]
+    return os.path.join(coverage_dir, f"{os.path.basename(input_file)}.{name}.coverage.npz")
+
+
+def build_coverage(rhythmo_inputs) -> dict:
+    """
+    Builds the coverage index of an input
+
+    Parameters
+    ------------
+    rhythmo_inputs: dataframe with columns: timestamp (milliseconds since epoch) and value
+
+    Returns
+    -------
+    dict of:
+        num_rows: number of rows
+        first_timestamp, last_timestamp: first and last timestamps (milliseconds since epoch)
+        origin, first_bin, num_bins: bins of COVERAGE_RATE, as in process.bin_values
+        valid_bins: bits (np.packbits) set for the bins with at least one value
+    """
+    timestamps = rhythmo_inputs['timestamp'].to_numpy(dtype=np.int64)
+    values = rhythmo_inputs['value'].to_numpy(dtype=float)
+    coverage = {'version': COVERAGE_VERSION, 'num_rows': len(timestamps)}
+    if not len(timestamps):
+        return coverage
+
+    origin, _, first_bin, _, counts = bin_values(timestamps * 10 ** 6, values, pd.Timedelta(COVERAGE_RATE).value)
+    coverage.update(first_timestamp=timestamps.min(),
+                    last_timestamp=timestamps.max(),
+                    origin=origin,
+                    first_bin=first_bin,
+                    num_bins=len(counts),
+                    valid_bins=np.packbits(counts > 0))
+    return coverage
+
+
+def save_coverage(input_file: str, coverage: dict, coverage_dir: Optional[str] = None) -> str:
+    """Saves the coverage index of an input, stamped with the size and modification time of the input"""
+    path = coverage_path(input_file, coverage_dir)
+    stat = os.stat(input_file)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}.tmp.npz"
+    np.savez_compressed(temporary_path, source_size=stat.st_size, source_mtime=stat.st_mtime_ns, **coverage)
+    os.replace(temporary_path, path)
+    return path
+
+
+def load_coverage(input_file: str, coverage_dir: Optional[str] = None) -> Optional[dict]:
+    """Loads the coverage index of an input, returning None if there is none or the input has changed since"""
+    path = coverage_path(input_file, coverage_dir)
+    try:
+        with np.load(path, allow_pickle=False) as index:
+            coverage = {name: index[name] for name in index.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable coverage index {path}: {e}")
+        return None
+
+    stat = os.stat(input_file)
+    if (coverage.pop('version') != COVERAGE_VERSION or coverage.pop('source_size') != stat.st_size
+            or coverage.pop('source_mtime') != stat.st_mtime_ns):
+        return None
+    return coverage
+
+
+def resampled_coverage(coverage: dict, data_resampling_rate: str):
+    """
+    Gets the timestamps of the resampled data and which of them have no data (as process.resample_inputs),
+    from the coverage index alone
+
+    Returns
+    -------
+    timestamps: array of datetime64, or None if the rate is not a multiple of COVERAGE_RATE
+    is_nan: array of bool
+    """
+    if not coverage['num_rows']:
+        return np.array([], dtype='datetime64[ns]'), np.array([], dtype=bool)
+    coverage_rate = pd.Timedelta(COVERAGE_RATE).value
+    rate = pd.Timedelta(data_resampling_rate).value
+    if rate % coverage_rate:
+        return None, None
+
+    # A bin has data if any of the coverage bins within it has
+    num_bins = int(coverage['num_bins'])
+    valid = np.unpackbits(coverage['valid_bins'], count=num_bins).astype(bool)
+    bins = (int(coverage['first_bin']) + np.arange(num_bins)) // (rate // coverage_rate)
+    first_bin = int(bins[0])
+    has_data = np.bincount(bins - first_bin, weights=valid) > 0
+
+    timestamps = int(coverage['origin']) + (first_bin + np.arange(len(has_data))) * rate
+    return timestamps.astype('datetime64[ns]'), ~has_data
+
+
+def sufficient_coverage(coverage: dict, data_resampling_rate: str) -> Optional[bool]:
+    """
+    Checks for sufficient data (the same rules as process.check_sufficient_data) from the coverage index,
+    without loading the values
+
+    Returns
+    -------
+    True or False, or None if it can't be decided from the index (the rate is not a multiple of COVERAGE_RATE)
+    """
+    timestamps, is_nan = resampled_coverage(coverage, data_resampling_rate)
+    if timestamps is None:
+        return None
+    if not len(timestamps):
+        return False
+    if is_nan.mean() <= MAX_PROPORTION_NANS:
+        return True
+
+    longest_start_ind, longest_end_ind = longest_valid_segment(timestamps, is_nan,
+                                                               max_proportion_nans=MAX_PROPORTION_NANS)
+    return longest_end_ind != longest_start_ind
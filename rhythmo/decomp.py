@@ -1,85 +1,92 @@
+import numpy as np
+import pandas as pd
+import pycwt as cwt # continuous wavelet spectral analysis
+from scipy.signal import find_peaks
+
+from wavelet import PERIOD_RESOLUTION, adaptive_periods, significance, wavelet_transform
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
 
 # Mortlet Wavelet Analysis
 
-# Variables
-# have an if function depending on what the user has inputted for the wave form here:
-WAVELET = cwt.Morlet(6) # Continuous wavelet transformation, 6 (non-dimensional frequency parameter) controls the frequency of the wavelet
-        # used to analyze signals, detect changes in frequency over time.
-STRONGEST_PEAK = 'prominence' # measure of how much a peak stands out relative to its surrounding data. Used to filter or rank detected peaks based on their prominence.
-
-# Wavelet analysis
-dt = 1 # sampling interval of 1 (units depends on time scale of signal- days, seconds, hrs)
-alpha, _, _ = cwt.ar1(y) # lag 1 autocorrelation for significance (alpha = np.corrcoef(y[:-1], y[1:])[0, 1])
-            # autoregressive lag-1 coefficient (AR1) of the signal y,
-            # models how much the current value of a time series depends on its previous value
-            # alpha stores the coefficient, later used for significance testing
-
-wave, scales, freqs, coi, fft, fftfreqs = cwt.cwt(signal = y, dt = dt, wavelet = WAVELET, freqs = freqs) # cwt.cwt -continuous wavelet transform (CWT)
-"""         signal = y: input time series data
-            dt = dt: Sampling interval (set to 1)
-            wavelet = WAVELET: wavelet function being used for the transform (Morlet wavelet)
-            freqs = freqs: Frequencies over which the CWT is computed
-            
-            OUTPUTS:
-            wave: wavelet transform of signal y
-            scales: wavelet scales corresponding to the wavelet transform
-            freqs: frequencies associated w/ scales.
-            coi: cone of influence (where edge effects distort the wavelet transform)
-            fft: Fourier transform of the signal y
-            fftfreqs: Fourier frequencies corresponding to fft
-            
-            """
-power = np.abs(wave) ** 2 # wavelet power spectrum. Squared magnitude of abs value of wavelet transform. Displays how power of different freqs changes over time
-fft_power = np.abs(fft) ** 2 # Fourier power spectrum. Squared magnitude of Fourier transform. Outputs overall power for each freq, independent of time
-period = 1 / freqs # converting freqs to periods
-glbl_power = power.mean(axis=1) # global wavelet power. Averages wavelet power over time, represents the avg power at each freq/scale.
-dof = y.size - scales  # Correction for padding at edges, Degrees of freedom (DOF) 
-        # calculated for wavelet power spectrum, (y.size = size of data) (scales - # of scales)
-var = y.std()**2 # variance of signal y. This is used in significance testing. Variance = square of std.
-glbl_signif, tmp = cwt.significance(var, dt, scales, 1, alpha, significance_level=0.95, dof=dof, wavelet=WAVELET) #  global significance of wavelet power spectrum
-""" 
-Inputs:
-    var: Variance of signal
-    dt: Sampling interval
-    scales: wavelet scales
-    1: background spectrum type (1 indicates an AR(1) process)
-    alpha: AR1 coefficient, which models background spectrum
-    significance_level=0.95: significance level (95% confidence)
-    dof=dof: Degrees of freedom for wavelet power spectrum
-    wavelet=WAVELET: wavelet function used (Morlet wavelet)
-Outputs:
-    glbl_signif: significance levels for global wavelet power spectrum
-    tmp: theoretical wavelet spectrum used for significance testing (often ignored).
-"""
-
-signif, fft_theor = cwt.significance(1.0, dt, scales, 0, alpha, significance_level=0.95, wavelet=WAVELET) # pointwise significance of wavelet power spectrum
-""" 
-Inputs:
-    1.0: Background variance is set to 1
-    dt: Sampling interval
-    scales: wavelet scales
-    0: Indicates that background spectrum is white noise
-    alpha: AR1 coefficient, which models background spectrum
-    significance_level=0.95: significance level (95% confidence)
-    wavelet=WAVELET: wavelet function used (Morlet wavelet)
-Outputs:
-    signif: significance levels for wavelet power spectrum at each scale
-    fft_theor: theoretical Fourier spectrum used for significance testing
-
-"""
-
-def freqs(df):
-    data_duration = (hr_interpolate['timestamp'].iloc[-1] - hr_interpolate['timestamp'].iloc[0]).total_seconds()/(60 * 60 * 24)/3 
-    """Calculates the total duration in days between the first and last timestamps in hr_interpolate and divides by 3"""
-
-    periods = np.arange(2, int(data_duration), 0.5) 
-    """Generates values from 2 to up until 'int(n)' calculated above, with a step size of 0.5"""
-
-    freqs = (1/periods)
-    return freqs
-
-#def decomp(rhythmo_inputs, rhythmo_outputs, parameters): 
-# rhythmo_outputs.wavelet_data = ## some dataframe
-# return rhythmo_outputs
+DAY = pd.Timedelta(days=1)
+# Supported values of Parameters.period_grid: 'linear' (every 0.5 days) or 'adaptive' (coarse log-spaced
+# pass, refined every 0.5 days around the candidate peaks only)
+PERIOD_GRIDS = ('linear', 'adaptive')
+MIN_PERIOD = 2 # shortest period of the wavelet transform (in days)
+# Round alpha to this many decimals so files with nearly the same AR(1) coefficient share significance
+# tables (None = exact)
+ALPHA_DECIMALS = None
+
+
+def wavelet_periods(signal, dt: float, max_period: float, parameters):
+    """
+    Gets the periods of the wavelet transform, from 2 days up to max_period: every 0.5 days
+    (parameters.period_grid = 'linear'), or every 0.5 days around the peaks of a coarse pass only
+    ('adaptive', see adaptive_periods)
+
+    Parameters
+    ------------
+    signal: array of float
+        standardised resampled values, or a 2D array of signals x time (the adaptive grid is then
+        refined around the peaks of every signal)
+    dt: float
+        sampling interval (in days)
+    max_period: float
+        longest period (in days), a third of the duration of the data
+    parameters: Parameters
+
+    Returns
+    -------
+    periods: array of float (in days)
+    """
+    if parameters.period_grid not in PERIOD_GRIDS:
+        raise ValueError(f"Unsupported period grid: {parameters.period_grid}. "
+                         f"Supported period grids are {', '.join(PERIOD_GRIDS)}")
+
+    periods = np.arange(MIN_PERIOD, int(max_period), PERIOD_RESOLUTION)
+    if parameters.period_grid == 'adaptive' and len(periods) >= 3:
+        return adaptive_periods(signal, dt, MIN_PERIOD, int(max_period), parameters.wavelet_waveform)
+    return periods
+
+
+def decomp(rhythmo_inputs, rhythmo_outputs, parameters):
+    """
+    Wavelet decomposition of the resampled data (standardised and NaN filled by process): the global
+    wavelet power at the periods of parameters.period_grid (from 2 days to a third of the duration of
+    the data), its significance against an AR(1) background, and its peaks, the candidate cycles.
+
+    Sets rhythmo_outputs.wavelet_data, with periods in days and the power scaled by the variance.
+    Returns None if the data is too short for the wavelet transform.
+    """
+    y = rhythmo_outputs.resampled_data['value'].to_numpy(dtype=float)
+    dt = pd.Timedelta(parameters.data_resampling_rate) / DAY # sampling interval (in days)
+
+    periods = wavelet_periods(y, dt, (len(y) - 1) * dt / 3, parameters)
+    if len(periods) < 3:
+        logger.error("Recording too short for the wavelet transform.")
+        return None
+
+    # Continuous wavelet transform (CWT), as cwt.cwt but with cached wavelet kernels
+    wave, scales, freqs, _, _, _ = wavelet_transform(signal=y, dt=dt, freqs=1 / periods,
+                                                     waveform=parameters.wavelet_waveform)
+    periods = periods[np.isin(1 / periods, freqs)] # Scales where the transform is all NaN are removed
+
+    glbl_power = (np.abs(wave) ** 2).mean(axis=1) # global wavelet power: the power at each period averaged over time
+    var = y.std() ** 2 # variance of the signal, used in significance testing
+    alpha, _, _ = cwt.ar1(y) # lag 1 autocorrelation, models the (red noise) background spectrum
+    dof = y.size - scales # Correction for padding at edges, degrees of freedom
+
+    # Global significance of the wavelet power spectrum (95% confidence), from the cached significance tables
+    glbl_signif, _ = significance(var, dt, scales, 1, alpha, significance_level=0.95, dof=dof,
+                                  waveform=parameters.wavelet_waveform, alpha_decimals=ALPHA_DECIMALS)
 
+    peaks = np.zeros(len(periods), dtype=int)
+    peaks[find_peaks(var * glbl_power)[0]] = 1
 
+    rhythmo_outputs.wavelet_data = pd.DataFrame({'period': periods,
+                                                 'power': var * glbl_power,
+                                                 'significance': glbl_signif,
+                                                 'peak': peaks})
+    return rhythmo_outputs
@@ -1 +1,86 @@
-#def forecast(rhythmo_inputs, rhythmo_outputs, parameters):
\ No newline at end of file
+import numpy as np
+import pandas as pd
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+# Phases (cos of the phase is the projected cycle, so 0 is the peak) predicted for each
+# Parameters.timing_of_future_phases. regular_sampling spreads number_of_future_phases phases over a cycle
+PHASE_TIMINGS = {
+    'peak_trough': (0, np.pi),
+    'peak_trough_rising_falling': (-np.pi / 2, 0, np.pi / 2, np.pi),
+}
+
+
+def timing_phases(parameters):
+    """Gets the phases (from -pi to pi) to predict the times of, see PHASE_TIMINGS"""
+    if parameters.timing_of_future_phases == 'regular_sampling':
+        phases = 2 * np.pi * np.arange(parameters.number_of_future_phases) / parameters.number_of_future_phases
+        return np.where(phases > np.pi, phases - 2 * np.pi, phases)
+    if parameters.timing_of_future_phases not in PHASE_TIMINGS:
+        raise ValueError(f"Unsupported timing of future phases: {parameters.timing_of_future_phases}. "
+                         f"Supported timings are regular_sampling, {', '.join(PHASE_TIMINGS)}")
+    return np.array(PHASE_TIMINGS[parameters.timing_of_future_phases])
+
+
+def phase_times(future_phases: pd.DataFrame, phases, number: int) -> pd.DataFrame:
+    """
+    Gets the first times the projected phases reach any of the given phases
+
+    Parameters
+    ------------
+    future_phases: dataframe with columns: timestamp and phase (from -pi to pi), a projected phase line
+    phases: array of float
+        phases to find (from -pi to pi)
+    number: int
+        number of times to return
+
+    Returns
+    -------
+    dataframe with columns: timestamp and phase, the first number times (interpolated between the
+    projected samples) and the phase reached at each
+    """
+    timestamps = pd.DatetimeIndex(future_phases['timestamp']).asi8.astype(float)
+    unwrapped = np.unwrap(future_phases['phase'].to_numpy(dtype=float))
+
+    times = []
+    reached = []
+    for phase in phases:
+        # Number of times the phase has been passed at each sample, which goes up where it is reached
+        turns = np.floor((unwrapped - phase) / (2 * np.pi))
+        after = np.flatnonzero(np.diff(turns) > 0) + 1
+        targets = phase + 2 * np.pi * turns[after]
+        fraction = (targets - unwrapped[after - 1]) / (unwrapped[after] - unwrapped[after - 1])
+        times.append(timestamps[after - 1] + fraction * (timestamps[after] - timestamps[after - 1]))
+        reached.append(np.full(len(after), phase))
+
+    times = np.concatenate(times)
+    order = np.argsort(times, kind='stable')[:number]
+    if len(order) < number:
+        logger.warning(f"Only {len(order)} of {number} future phases fall within the projection")
+    return pd.DataFrame({'timestamp': pd.to_datetime(times[order].astype(np.int64)),
+                         'phase': np.concatenate(reached)[order]})
+
+
+def forecast(rhythmo_inputs, rhythmo_outputs, parameters):
+    """
+    Predicts the times of the next parameters.number_of_future_phases phases of each tracked cycle
+    (parameters.timing_of_future_phases, see PHASE_TIMINGS) from its projected phases (see project)
+
+    Sets rhythmo_outputs.future_phases (the strongest cycle) and cycle_future_phases to those times
+    """
+    if rhythmo_outputs.future_phases is None:
+        return rhythmo_outputs
+    phases = timing_phases(parameters)
+
+    rhythmo_outputs.future_phases = phase_times(rhythmo_outputs.future_phases, phases,
+                                                parameters.number_of_future_phases)
+
+    cycle_future_phases = rhythmo_outputs.cycle_future_phases
+    if cycle_future_phases is not None:
+        rhythmo_outputs.cycle_future_phases = pd.concat(
+            [phase_times(rows, phases, parameters.number_of_future_phases).assign(cycle_period=cycle_period)
+             [['cycle_period', 'timestamp', 'phase']]
+             for cycle_period, rows in cycle_future_phases.groupby('cycle_period', sort=False)],
+            ignore_index=True)
+    return rhythmo_outputs
@@ -2,8 +2,6 @@ import numpy as np
 import pandas as pd
 import copy
 
-from utils import nearest
-
 from logger.logger import get_logger
 logger = get_logger(__name__)
 
@@ -16,10 +14,128 @@ def timestamps_to_dates(rhythmo_inputs):
 
     return data
 
+# Rates of the resampling pyramid, finest first. Each rate is aggregated from the bins of a finer rate that
+# divides it, rather than from the raw data
+RESAMPLING_RATES = ('1Min', '5Min', '1H', '1D')
+DAY = pd.Timedelta(days=1).value # nanoseconds
+
+
+def bin_values(timestamps, values, rate: int):
+    """Sums and counts the (non NaN) values in bins of rate nanoseconds, as in pandas resample
+
+    Bins are counted from midnight of the first day (pandas' default origin, 'start_day'), and run from
+    the bin of the first timestamp to the bin of the last one.
+
+        Parameters
+        ------------
+            timestamps: numpy array of int64
+                Nanoseconds since epoch (in any order)
+            values: numpy array of float
+            rate: int
+                Width of the bins in nanoseconds
+        Returns
+        ------------
+            bins: tuple of (origin, rate, first_bin, sums, counts)
+                origin: midnight of the first day (nanoseconds since epoch)
+                first_bin: number of bins from origin to the first bin
+                sums, counts: numpy arrays of the sum and number of the values in each bin
+    """
+    origin = timestamps.min() - timestamps.min() % DAY
+    bins = (timestamps - origin) // rate
+    first_bin = bins.min()
+    bins -= first_bin
+    has_value = ~np.isnan(values)
+    num_bins = int(bins.max()) + 1
+    sums = np.bincount(bins[has_value], weights=values[has_value], minlength=num_bins)
+    counts = np.bincount(bins[has_value], minlength=num_bins)
+    return origin, rate, int(first_bin), sums, counts
+
+
+def aggregate_bins(bins, rate: int):
+    """Sums and counts the values in bins of rate nanoseconds from the bins of a finer rate that divides it
+    (see bin_values)"""
+    origin, fine_rate, fine_first_bin, fine_sums, fine_counts = bins
+    coarse_bins = (fine_first_bin + np.arange(len(fine_sums))) // (rate // fine_rate)
+    first_bin = int(coarse_bins[0])
+    coarse_bins -= first_bin
+    sums = np.bincount(coarse_bins, weights=fine_sums)
+    counts = np.bincount(coarse_bins, weights=fine_counts).astype(np.int64)
+    return origin, rate, first_bin, sums, counts
+
+
+def bins_to_frame(bins):
+    """Builds the resampled dataframe (columns: timestamp and value, the mean of each bin or NaN if it is
+    empty) from the bins of bin_values"""
+    origin, rate, first_bin, sums, counts = bins
+    timestamps = origin + (first_bin + np.arange(len(sums))) * rate
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = np.where(counts > 0, sums / counts, np.nan)
+    return pd.DataFrame({'timestamp': timestamps.astype('datetime64[ns]'), 'value': means})
+
+
+def empty_resampled_data():
+    """Resampled dataframe of an input without rows"""
+    return pd.DataFrame({'timestamp': np.array([], dtype='datetime64[ns]'), 'value': np.array([], dtype=float)})
+
+
+def resample_inputs(rhythmo_inputs, data_resampling_rate):
+    """
+    Resamples the inputs to data_resampling_rate intervals (e.g., '1H'), calculating the resampled value
+    as the average of the data within each interval. Same as resample_data, but bins the timestamps
+    (milliseconds since epoch) directly, without converting them to dates first.
+    """
+    if rhythmo_inputs.empty:
+        return empty_resampled_data()
+    timestamps = rhythmo_inputs['timestamp'].to_numpy(dtype=np.int64) * 10 ** 6
+    values = rhythmo_inputs['value'].to_numpy(dtype=float)
+    return bins_to_frame(bin_values(timestamps, values, pd.Timedelta(data_resampling_rate).value))
+
+
 def resample_data(data, data_resampling_rate):
     # Resamples the data to hourly intervals, calculating the resampled value as the average of the data within each interval.
-    resample_data = data.resample(data_resampling_rate, on='timestamp').mean().reset_index()['value']
-    return resample_data
+    if data.empty:
+        return empty_resampled_data()
+    timestamps = pd.DatetimeIndex(data['timestamp']).asi8
+    values = data['value'].to_numpy(dtype=float)
+    return bins_to_frame(bin_values(timestamps, values, pd.Timedelta(data_resampling_rate).value))
+
+
+def resample_pyramid(rhythmo_inputs, data_resampling_rates=RESAMPLING_RATES):
+    """
+    Resamples the inputs at several rates in one pass over the data: the finest rate is binned from the
+    inputs, and each coarser rate from the bins of the finest rate that divides it (rates that no finer
+    rate divides are binned from the inputs).
+
+        Parameters
+        ------------
+            rhythmo_inputs:
+                Data frame with columns: timestamp (milliseconds since epoch) and value
+            data_resampling_rates: list of str
+                e.g. ('1Min', '5Min', '1H', '1D')
+        Returns
+        ------------
+            pyramid: dict of rate to the resampled data frame (as resample_inputs)
+    """
+    if rhythmo_inputs.empty:
+        return {rate: empty_resampled_data() for rate in data_resampling_rates}
+
+    timestamps = rhythmo_inputs['timestamp'].to_numpy(dtype=np.int64) * 10 ** 6
+    values = rhythmo_inputs['value'].to_numpy(dtype=float)
+    computed = {} # rate in nanoseconds to its bins
+    pyramid = {}
+    for rate in sorted(data_resampling_rates, key=lambda rate: pd.Timedelta(rate).value):
+        rate_ns = pd.Timedelta(rate).value
+        finer = [fine_rate for fine_rate in computed if rate_ns % fine_rate == 0]
+        if rate_ns in computed:
+            bins = computed[rate_ns]
+        elif finer:
+            bins = aggregate_bins(computed[max(finer)], rate_ns)
+        else:
+            bins = bin_values(timestamps, values, rate_ns)
+        computed[rate_ns] = bins
+        pyramid[rate] = bins_to_frame(bins)
+    return pyramid
+
 
 def proportion_nans(df):
     """Get the proportion of nans in the dataset
@@ -39,6 +155,84 @@ def proportion_nans(df):
     proportion_nans = num_of_nans / len(df)
     return proportion_nans
 
+def nearest_indices(timestamps, pivots):
+    """Gets the index of the timestamp nearest to each pivot point (the earlier one on ties)
+
+        Parameters
+        ------------
+            timestamps: numpy array
+                Sorted timestamps
+            pivots: numpy array
+                Timestamps to find the nearest neighbours of
+        Returns
+        ------------
+            indices: numpy array of int
+                Index into timestamps of the nearest value to each pivot
+    """
+    if len(timestamps) == 1:
+        return np.zeros(len(pivots), dtype=int)
+
+    # Binary search for the first timestamp at or after each pivot, then compare with the one before it
+    right = np.clip(np.searchsorted(timestamps, pivots), 1, len(timestamps) - 1)
+    left = right - 1
+    closer_left = (pivots - timestamps[left]) <= (timestamps[right] - pivots)
+    return np.where(closer_left, left, right)
+
+def longest_valid_segment(timestamps, is_nan,
+                          min_window_size=pd.Timedelta(days=90),
+                          sliding_window_size=pd.Timedelta(days=30),
+                          max_proportion_nans=0.3):
+    """Finds the longest segment longer than min_window_size with at most max_proportion_nans NaNs.
+
+    Segments start and end at anchors spaced approximately sliding_window_size apart (the nearest
+    timestamp to each month from the start of the recording). A cumulative count of NaNs gives the
+    proportion of NaNs in any segment in O(1), so all (start, end) anchor pairs are checked at once.
+
+        Parameters
+        ------------
+            timestamps: numpy array of datetime64
+                Sorted timestamps of the data
+            is_nan: numpy array of bool
+                True where the value at the matching timestamp is NaN
+        Returns
+        ------------
+            longest_start_ind, longest_end_ind: int
+                Positional indices of the first and last rows of the longest segment. Both are 0
+                if no segment satisfies the rules.
+    """
+    timestamps = np.asarray(timestamps, dtype='datetime64[ns]').astype(np.int64)
+    min_window_size = pd.Timedelta(min_window_size).value
+    sliding_window_size = pd.Timedelta(sliding_window_size).value
+
+    # Anchors at approximately 1 per month (e.g., Month 1, Month 2, Month 3), from the start of the recording
+    # up to (but excluding) the last timestamp
+    recording_span = timestamps.max() - timestamps[0]
+    num_anchors = max(0, (recording_span - 1) // sliding_window_size)
+    if num_anchors < 2:
+        return 0, 0
+    anchor_dates = timestamps[0] + sliding_window_size * np.arange(1, num_anchors + 1)
+    anchors = nearest_indices(timestamps, anchor_dates)
+
+    # Number of NaNs before each row, so that the NaNs in rows [i, j] are nan_count[j + 1] - nan_count[i]
+    nan_count = np.concatenate(([0], np.cumsum(is_nan)))
+
+    # Every (start, end) pair of anchors, with start in rows and end in columns
+    start_inds = anchors[:, np.newaxis]
+    end_inds = anchors[np.newaxis, :]
+    durations = timestamps[end_inds] - timestamps[start_inds]
+    proportion = (nan_count[end_inds + 1] - nan_count[start_inds]) / (end_inds - start_inds + 1)
+
+    # Only ending anchors after the starting anchor, for segments longer than 90 days with <30% NaNs
+    later_end = np.triu(np.ones((num_anchors, num_anchors), dtype=bool), k=1)
+    valid = later_end & (durations > min_window_size) & (proportion <= max_proportion_nans)
+    if not valid.any():
+        return 0, 0
+
+    # argmax returns the first longest pair, in the same (start, end) order as scanning anchor by anchor
+    best = np.argmax(np.where(valid, durations, -1))
+    start, end = np.unravel_index(best, valid.shape)
+    return int(anchors[start]), int(anchors[end])
+
 def check_sufficient_data(df):
     '''
     Checks for sufficient data:
@@ -62,55 +256,8 @@ def check_sufficient_data(df):
             return True, df
         
         # Finding the longest segment of data with less than 30% NaN
-        max_duration = pd.Timedelta(0)
-        longest_start_ind = 0
-        longest_end_ind = 0
-        min_window_size = pd.Timedelta(days=90)
-        sliding_window_size = pd.Timedelta(days=30)
-
-        starting_inds = []
-        k = 1
-        while (next_date:=df.iloc[0]['timestamp'] + k*sliding_window_size) < df['timestamp'].max():
-            """
-            Loop creates an array of indices of approximately 1 per month (e.g., Month 1, Month 2, Month 3), starting 
-            from the beginning of the dataframe. Loop increases by increments of k (window size of 30 days) until it 
-            hits a date that is greater than or equal to the maximum timestamp in the dataframe.
-            """
-            
-            # Finding the closest/nearest time stamp to 'next-date' and appending its index to the starting_inds list (start of the 30 days)
-            closest = nearest(df['timestamp'], next_date)
-            starting_inds.append(df[df['timestamp'] == closest].index[0])
-            k += 1
-        
-        for i, start_ind in enumerate(starting_inds):
-            """Iterate through the data of each month to find the longest segment with less than 30% NaN
-                Parameters
-                ------------
-                i: 
-                    indices of start_ind
-                start_ind:
-                    original monthly indices for df, found in while loop above
-            """
-
-            # Ending indices of approximately 1 per month starting from the starting index (e.g., Month 2, Month 3, Month 4)
-            ending_inds = starting_inds[i + 1:]
-
-            for end_ind in ending_inds:
-                """ Iterating through all possible ending indices until the end of the recording is reached"""
-
-                if df.iloc[end_ind]['timestamp'] - df.iloc[start_ind]['timestamp'] <= min_window_size:
-                    # Checks if the segment of data is longer than 90 days
-                    continue
-
-                # Finding the number of NaNs in the segment of interest
-                segment = df.iloc[start_ind:end_ind+1]
-                num_of_nans = proportion_nans(segment)
-
-                # Checking if the segment has <30% NaNs and is longer than the current longest segment
-                if num_of_nans <= 0.3 and (segment['timestamp'].max() - segment['timestamp'].min()) > max_duration:
-                    max_duration = segment['timestamp'].max() - segment['timestamp'].min()
-                    longest_start_ind = start_ind
-                    longest_end_ind = end_ind
+        longest_start_ind, longest_end_ind = longest_valid_segment(
+            df['timestamp'].to_numpy(), pd.isnull(df['value']).to_numpy())
 
         longest_segment = df.iloc[longest_start_ind:longest_end_ind+1]
         if len(longest_segment) == 1:
@@ -133,13 +280,15 @@ def data_interpolate(df):
     return df
 
 
-def process(rhythmo_inputs, rhythmo_outputs, parameters):
-
-    # convert timestamps to dates
-    data = timestamps_to_dates(rhythmo_inputs)
+def process(rhythmo_inputs, rhythmo_outputs, parameters, pyramid=None):
+    # pyramid (optional): dict of rate to resampled data (see resample_pyramid), e.g. shared by the
+    # variants of a sweep over data_resampling_rate, so the inputs are only binned once
 
-    # Resampling the data
-    resampled_data = resample_data(data, parameters.data_resampling_rate)
+    # Resampling the data (binning the millisecond timestamps directly)
+    if pyramid is not None and parameters.data_resampling_rate in pyramid:
+        resampled_data = pyramid[parameters.data_resampling_rate].copy()
+    else:
+        resampled_data = resample_inputs(rhythmo_inputs, parameters.data_resampling_rate)
 
     data_check, best_segment = check_sufficient_data(resampled_data)
     if data_check:
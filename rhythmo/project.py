@@ -1,93 +1,163 @@
 # Projection
-def get_phases(cycle):
+import numpy as np
+import pandas as pd
+from scipy.signal import hilbert
+
+from track import chunked_phases
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+# Supported values of Parameters.projection_method
+PROJECTION_METHODS = ('linear',)
+
+
+def get_phases(cycle, cycle_period=None):
     """
     Gets instantaneous phases for significant HR cycle with a given period using Hilbert transform
+    If the cycle period (in samples) is given, long cycles are transformed in blocks (see chunked_phases),
+    and cycle can be a 2D array of cycles x time (with the longest cycle period)
     Returns phase values of cycle
     """
+    if cycle_period is not None:
+        return chunked_phases(cycle, cycle_period)
     hilbert_arr = hilbert(cycle)  # hilbert transform
     phase = np.angle(hilbert_arr)  # get instantaneous phases. Returns the angle (or phase) of each complex number in hilbert_arr
     return phase
 
 
-def get_phases_future(time_in_past, cycle_phase):
+def unwrap_phases(cycle_phase):
+    """
+    Converts phases from (-pi, pi) to cumulative phases (eg phase = 0 -> 4*pi, if 2nd cycle)
+    Each phase is shifted by 2 * (n + 1) * pi, where n is the number of times the phase has wrapped around
+    (gone from positive to not positive) before it.
+    """
+    cycle_phase = np.asarray(cycle_phase, dtype=float)
+    wraps = (cycle_phase > 0) & np.append(~(cycle_phase[1:] > 0), True) # positive, and the next phase is not (or is the last)
+    n = np.concatenate(([0], np.cumsum(wraps)[:-1])) # number of wraps before each phase
+    return cycle_phase + 2 * (n + 1) * np.pi
+
+
+def fit_phase_line(time, phase):
+    """
+    Least squares linear model of phase against time, in closed form
+    Returns slope and intercept
+    """
+    time = np.asarray(time, dtype=float)
+    phase = np.asarray(phase, dtype=float)
+    time_mean = time.mean()
+    phase_mean = phase.mean()
+    slope = np.sum((time - time_mean) * (phase - phase_mean)) / np.sum((time - time_mean) ** 2)
+    return slope, phase_mean - slope * time_mean
+
+
+def wrap_phases(phases):
+    """Re-wraps cumulative phases to be from -pi to pi"""
+    phases = phases - (phases // (2 * np.pi)) * (2 * np.pi) # Normalizes phases to a value within the range of 0 to 2pi
+    return np.where(phases > np.pi, phases - 2 * np.pi, phases) # Subtracts 2pi from phases above pi
+
+
+def projection_horizon(parameters, cycle_period):
+    """Gets the number of days to project phases for (parameters.projection_duration, or 4 cycles if not set)"""
+    return parameters.projection_duration or 4 * cycle_period
+
+
+def get_phases_future(time_in_past, cycle_phase, projection_duration):
     """
     Forecast future phases for a given cycle using a linear model
     Phases must first be converted to cumulative phase (strictly increasing, rather than cyclical)
     in order to avoid drops from pi to -pi when phase is kept cyclical
+
+    Parameters
+    ------------
+    time_in_past: array of float
+        timestamps (milliseconds since epoch) of the phases
+    cycle_phase: array of float
+        phases of the cycle from -pi to pi
+    projection_duration: float
+        number of days to project phases for (see projection_horizon)
     """
+    time_in_past = np.asarray(time_in_past, dtype=float)
+
     # model cumulative phases such as 0, 2*pi, 4*pi, .... n*pi
-    item_arr = [] # empty list
-    n = 0 # keeps track of # phase cycles (i.e., how many times the phase has wrapped around).
-
-    # Unwrap phases to be within (pi, inf), i.e. cumulative, rather than (-pi, pi)
-    # (eg phase = 0 -> 4*pi, if 2nd cycle)
-    for i, _ in enumerate(cycle_phase):
-        item_arr.append(cycle_phase[i] + 2 * (n + 1) * np.pi) # For each phase value in cycle_phase, adjust it by adding 2 * (n + 1) * np.pi
-                # Adjustment accounts for phase wrapping around by adding an appropriate multiple of 2 * np.pi
-                # Variable n tracks how many times the phase has wrapped around (crossed from + to - values)
-        if cycle_phase[i] > 0:
-            if i < len(cycle_phase) - 1 and cycle_phase[i + 1] > 0: # if current phase value is positive, check whether next phase value is positive
-                continue
-            n += 1
+    item_arr = unwrap_phases(cycle_phase)
 
     # develop a linear model for cumulative/unwrapped phases
-    a = np.array(time_in_past).reshape(-1, 1) # Converts time_in_past into a NumPy array
-    y = np.array(item_arr).reshape(-1, 1) # Reshapes the array to be a column vector with one column. Ensures correct shape for linear regression below
-    reg1 = LinearRegression() # Facebook prophet method? people can choose projection method (linear regression, linear projection, prophet projection).. look at way she projects cycles into future
-    reg1.fit(a, y) 
-    """ a: feature matrix/independent variable). Reshaped version of time_in_past
-        y: target matrix (dependent variable), reshaped version of item_arr.
-        fit: Fits the linear regression model 
-    """
-
-    # get timestamps to project phases from
-    timestamp_dif = time_in_past.iloc[-1] - time_in_past.iloc[-2] # Computes difference btw the last and second-to-last time points. Result is a time delta
-    time_in_future = np.arange(time_in_past.iloc[-1], time_in_past.iloc[-1] + timestamp_dif*1000, timestamp_dif)
-            # generates an array of future time points starting from the last time point in time_in_past, 
-            # extending into the future by timestamp_dif * 1000, with intervals of timestamp_dif
+    slope, intercept = fit_phase_line(time_in_past, item_arr)
 
+    # get timestamps to project phases from, at the sampling interval of the past phases
+    timestamp_dif = time_in_past[-1] - time_in_past[-2]
+    time_in_future = np.arange(time_in_past[-1], time_in_past[-1] + projection_duration * 24 * 60 * 60 * 1000, timestamp_dif)
 
-    # project future cycle phases from linear model
-    phases_in_future = [reg1.coef_[0][0] * t + reg1.intercept_[0] for t in time_in_future]
-            # reg1.coef_: coefficient (slope) of linear regression model
-            # reg1.coef_[0][0] extracts the coefficient for the single feature (time). When * t: The predicted phase component due to the time t
-            # reg1.intercept_: intercept of linear regression model. w/ [0] it is the constant term added to the predicted phase.
+    # project future cycle phases from linear model, then re-wrap phases to be from -pi to pi
+    round_phase = wrap_phases(slope * time_in_future + intercept)
 
+    return time_in_future, round_phase
+        # time_in_future: array of future time points
+        # round_phase: array of phases from -pi to pi
 
-    # re-wrap phases to be from -pi to pi
-    round_phase = []
-    for future_phase in phases_in_future: # loop through every value in phases_in_future
-        phase = future_phase - (future_phase // (2 * np.pi)) * (2 * np.pi) # Computes the integer number of full 2π cycles in fut_phase. Normalizes future_phase to a value within the range of -2pi to 2pi
-        round_phase.append(phase - (2 * np.pi) if phase > np.pi else phase)
-            # phase - (2 * np.pi): Adjusts the phase by subtracting 2pi if it is above pi, bringing it within range of -pi to pi
-            # else phase: If the phase is within the range, append it as-is.
 
-    return time_in_future, round_phase
-        # time_in_future: list of future time points corresponding to phases_in_future
-        # round_phase: list of adjusted phase value
+def predict_cycle(filtered_cycle, phases):
+    """
+    Gets the values of a cycle at the given phases: a cosine around the mean of the filtered cycle, with
+    the amplitude of its middle 40% of values (70th minus 30th percentile)
+    """
+    avg_amplitude = np.percentile(filtered_cycle, 70) - np.percentile(filtered_cycle, 30)
+    return avg_amplitude * np.cos(phases) + np.mean(filtered_cycle)
 
 
 def get_future_phases(time_in_past,
-                                hr_cycle):
+                                hr_cycle,
+                                projection_duration,
+                                cycle_period=None):
     """
     Generates future phases of HR cycle
     """
 
-    phases = get_phases(hr_cycle)  # get instantaneous phases of significant cycles
-    time_in_future, phase_cycles_future = get_phases_future(time_in_past, phases)
+    phases = get_phases(hr_cycle, cycle_period)  # get instantaneous phases of significant cycles
+    time_in_future, phase_cycles_future = get_phases_future(time_in_past, phases, projection_duration)
 
     return phases, time_in_future, phase_cycles_future
 
 
+def project(rhythmo_inputs, rhythmo_outputs, parameters):
+    """
+    Projects each tracked cycle (see track): the instantaneous phases of every filtered cycle are taken
+    in one Hilbert pass (in blocks, see chunked_phases) and projected with a line through the unwrapped
+    phases, for projection_duration days (4 cycle periods if not set).
 
-# Projection figure output:
-import datetime
-### cycle prediction
-phases, time_in_future, phase_cycles_future = get_future_phases(smoothed_all_hr['timestamp'].apply(lambda x: x.timestamp() * 1000), smoothed_all_hr['value'])
-
-time_in_future = pd.to_datetime(time_in_future, unit='ms')
-avg_amplitude = np.percentile(smoothed_all_hr['value'], 70) - np.percentile(smoothed_all_hr['value'], 30)
-cycle_prediction = (avg_amplitude)*(np.cos(phase_cycles_future)) + smoothed_all_hr['value'].mean()
-
-
-#def project(rhythmo_inputs, rhythmo_outputs, parameters):
\ No newline at end of file
+    Sets rhythmo_outputs.future_phases and projected_cycle (the strongest cycle), and cycle_future_phases
+    """
+    cycle_periods = rhythmo_outputs.cycle_periods
+    if not cycle_periods:
+        return rhythmo_outputs
+    if parameters.projection_method not in PROJECTION_METHODS:
+        logger.warning(f"Projection method {parameters.projection_method} is not supported, using linear")
+
+    samples_per_day = pd.Timedelta(days=1) / pd.Timedelta(parameters.data_resampling_rate)
+    timestamps = rhythmo_outputs.filtered_cycle['timestamp']
+    time_in_past = (pd.DatetimeIndex(timestamps).asi8 // 10 ** 6).astype(float) # milliseconds since epoch
+    filtered_cycles = rhythmo_outputs.filtered_cycles['value'].to_numpy(dtype=float).reshape(len(cycle_periods), -1)
+
+    # Phases of the cycles around their mean (the rescaled cycles are offset to the range of the data),
+    # strongest first
+    all_cycle_phases = get_phases(filtered_cycles - filtered_cycles.mean(axis=1, keepdims=True),
+                                  max(cycle_periods) * samples_per_day)
+
+    cycle_future_phases = []
+    for cycle_period, cycle_phase in zip(cycle_periods, all_cycle_phases):
+        time_in_future, phases_future = get_phases_future(time_in_past, cycle_phase,
+                                                          projection_horizon(parameters, cycle_period))
+        cycle_future_phases.append(pd.DataFrame({'cycle_period': cycle_period,
+                                                 'timestamp': pd.to_datetime(time_in_future, unit='ms'),
+                                                 'phase': phases_future}))
+
+    # Cycle prediction of the strongest cycle, around its mean
+    future_phases = cycle_future_phases[0][['timestamp', 'phase']]
+    cycle_prediction = predict_cycle(filtered_cycles[0], future_phases['phase'].to_numpy())
+
+    rhythmo_outputs.future_phases = future_phases
+    rhythmo_outputs.projected_cycle = pd.DataFrame({'timestamp': future_phases['timestamp'],
+                                                    'value': cycle_prediction})
+    rhythmo_outputs.cycle_future_phases = pd.concat(cycle_future_phases, ignore_index=True)
+    return rhythmo_outputs
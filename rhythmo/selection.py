@@ -1,96 +1,149 @@
-# Peak analysis
-xpeaks = []; power_relative = []
-ind_peaks = scipy.signal.find_peaks(var * glbl_power)[0]
-peak_prominence = scipy.signal.peak_prominences(var * glbl_power, ind_peaks)[0]
-
-for i in ind_peaks:
-    xpeaks.append(period[i])
-    power_relative.append([var * glbl_power - glbl_signif][0][i])
-
-if STRONGEST_PEAK == 'prominence':
-    strongest_peak = xpeaks[np.argmax(peak_prominence)]
-elif STRONGEST_PEAK == 'relative_power':
-    strongest_peak = xpeaks[np.argmax(power_relative)]
-
-loc_peak = np.where(period == strongest_peak)[0][0]
-power_peak = power[loc_peak]
-cycle_repeats = 3
-time_duration = int(strongest_peak*cycle_repeats)
-avg_power = 0
-best_segment = 0
-for start_segment in range(len(power_peak) - time_duration):
-    end_segment = start_segment + time_duration
-    test_segment = power_peak[start_segment:end_segment]
-    avg_power_segment = np.mean(test_segment)
-    if avg_power_segment > avg_power:
-          avg_power = avg_power_segment
-          best_segment = start_segment
-        
-
-xpeaks = [strongest_peak]
-print(f"Strongest peak: {strongest_peak}")
-
-
-# Trimming data to display an sample of the subject's strongest HR cycle
-sample_start = hr_resample['timestamp'].iloc[best_segment] 
-sample_end = hr_resample['timestamp'].iloc[best_segment + time_duration]
-trimmed_data = hr_resample[hr_resample['timestamp'] <= sample_end] 
-
-# Filtering data to make curve smoother
-filter_tolerance = 0.3
-fs = 1
-
-# Handling the NaNs
-nan_inds = np.where(pd.isnull(trimmed_data['value']))[0]
-intertrimmed_data = trimmed_data.copy()
-intertrimmed_data['value'][nan_inds] = np.nanmean(trimmed_data['value'])
-
-# For reversing the normalising (later)
-original_min = intertrimmed_data['value'].min()
-original_max = intertrimmed_data['value'].max()
-
-# Butter bandpass filter
-smoothed_hr = butter_bandpass_filter(intertrimmed_data['value'],
-                                        1 / ((1 + filter_tolerance) * strongest_peak),
-                                        1 / ((1 - filter_tolerance) * strongest_peak),
-                                        fs,
-                                        order=2)
-
-# Rescale the filtered data to the original range
-filtered_min = smoothed_hr.min()
-filtered_max = smoothed_hr.max()
-
-# Reversing normalisation
-if filtered_min != filtered_max:  # Just preventing division by 0
-    smoothed_hr = (smoothed_hr - filtered_min) / (filtered_max - filtered_min) # Making sure it really is normalised before reversing
-    smoothed_hr = smoothed_hr * (original_max - original_min) + original_min # Reversing with the orignal max and min instead of filtered max and min
-
-# Butter bandpass filter
-sample_data = trimmed_data.copy()
-sample_data['value'] = smoothed_hr
-sample_data['value'][nan_inds] = np.NaN # Putting the NaNs back in for accuracy
-
-
-# Butter bandpass filter
-smoothed_all = butter_bandpass_filter(hr_interpolate['value'],
-                                        1 / ((1 + filter_tolerance) * strongest_peak),
-                                        1 / ((1 - filter_tolerance) * strongest_peak),
-                                        fs,
-                                        order=2)
-
-# Rescale the filtered data to the original range
-filtered_min = smoothed_all.min() # Finding the minimum of the smoothed_all data
-filtered_max = smoothed_all.max() # Finding the maximum of the smoothed_all data
-
-# Reversing normalisation
-if filtered_min != filtered_max:  # Just preventing division by 0
-    smoothed_all = (smoothed_all - filtered_min) / (filtered_max - filtered_min) # Making sure it really is normalised before reversing
-    smoothed_all = smoothed_all * (original_max - original_min) + original_min # Reversing with the orignal max and min instead of filtered max and min
-
-# Butter bandpass filter
-smoothed_all_hr = hr_interpolate.copy()
-smoothed_all_hr['value'] = smoothed_all
-# smoothed_all_hr['value'][nan_inds] = np.NaN # Putting the NaNs back in for accuracy
-
-
-#def selection(rhythmo_inputs, rhythmo_outputs, parameters):
\ No newline at end of file
+import numpy as np
+import pandas as pd
+from scipy.signal import peak_prominences
+
+from wavelet import wavelet_transform
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+DAY = pd.Timedelta(days=1)
+# Supported values of Parameters.cycle_selection_method (spaces are read as underscores)
+SELECTION_METHODS = ('prominence', 'power', 'relative_power', 'segment_power')
+# Cycles the segment power is averaged over
+CYCLE_REPEATS = 3
+# Difference, relative to the total power, below which the average powers of two windows are equal
+# (see best_segments)
+TIE_TOLERANCE = 1e-9
+
+
+def best_segments(power, peak_locs, window_lengths):
+    """
+    Finds the window with the highest average wavelet power for each peak.
+
+    The average power of every window is computed from a cumulative sum of the power at each peak's
+    scale, so all windows of all peaks are scored in one pass rather than re-averaging each slice.
+
+    Parameters
+    ------------
+    power: 2D array of float
+        wavelet power spectrum (scales x time)
+    peak_locs: array of int
+        index of the scale (row of power) of each peak
+    window_lengths: array of int
+        length of the window (in samples) to average over for each peak
+
+    Returns
+    -------
+    best_starts: array of int
+        start index of the highest average power window for each peak (0 if no window has power)
+    best_powers: array of float
+        average power in that window for each peak
+    """
+    peak_power = np.asarray(power)[np.asarray(peak_locs)]
+    window_lengths = np.asarray(window_lengths)[:, np.newaxis]
+    num_peaks, num_samples = peak_power.shape
+
+    # Power summed over [start, end) is cumulative_power[end] - cumulative_power[start]
+    cumulative_power = np.zeros((num_peaks, num_samples + 1))
+    np.cumsum(peak_power, axis=1, out=cumulative_power[:, 1:])
+
+    # Windows [start, start + window_length) for every start before len - window_length
+    starts = np.broadcast_to(np.arange(num_samples), (num_peaks, num_samples))
+    ends = starts + window_lengths
+    valid = ends < num_samples
+    ends = np.minimum(ends, num_samples)
+    avg_power = (np.take_along_axis(cumulative_power, ends, axis=1)
+                 - np.take_along_axis(cumulative_power, starts, axis=1)) / window_lengths
+    avg_power[~valid] = 0
+
+    # The earliest window on ties. Differences of the cumulative sums carry rounding errors relative to
+    # the total power rather than to the window's, so windows within TIE_TOLERANCE of the total power
+    # (averaged over the window) of the highest average are ties
+    best_powers = avg_power.max(axis=1)
+    tolerance = TIE_TOLERANCE * cumulative_power[:, -1:] / window_lengths
+    best_starts = np.argmax(avg_power >= best_powers[:, np.newaxis] - tolerance, axis=1)
+    # Windows must have some power to be selected
+    best_starts[best_powers <= 0] = 0
+    best_powers = np.maximum(best_powers, 0)
+    return best_starts, best_powers
+
+
+def segment_powers(y, dt: float, periods, waveform: str = "morlet"):
+    """
+    Gets the highest average wavelet power over CYCLE_REPEATS cycles of each period (see best_segments).
+    Only the scales of the given periods are transformed, each is independent of the rest of the grid.
+
+    Parameters
+    ------------
+    y: array of float
+        standardised resampled values (without NaNs)
+    dt: float
+        sampling interval (in days)
+    periods: array of float
+        periods of the peaks (in days)
+    waveform: str (default = "morlet")
+        mother wavelet name
+
+    Returns
+    -------
+    segment_power: array of float
+        highest average power of each period (0 if the series is shorter than CYCLE_REPEATS cycles)
+    """
+    wave = wavelet_transform(y, dt, 1 / np.asarray(periods), waveform)[0]
+    segment_durations = (np.asarray(periods) * CYCLE_REPEATS / dt).astype(int)
+    return best_segments(np.abs(wave) ** 2, np.arange(len(periods)), segment_durations)[1]
+
+
+def peak_strengths(rhythmo_outputs, ind_peaks, method: str, parameters):
+    """Measure of how much each peak of the global wavelet power stands out, by selection method"""
+    wavelet_data = rhythmo_outputs.wavelet_data
+    power = wavelet_data['power'].to_numpy()
+
+    if method == 'prominence':
+        return peak_prominences(power, ind_peaks)[0]
+    if method == 'relative_power':
+        return (power - wavelet_data['significance'].to_numpy())[ind_peaks]
+    if method == 'segment_power':
+        dt = pd.Timedelta(parameters.data_resampling_rate) / DAY
+        return segment_powers(rhythmo_outputs.resampled_data['value'].to_numpy(dtype=float), dt,
+                              wavelet_data['period'].to_numpy()[ind_peaks], parameters.wavelet_waveform)
+    return power[ind_peaks]
+
+
+def selection(rhythmo_inputs, rhythmo_outputs, parameters):
+    """
+    Selects the cycles to track: the parameters.number_of_cycles strongest peaks of the global wavelet
+    power (see decomp) by parameters.cycle_selection_method, strongest first. A cycle_period given in
+    the parameters is tracked as the strongest cycle.
+
+    Sets rhythmo_outputs.cycle_period and cycle_periods (in days), or notes 'No cycle found'
+    """
+    method = parameters.cycle_selection_method.replace(' ', '_')
+    if method not in SELECTION_METHODS:
+        raise ValueError(f"Unsupported cycle selection method: {parameters.cycle_selection_method}. "
+                         f"Supported methods are {', '.join(SELECTION_METHODS)}")
+
+    wavelet_data = rhythmo_outputs.wavelet_data
+    ind_peaks = np.flatnonzero(wavelet_data['peak'].to_numpy())
+    xpeaks = wavelet_data['period'].to_numpy()[ind_peaks]
+
+    cycle_periods = []
+    if len(ind_peaks):
+        # Peaks from strongest to weakest (the earliest first on ties)
+        peak_strength = np.asarray(peak_strengths(rhythmo_outputs, ind_peaks, method, parameters))
+        cycle_periods = [float(xpeaks[i]) for i in np.argsort(-peak_strength, kind='stable')]
+    if parameters.cycle_period is not None:
+        cycle_periods = [float(parameters.cycle_period)] + [
+            period for period in cycle_periods if period != parameters.cycle_period]
+    cycle_periods = cycle_periods[:parameters.number_of_cycles]
+
+    if not cycle_periods:
+        logger.info("No cycle found")
+        rhythmo_outputs.notes = 'No cycle found'
+        return rhythmo_outputs
+
+    logger.info(f"Strongest peak: {cycle_periods[0]}")
+    rhythmo_outputs.cycle_period = cycle_periods[0]
+    rhythmo_outputs.cycle_periods = cycle_periods
+    return rhythmo_outputs
@@ -1,5 +1,25 @@
+from functools import lru_cache
+import math
+
+import numpy as np
+import pandas as pd
 import pycwt as cwt # continuous wavelet spectral analysis
-from scipy.signal import butter, sosfiltfilt, hilbert # tools for signal processing (filtering, fourier transforms, wavelets)
+from scipy.fft import next_fast_len
+from scipy.signal import butter, sos2zpk, sosfilt, sosfiltfilt, hilbert # tools for signal processing (filtering, fourier transforms, wavelets)
+
+# Series longer than this (plus padding) are filtered and transformed in blocks of this many samples, so
+# memory use does not grow with the length of the series
+BLOCK_LENGTH = 2 ** 18
+# Blocks are at least this many times the padding either side of them (for long cycles, whose padding
+# would otherwise outgrow BLOCK_LENGTH), so padding adds at most a quarter to the samples transformed
+MIN_BLOCK_PADS = 8
+# Blocks are padded until the impulse response of the filter has fallen below this fraction of its peak
+FILTER_TOLERANCE = 1e-9
+# Cycles of padding either side of each block for the Hilbert transform. Its kernel decays as 1 / distance,
+# so the error falls with the padding: at 32 cycles the analytic signal matches the whole-series transform
+# to within 0.1% of the RMS of the filtered series, and the phases to within 0.002 radians wherever the
+# amplitude is at least half the RMS (phases are ill-defined where the amplitude is close to 0)
+HILBERT_PAD_CYCLES = 32
 
 # Bandpass filtering
 def butter_bandpass_filter_params(lowcut: float,
@@ -63,4 +83,360 @@ def butter_bandpass_filter(data: list,
             
     return filtered_signal
 
-#def track(rhythmo_inputs, rhythmo_outputs, parameters):
\ No newline at end of file
+
+@lru_cache(maxsize=256)
+def cycle_bandpass_sos(cycle_period: float,
+                       cutoff_percentage: float,
+                       fs: float = 1,
+                       order: int = 2):
+    """
+    Gets the bandpass filter around a cycle period.
+
+    The design only depends on its arguments, so it is cached and shared between every filtering of
+    the same cycle. The returned array must not be modified (it is left writable because
+    sosfiltfilt does not accept read-only filters).
+
+    Parameters
+    ------------
+    cycle_period: float
+        period of the cycle (in samples if fs = 1)
+    cutoff_percentage: float
+        filter cutoffs either side of the cycle period, as a percentage
+    fs: float (default = 1)
+        sampling rate
+    order: int (default = 2)
+        bandpass filter order
+
+    Returns
+    -------
+    sos: array of float
+        butter bandpass filter second order sections
+    """
+    cutoff = cutoff_percentage / 100
+    sos = butter_bandpass_filter_params(1 / ((1 + cutoff) * cycle_period),
+                                        1 / ((1 - cutoff) * cycle_period),
+                                        fs,
+                                        order=order)
+    return sos
+
+
+def cycle_filter(data,
+                 cycle_period: float,
+                 cutoff_percentage: float,
+                 fs: float = 1,
+                 order: int = 2,
+                 axis: int = -1):
+    """
+    Gets bandpass filtered values around a cycle period, using the cached filter design.
+
+    Parameters
+    ----------
+    data: array of float
+        data to be filtered
+    cycle_period: float
+        period of the cycle (in samples if fs = 1)
+    cutoff_percentage: float
+        filter cutoffs either side of the cycle period, as a percentage
+    fs: float (default = 1)
+        sampling rate
+    order: int (default = 2)
+        bandpass filter order
+    axis: int (default = -1)
+        axis of data to filter along (e.g., time, for a 2D array of signals x time)
+
+    Returns
+    -------
+    filtered_signal: array of float
+        filtered continuous signal
+    """
+    return sosfiltfilt(cycle_bandpass_sos(cycle_period, cutoff_percentage, fs, order), data, axis=axis)
+
+
+@lru_cache(maxsize=256)
+def filter_settle_length(cycle_period: float,
+                         cutoff_percentage: float,
+                         fs: float = 1,
+                         order: int = 2,
+                         tolerance: float = FILTER_TOLERANCE):
+    """
+    Gets the number of samples after which the impulse response of the bandpass filter around a cycle
+    period stays below tolerance (relative to its peak). The filter rings for a number of cycles that
+    grows as the band narrows, so this is about 400 / cutoff_percentage cycles at the default tolerance.
+
+    The response is a sum of decaying exponentials, one per pole (h[n] = sum of r * p ** (n - 1) over the
+    poles p and their residues r), so it is bounded by sum(|r| * |p| ** (n - 1)), which only decreases.
+    The settle length is where that bound falls below tolerance, found by bisection, and is within a few
+    percent of (and never shorter than) the last sample of the response above tolerance. Only the first
+    few time constants of the response are simulated, for its peak.
+
+    Returns
+    -------
+    settle_length: int
+        padding (in samples) that filtering a block needs either side to match filtering the whole series
+    """
+    sos = cycle_bandpass_sos(cycle_period, cutoff_percentage, fs, order)
+    zeros, poles, gain = sos2zpk(sos)
+    magnitudes = np.abs(poles)
+    residues = np.abs([gain * np.prod(pole - zeros) / np.prod(pole - np.delete(poles, i))
+                       for i, pole in enumerate(poles)])
+
+    # The envelope of the response peaks within a few time constants (1 / (1 - |p|) samples)
+    impulse = np.zeros(math.ceil(4 / (1 - magnitudes.max())) + 1)
+    impulse[0] = 1
+    threshold = tolerance * np.abs(sosfilt(sos, impulse)).max()
+
+    def above(n):
+        return np.sum(residues * magnitudes ** (n - 1)) >= threshold
+
+    low, high = 1, 2
+    while above(high):
+        low, high = high, 2 * high
+    while low < high:
+        middle = (low + high) // 2
+        if above(middle):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def block_bounds(length: int, block_length: int):
+    """Yields the (start, end) of consecutive blocks of block_length samples covering length samples"""
+    for start in range(0, length, block_length):
+        yield start, min(length, start + block_length)
+
+
+def chunked_cycle_filter(data,
+                         cycle_period: float,
+                         cutoff_percentage: float,
+                         fs: float = 1,
+                         order: int = 2,
+                         block_length: int = BLOCK_LENGTH):
+    """
+    Gets bandpass filtered values around a cycle period (same as cycle_filter), filtering the series in
+    overlapping blocks (overlap-save), so that long series only need block-sized temporaries.
+
+    Each block is padded either side by the settle length of the filter (see filter_settle_length) and
+    only its centre is kept, so blocks match filtering the whole series to within FILTER_TOLERANCE of the
+    peak of the signal. Blocks are at least MIN_BLOCK_PADS times the settle length. Blocks at the start
+    and end of the series include the true edges, and are padded the same way sosfiltfilt pads the whole
+    series.
+
+    Parameters
+    ----------
+    data: array of float
+        data to be filtered (without NaNs), or a 2D array of signals x time (e.g., a batch of subjects)
+    cycle_period: float
+        period of the cycle (in samples if fs = 1)
+    cutoff_percentage: float
+        filter cutoffs either side of the cycle period, as a percentage
+    fs: float (default = 1)
+        sampling rate
+    order: int (default = 2)
+        bandpass filter order
+    block_length: int (default = BLOCK_LENGTH)
+        number of samples kept from each block (at least)
+
+    Returns
+    -------
+    filtered_signal: array of float
+        filtered continuous signal
+    """
+    data = np.asarray(data, dtype=float)
+    length = data.shape[-1]
+    pad = filter_settle_length(cycle_period, cutoff_percentage, fs, order)
+    block_length = max(block_length, MIN_BLOCK_PADS * pad)
+    if length <= block_length + 2 * pad:
+        return cycle_filter(data, cycle_period, cutoff_percentage, fs, order)
+
+    sos = cycle_bandpass_sos(cycle_period, cutoff_percentage, fs, order)
+    filtered_signal = np.empty_like(data)
+    for start, end in block_bounds(length, block_length):
+        padded_start = max(0, start - pad)
+        padded_end = min(length, end + pad)
+        filtered_block = sosfiltfilt(sos, data[..., padded_start:padded_end], axis=-1)
+        filtered_signal[..., start:end] = filtered_block[..., start - padded_start:end - padded_start]
+    return filtered_signal
+
+
+def chunked_phases(filtered_signal,
+                   cycle_period: float,
+                   fs: float = 1,
+                   block_length: int = BLOCK_LENGTH,
+                   pad_cycles: float = HILBERT_PAD_CYCLES):
+    """
+    Gets the instantaneous phases of a bandpass filtered signal (same as np.angle(hilbert(..., axis=-1))),
+    taking the Hilbert transform of overlapping blocks rather than one FFT over the whole series.
+
+    Each block is padded either side by pad_cycles cycles, tapered to 0 with a raised cosine, and only its
+    centre is kept (see HILBERT_PAD_CYCLES for the tolerance). The padding wraps around the ends of the
+    series, as the FFT of the whole series does, so the first and last blocks match it too. Blocks are at
+    least MIN_BLOCK_PADS times the padding.
+
+    Parameters
+    ----------
+    filtered_signal: array of float
+        signal filtered around the cycle period, or a 2D array of signals x time (e.g., a filter bank)
+    cycle_period: float
+        period of the cycle (in samples if fs = 1), the longest period for a 2D array
+    fs: float (default = 1)
+        sampling rate
+    block_length: int (default = BLOCK_LENGTH)
+        number of samples kept from each block (at least)
+    pad_cycles: float (default = HILBERT_PAD_CYCLES)
+        cycles of padding either side of each block
+
+    Returns
+    -------
+    phases: array of float
+        phases from -pi to pi
+    """
+    filtered_signal = np.asarray(filtered_signal, dtype=float)
+    length = filtered_signal.shape[-1]
+    pad = math.ceil(pad_cycles * cycle_period * fs)
+    block_length = max(block_length, MIN_BLOCK_PADS * pad)
+    if length <= block_length + 2 * pad:
+        return np.angle(hilbert(filtered_signal, axis=-1))
+
+    taper = 0.5 - 0.5 * np.cos(np.pi * np.arange(pad) / pad)
+    phases = np.empty_like(filtered_signal)
+    for start, end in block_bounds(length, block_length):
+        block = filtered_signal[..., np.arange(start - pad, end + pad) % length]
+        block[..., :pad] *= taper
+        block[..., -pad:] *= taper[::-1]
+        # The block is tapered to 0 at both ends, so zero padding it to a fast FFT length changes nothing
+        analytic = hilbert(block, N=next_fast_len(block.shape[-1]), axis=-1)
+        phases[..., start:end] = np.angle(analytic[..., pad:pad + end - start])
+    return phases
+
+
+def bandpass_phases(data,
+                    cycle_period: float,
+                    cutoff_percentage: float,
+                    fs: float = 1,
+                    order: int = 2,
+                    block_length: int = BLOCK_LENGTH):
+    """
+    Gets the instantaneous phases of the cycle: bandpass filters data around the cycle period then takes
+    the phase of the analytic signal, both in blocks (see chunked_cycle_filter and chunked_phases)
+
+    Returns
+    -------
+    filtered_signal: array of float
+        filtered continuous signal
+    phases: array of float
+        phases from -pi to pi
+    """
+    filtered_signal = chunked_cycle_filter(data, cycle_period, cutoff_percentage, fs, order, block_length)
+    return filtered_signal, chunked_phases(filtered_signal, cycle_period, fs, block_length)
+
+
+def filter_bank(data,
+                cycle_periods,
+                cutoff_percentage: float,
+                fs: float = 1,
+                order: int = 2,
+                block_length: int = BLOCK_LENGTH):
+    """
+    Gets bandpass filtered values around each of several cycle periods, one row per cycle.
+
+    Each cycle has its own filter design (cached, see cycle_bandpass_sos), and sosfiltfilt takes a
+    single design, so the rows are filtered one at a time (in blocks, see chunked_cycle_filter) into
+    one preallocated array.
+
+    Parameters
+    ----------
+    data: 1D array of float
+        data to be filtered (without NaNs)
+    cycle_periods: list of float
+        period of each cycle (in samples if fs = 1)
+    cutoff_percentage: float
+        filter cutoffs either side of each cycle period, as a percentage
+    fs: float (default = 1)
+        sampling rate
+    order: int (default = 2)
+        bandpass filter order
+    block_length: int (default = BLOCK_LENGTH)
+        number of samples kept from each block
+
+    Returns
+    -------
+    filtered_signals: 2D array of float
+        filtered continuous signal of each cycle (cycles x time)
+    """
+    data = np.asarray(data, dtype=float)
+    filtered_signals = np.empty((len(cycle_periods), len(data)))
+    for row, cycle_period in enumerate(cycle_periods):
+        filtered_signals[row] = chunked_cycle_filter(data, cycle_period, cutoff_percentage, fs, order,
+                                                     block_length)
+    return filtered_signals
+
+
+def rescale(values, new_min, new_max, axis=None):
+    """
+    Rescales values (in place) from their own range to [new_min, new_max], reversing the
+    normalisation of the filter. Constant values are left unchanged.
+
+    Parameters
+    ----------
+    values: array of float
+        modified in place
+    new_min, new_max: float, or array of float
+        range to rescale to (one per signal when rescaling along an axis)
+    axis: int, optional
+        axis to take the range along (e.g., time, for a 2D array of signals x time),
+        otherwise the range of the whole array
+
+    Returns
+    -------
+    values: array of float
+        the same array, rescaled
+    """
+    old_min = values.min(axis=axis, keepdims=True)
+    old_max = values.max(axis=axis, keepdims=True)
+    if axis is not None:
+        new_min = np.expand_dims(new_min, axis)
+        new_max = np.expand_dims(new_max, axis)
+    old_range = old_max - old_min
+    constant = old_range == 0  # Just preventing division by 0
+    values -= np.where(constant, 0, old_min)
+    values *= np.where(constant, 1, (new_max - new_min) / np.where(constant, 1, old_range))
+    values += np.where(constant, 0, new_min)
+    return values
+
+
+def track(rhythmo_inputs, rhythmo_outputs, parameters):
+    """
+    Bandpass filters the resampled data around each selected cycle period (see selection), through a
+    bank of filters over the whole series in blocks, with cutoffs parameters.bandpass_cutoff_percentage
+    either side of each period. The filtered cycles are rescaled to the range of the data before it was
+    standardised (the best segment).
+
+    Sets rhythmo_outputs.filtered_cycle (the strongest cycle) and filtered_cycles, strongest first
+    """
+    cycle_periods = rhythmo_outputs.cycle_periods
+    if not cycle_periods:
+        return rhythmo_outputs
+
+    resampled_data = rhythmo_outputs.resampled_data
+    samples_per_day = pd.Timedelta(days=1) / pd.Timedelta(parameters.data_resampling_rate)
+
+    # One filter per cycle (the designs are cached per cycle period), periods in samples
+    filtered_cycles = filter_bank(resampled_data['value'].to_numpy(dtype=float),
+                                  np.asarray(cycle_periods) * samples_per_day,
+                                  parameters.bandpass_cutoff_percentage,
+                                  fs=1,
+                                  order=2)
+
+    # For reversing the normalising. min and max skip the NaNs
+    original_min = rhythmo_outputs.best_segment['value'].min()
+    original_max = rhythmo_outputs.best_segment['value'].max()
+    rescale(filtered_cycles, np.full(len(cycle_periods), original_min),
+            np.full(len(cycle_periods), original_max), axis=-1)
+
+    timestamps = resampled_data['timestamp'].to_numpy()
+    rhythmo_outputs.filtered_cycle = pd.DataFrame({'timestamp': timestamps, 'value': filtered_cycles[0]})
+    rhythmo_outputs.filtered_cycles = pd.DataFrame({'cycle_period': np.repeat(cycle_periods, len(timestamps)),
+                                                    'timestamp': np.tile(timestamps, len(cycle_periods)),
+                                                    'value': filtered_cycles.ravel()})
+    return rhythmo_outputs
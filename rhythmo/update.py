@@ -0,0 +1,236 @@
+import hashlib
+import os
+import pickle
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from cache import stage_parameters
+from dataclass import SubjectState
+from process import resample_inputs
+from track import bandpass_phases
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+# Number of cycles of the most recent data that are re-filtered to get the phases of new samples
+FILTER_WINDOW_CYCLES = 8
+# Maximum proportion of NaNs before the state is rebuilt (same rule as check_sufficient_data)
+MAX_PROPORTION_NANS = 0.3
+DAY = pd.Timedelta(days=1)
+
+
+def state_path(state_dir: str, input_file: str) -> str:
+    """Gets the location of the saved state for an input file (by its absolute path, so inputs with the
+    same name in different folders have their own state)"""
+    name = hashlib.sha256(os.path.abspath(input_file).encode()).hexdigest()[:16]
+    return os.path.join(state_dir, f"{os.path.basename(input_file)}.{name}.state.pkl")
+
+
+def load_state(path: str) -> Optional[SubjectState]:
+    """Loads a saved subject state, returning None if there isn't one"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def save_state(state: SubjectState, path: str) -> None:
+    """Saves a subject state, replacing the previous one only once it is fully written"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path + '.tmp', path)
+
+
+def state_parameters(parameters) -> dict:
+    """Gets the parameters a state depends on: those of the stages up to track (see cache.STAGE_PARAMETERS)"""
+    return stage_parameters(parameters, 'track')
+
+
+def matches_parameters(state: SubjectState, parameters) -> bool:
+    """Whether a saved state was built with the same parameters (up to track) as those of the run"""
+    return state.stage_parameters == state_parameters(parameters)
+
+
+def cycle_phases(values, value_mean: float, cycle_period: float, parameters):
+    """
+    Gets the instantaneous phases of the cycle in a series of resampled values
+
+    Parameters
+    ------------
+    values: array of float
+        resampled values (may contain NaNs)
+    value_mean: float
+        value used in place of NaNs
+    cycle_period: float
+        period of the cycle (in days)
+    parameters: Parameters
+        uses data_resampling_rate and bandpass_cutoff_percentage
+
+    Returns
+    -------
+    phases: array of float
+        phases from -pi to pi
+    """
+    filled = np.where(np.isnan(values), value_mean, values)
+    period = cycle_period * (DAY / pd.Timedelta(parameters.data_resampling_rate)) # period in samples
+    _, phases = bandpass_phases(filled, period, parameters.bandpass_cutoff_percentage, fs=1, order=2)
+    return phases
+
+
+def days_since(timestamps, origin: pd.Timestamp):
+    """Converts timestamps to days since the origin"""
+    return ((pd.DatetimeIndex(timestamps) - origin) / DAY).to_numpy()
+
+
+def add_phases(state: SubjectState, timestamps, phases) -> None:
+    """Adds unwrapped phases to the running sums of the state's phase line"""
+    days = days_since(timestamps, state.phase_origin)
+    state.phase_count += len(days)
+    state.sum_time += days.sum()
+    state.sum_phase += phases.sum()
+    state.sum_time_squared += (days ** 2).sum()
+    state.sum_time_phase += (days * phases).sum()
+    state.last_phase_timestamp = pd.Timestamp(timestamps[-1])
+    state.last_phase = phases[-1]
+
+
+def phase_line(state: SubjectState):
+    """Gets the slope (radians per day) and intercept of the least squares phase line"""
+    n = state.phase_count
+    slope = ((n * state.sum_time_phase - state.sum_time * state.sum_phase)
+             / (n * state.sum_time_squared - state.sum_time ** 2))
+    intercept = (state.sum_phase - slope * state.sum_time) / n
+    return slope, intercept
+
+
+def build_state(rhythmo_inputs: pd.DataFrame, cycle_period: float, parameters) -> SubjectState:
+    """
+    Builds the state of a subject from its full history
+
+    Parameters
+    ------------
+    rhythmo_inputs: dataframe with columns: timestamp (milliseconds since epoch) and value
+    cycle_period: float
+        period of the selected cycle (in days)
+    parameters: Parameters
+
+    Returns
+    -------
+    SubjectState
+    """
+    resampled = resample_inputs(rhythmo_inputs, parameters.data_resampling_rate)
+    values = resampled['value'].to_numpy(dtype=float)
+
+    state = SubjectState(data_resampling_rate=parameters.data_resampling_rate,
+                         resampled_data=resampled,
+                         num_samples=len(values),
+                         num_nans=int(np.isnan(values).sum()),
+                         value_mean=float(np.nanmean(values)),
+                         cycle_period=cycle_period,
+                         phase_origin=resampled['timestamp'].iloc[0],
+                         stage_parameters=state_parameters(parameters))
+
+    phases = np.unwrap(cycle_phases(values, state.value_mean, cycle_period, parameters))
+    add_phases(state, resampled['timestamp'].to_numpy(), phases)
+    return state
+
+
+def update_state(state: SubjectState, new_rows: pd.DataFrame, parameters) -> bool:
+    """
+    Updates the state with newly appended rows.
+
+    new_rows must contain every row from the start of the last resampled bin of the state, so that
+    the last (possibly partial) bin is recomputed. Only the most recent FILTER_WINDOW_CYCLES cycles
+    are re-filtered, and the phases of the new samples are added to the phase line.
+
+    Parameters
+    ------------
+    state: SubjectState
+        updated in place if the update succeeds
+    new_rows: dataframe with columns: timestamp (milliseconds since epoch) and value
+    parameters: Parameters
+
+    Returns
+    -------
+    True if the state was updated, False if the data needs to be recomputed from the full history
+    (too many NaNs, the cycle period has drifted or too much new data to update from).
+    """
+    if new_rows.empty:
+        return True
+
+    # Replace the bins from the first new bin onwards with the newly resampled ones
+    new_bins = resample_inputs(new_rows, state.data_resampling_rate)
+    replaced = state.resampled_data['timestamp'] >= new_bins['timestamp'].iloc[0]
+    removed_bins = state.resampled_data[replaced]
+    resampled = pd.concat([state.resampled_data[~replaced], new_bins], ignore_index=True)
+
+    num_samples = state.num_samples + len(new_bins) - len(removed_bins)
+    num_nans = (state.num_nans + int(pd.isnull(new_bins['value']).sum())
+                - int(pd.isnull(removed_bins['value']).sum()))
+    if num_nans / num_samples > MAX_PROPORTION_NANS:
+        logger.info(f"Proportion of NaNs is now {num_nans / num_samples:.2f}, the best segment must be reselected")
+        return False
+
+    # Mean of the values (without NaNs), updated from the replaced and new bins
+    value_sum = (state.value_mean * (state.num_samples - state.num_nans) + np.nansum(new_bins['value'])
+                 - np.nansum(removed_bins['value']))
+    value_mean = value_sum / (num_samples - num_nans)
+
+    # Phases of the most recent cycles only
+    window_size = int(np.ceil(FILTER_WINDOW_CYCLES * state.cycle_period
+                              * (DAY / pd.Timedelta(state.data_resampling_rate))))
+    window = resampled.iloc[-window_size:]
+    window_timestamps = window['timestamp'].to_numpy()
+    phases = np.unwrap(cycle_phases(window['value'].to_numpy(dtype=float), value_mean,
+                                    state.cycle_period, parameters))
+
+    # The cycle period implied by the recent phases must stay within the bandpass filter
+    days = days_since(window_timestamps, state.phase_origin)
+    slope = np.sum((days - days.mean()) * (phases - phases.mean())) / np.sum((days - days.mean()) ** 2)
+    drift = abs(2 * np.pi / slope - state.cycle_period) / state.cycle_period
+    if drift > parameters.bandpass_cutoff_percentage / 100:
+        logger.info(f"Cycle period has drifted from {state.cycle_period} days to {2 * np.pi / slope:.2f} days")
+        return False
+
+    previous = np.flatnonzero(window_timestamps == np.datetime64(state.last_phase_timestamp))
+    if len(previous) == 0:
+        logger.info("More new data than the filter window, recomputing from the full history")
+        return False
+
+    # Continue the unwrapped phase from the previous update, keeping its cycle count
+    new_phases = phases[previous[0] + 1:]
+    if len(new_phases):
+        offset = 2 * np.pi * np.round((state.last_phase - phases[previous[0]]) / (2 * np.pi))
+        add_phases(state, window_timestamps[previous[0] + 1:], new_phases + offset)
+
+    state.resampled_data = resampled
+    state.num_samples = num_samples
+    state.num_nans = num_nans
+    state.value_mean = value_mean
+    return True
+
+
+def future_phases(state: SubjectState, parameters) -> pd.DataFrame:
+    """
+    Projects the phase line of the state into the future
+
+    Returns
+    -------
+    dataframe with columns: timestamp and phase (from -pi to pi), at the resampling rate for
+    projection_duration days (4 cycle periods if not set)
+    """
+    slope, intercept = phase_line(state)
+    duration = parameters.projection_duration or 4 * state.cycle_period
+    last_timestamp = state.resampled_data['timestamp'].iloc[-1]
+    timestamps = pd.date_range(last_timestamp, last_timestamp + duration * DAY,
+                               freq=state.data_resampling_rate)
+
+    # Re-wrap phases to be from -pi to pi
+    phase = slope * days_since(timestamps, state.phase_origin) + intercept
+    phase = phase - (phase // (2 * np.pi)) * (2 * np.pi)
+    phase = np.where(phase > np.pi, phase - 2 * np.pi, phase)
+
+    return pd.DataFrame({'timestamp': timestamps, 'phase': phase})
@@ -0,0 +1,335 @@
+import os
+
+import numpy as np
+import pycwt as cwt # continuous wavelet spectral analysis
+from scipy.signal import find_peaks, peak_prominences
+from pycwt.helpers import fft, fft_kwargs # same FFT backend (pyFFTW if installed, otherwise scipy) as pycwt
+
+from utils import LRUCache
+
+from logger.logger import get_logger
+logger = get_logger(__name__)
+
+# Mother wavelets supported by Parameters.wavelet_waveform
+WAVEFORMS = {
+    "morlet": lambda: cwt.Morlet(6), # 6 (non-dimensional frequency parameter) controls the frequency of the wavelet
+    "paul": lambda: cwt.Paul(4),
+    "dog": lambda: cwt.DOG(2),
+    "mexican_hat": cwt.MexicanHat,
+}
+
+# Daughter wavelet spectra are (number of scales x FFT length) complex arrays, so the cache is bounded
+# by size rather than by number of entries. The budget (in MB) is for the whole run: worker processes
+# split it between them (see share_kernel_cache)
+KERNEL_CACHE_MB = float(os.environ.get('RHYTHMO_KERNEL_CACHE_MB', 1024))
+KERNEL_CACHE = LRUCache(max_bytes=int(KERNEL_CACHE_MB * 1024 ** 2))
+
+# Significance levels and theoretical spectra (one value per scale) for unit variance
+SIGNIFICANCE_CACHE = LRUCache(max_bytes=64 * 1024 ** 2)
+
+# Wavelet coefficients (complex) held at once when transforming a batch of signals
+BATCH_MAX_BYTES = 256 * 1024 ** 2
+
+# Adaptive period grid: log-spaced coarse pass, refined around the most prominent peaks
+COARSE_PERIODS_PER_OCTAVE = 8
+MAX_CANDIDATE_PEAKS = 10
+PERIOD_RESOLUTION = 0.5 # spacing of the refined (and linear) period grid
+
+
+def get_wavelet(waveform: str):
+    """
+    Gets the pycwt mother wavelet for a waveform name.
+
+    Parameters
+    ------------
+    waveform: str
+        one of the keys of WAVEFORMS (e.g., "morlet")
+
+    Returns
+    -------
+    mother wavelet instance
+    """
+    if waveform not in WAVEFORMS:
+        raise ValueError(f"Unsupported wavelet waveform: {waveform}. "
+                         f"Supported waveforms are {', '.join(WAVEFORMS)}")
+    return WAVEFORMS[waveform]()
+
+
+def daughter_spectra(n_fft: int, dt: float, freqs, waveform: str = "morlet"):
+    """
+    Gets the conjugate Fourier transforms of the daughter wavelets for each frequency.
+
+    These only depend on the (padded) signal length, sampling interval, frequency grid and
+    waveform, so they are cached and shared between signals of the same length.
+
+    Parameters
+    ------------
+    n_fft: int
+        length of the signal's Fourier transform (after padding)
+    dt: float
+        sampling interval
+    freqs: array of float
+        Fourier frequencies to compute the wavelet transform at
+    waveform: str (default = "morlet")
+        mother wavelet name
+
+    Returns
+    -------
+    sj: array of float
+        wavelet scales for each frequency
+    psi_ft_bar: array of complex
+        scales x n_fft matrix of normalised, conjugated daughter wavelet spectra
+    """
+    freqs = np.asarray(freqs, dtype=float)
+    key = (n_fft, float(dt), freqs.tobytes(), waveform)
+
+    def compute():
+        wavelet = get_wavelet(waveform)
+        sj = 1 / (wavelet.flambda() * freqs) # wavelet scales for the given Fourier frequencies
+        ftfreqs = 2 * np.pi * fft.fftfreq(n_fft, dt) # Fourier angular frequencies
+
+        # Outer product of the scales and the angular frequencies, as in pycwt.cwt
+        sj_col = sj[:, np.newaxis]
+        psi_ft_bar = (sj_col * ftfreqs[1] * n_fft) ** 0.5 * np.conjugate(wavelet.psi_ft(sj_col * ftfreqs))
+
+        # Shared between calls, so make sure nobody modifies them in place
+        sj.flags.writeable = False
+        psi_ft_bar.flags.writeable = False
+        return sj, psi_ft_bar
+
+    return KERNEL_CACHE.get_or_compute(key, compute)
+
+
+def wavelet_transform(signal, dt: float, freqs, waveform: str = "morlet"):
+    """
+    Continuous wavelet transform of the signal at the given frequencies.
+
+    Equivalent to pycwt.cwt(signal, dt, wavelet=get_wavelet(waveform), freqs=freqs), but the
+    daughter wavelet spectra come from the kernel cache instead of being rebuilt for every signal.
+
+    Parameters
+    ------------
+    signal: array of float
+        input time series data
+    dt: float
+        sampling interval
+    freqs: array of float
+        Fourier frequencies over which the CWT is computed
+    waveform: str (default = "morlet")
+        mother wavelet name
+
+    Returns
+    -------
+    wave: wavelet transform of the signal (scales x len(signal))
+    scales: wavelet scales corresponding to the wavelet transform
+    freqs: frequencies associated with the scales
+    coi: cone of influence (where edge effects distort the wavelet transform)
+    fft: Fourier transform of the signal
+    fftfreqs: Fourier frequencies corresponding to fft
+    """
+    signal = np.asarray(signal)
+    freqs = np.asarray(freqs, dtype=float)
+    n0 = len(signal)
+
+    signal_ft = fft.fft(signal, **fft_kwargs(signal)) # signal Fourier transform
+    n_fft = len(signal_ft)
+    sj, psi_ft_bar = daughter_spectra(n_fft, dt, freqs, waveform)
+
+    # Wavelet transform according to the convolution theorem
+    wave = fft.ifft(signal_ft * psi_ft_bar, axis=1, **fft_kwargs(signal_ft, overwrite_x=True))
+
+    # Removes scales where the transform is all NaN
+    sel = np.invert(np.isnan(wave).all(axis=1))
+    if np.any(sel):
+        sj = sj[sel]
+        freqs = freqs[sel]
+        wave = wave[sel, :]
+
+    # Cone of influence in Fourier periods, using a triangular Bartlett window with non-zero end points
+    wavelet = get_wavelet(waveform)
+    coi = n0 / 2 - np.abs(np.arange(0, n0) - (n0 - 1) / 2)
+    coi = wavelet.flambda() * wavelet.coi() * dt * coi
+
+    ftfreqs = 2 * np.pi * fft.fftfreq(n_fft, dt)
+    return (wave[:, :n0],
+            np.array(sj),
+            freqs,
+            coi,
+            signal_ft[1:n_fft // 2] / n_fft ** 0.5,
+            ftfreqs[1:n_fft // 2] / (2 * np.pi))
+
+
+def significance(variance: float, dt: float, scales, sigma_test: int = 0, alpha: float = 0.0,
+                 significance_level: float = 0.95, dof=-1, waveform: str = "morlet",
+                 alpha_decimals=None):
+    """
+    Significance test for the wavelet power spectrum, as pycwt.significance with a variance given.
+
+    The significance levels and theoretical spectrum are proportional to the variance, so they are
+    computed (including the chi-square terms) once for unit variance per (dt, scales, sigma_test,
+    alpha, significance_level, dof, waveform), cached, and rescaled for each signal.
+
+    Parameters
+    ------------
+    variance: float
+        variance of the signal
+    dt: float
+        sampling interval
+    scales: array of float
+        wavelet scales returned by wavelet_transform
+    sigma_test: int (default = 0)
+        0 for the pointwise chi-square test, 1 for the time-averaged (global) test
+    alpha: float (default = 0.0)
+        AR(1) lag-1 autocorrelation, which models the background spectrum
+    significance_level: float (default = 0.95)
+        significance level
+    dof: float or array of float (default = -1)
+        degrees of freedom, as in pycwt.significance
+    waveform: str (default = "morlet")
+        mother wavelet name
+    alpha_decimals: int, optional
+        if given, alpha is rounded to this many decimals so nearly identical signals share a table
+
+    Returns
+    -------
+    signif: array of float
+        significance levels for each scale
+    fft_theor: array of float
+        theoretical (red noise) spectrum used for significance testing
+    """
+    if alpha_decimals is not None:
+        alpha = round(alpha, alpha_decimals)
+    scales = np.asarray(scales, dtype=float)
+    dof = np.asarray(dof, dtype=float)
+    key = (float(dt), scales.tobytes(), sigma_test, float(alpha), significance_level,
+           dof.shape, dof.tobytes(), waveform)
+
+    def compute():
+        # pycwt modifies an array dof in place, so give it a copy
+        unit_signif, unit_fft_theor = cwt.significance(
+            1.0, dt, scales, sigma_test, alpha, significance_level=significance_level,
+            dof=dof.copy() if dof.ndim else float(dof), wavelet=get_wavelet(waveform))
+        unit_signif.flags.writeable = False
+        unit_fft_theor.flags.writeable = False
+        return unit_signif, unit_fft_theor
+
+    unit_signif, unit_fft_theor = SIGNIFICANCE_CACHE.get_or_compute(key, compute)
+    return variance * unit_signif, variance * unit_fft_theor
+
+
+def global_wavelet_power(signals, dt: float, freqs, waveform: str = "morlet",
+                         max_bytes: int = BATCH_MAX_BYTES):
+    """
+    Global wavelet power (the wavelet power averaged over time) of a batch of equal length signals.
+
+    Same as averaging abs(wavelet_transform(signal, ...)[0]) ** 2 over time for each signal, but the
+    Fourier transforms and the convolution with the (cached) daughter wavelets are done for many
+    signals at once. Signals are transformed in groups so that at most max_bytes of wavelet
+    coefficients are held at a time.
+
+    Parameters
+    ------------
+    signals: 2D array of float
+        signals x time
+    dt: float
+        sampling interval
+    freqs: array of float
+        Fourier frequencies over which the CWT is computed
+    waveform: str (default = "morlet")
+        mother wavelet name
+    max_bytes: int (default = 256 MB)
+        memory for the wavelet coefficients of a group of signals
+
+    Returns
+    -------
+    glbl_power: 2D array of float
+        signals x scales global wavelet power
+    scales: array of float
+        wavelet scales corresponding to the frequencies
+    """
+    signals = np.atleast_2d(signals)
+    num_signals, n0 = signals.shape
+
+    signals_ft = fft.fft(signals, axis=-1, **fft_kwargs(signals[0])) # Fourier transform of every signal
+    n_fft = signals_ft.shape[-1]
+    sj, psi_ft_bar = daughter_spectra(n_fft, dt, freqs, waveform)
+
+    glbl_power = np.empty((num_signals, len(sj)))
+    group_size = max(1, max_bytes // (len(sj) * n_fft * 16))
+    for start in range(0, num_signals, group_size):
+        end = min(start + group_size, num_signals)
+        # signals x scales x time wavelet transform, according to the convolution theorem
+        wave = fft.ifft(signals_ft[start:end, np.newaxis, :] * psi_ft_bar, axis=-1)
+        glbl_power[start:end] = (np.abs(wave[..., :n0]) ** 2).mean(axis=-1)
+    return glbl_power, np.array(sj)
+
+
+def adaptive_periods(signal, dt: float, min_period: float, max_period: float, waveform: str = "morlet",
+                     periods_per_octave: int = COARSE_PERIODS_PER_OCTAVE,
+                     max_candidates: int = MAX_CANDIDATE_PEAKS,
+                     resolution: float = PERIOD_RESOLUTION):
+    """
+    Coarse-to-fine period grid for the wavelet transform.
+
+    A coarse pass at periods_per_octave log-spaced periods finds the candidate peaks of the global
+    wavelet power. The grid is then refined to the linear grid (min_period + k * resolution) between
+    the coarse neighbours of the most prominent candidates, so peaks are still resolved to resolution,
+    with far fewer scales than a linear grid over the whole range.
+
+    Parameters
+    ------------
+    signal: array of float
+        input time series data, or a 2D array of signals x time (the grid is then refined around the
+        candidate peaks of every signal, so the signals share it)
+    dt: float
+        sampling interval
+    min_period, max_period: float
+        range of periods (same units as dt)
+    waveform: str (default = "morlet")
+        mother wavelet name
+    periods_per_octave: int (default = 8)
+        number of coarse periods per doubling of the period
+    max_candidates: int (default = 10)
+        number of peaks (by prominence) to refine around
+    resolution: float (default = 0.5)
+        spacing of the refined periods
+
+    Returns
+    -------
+    periods: array of float
+        sorted periods, all on the linear grid min_period + k * resolution
+    """
+    def snap(periods):
+        # Round periods onto the linear grid, within [min_period, max_period)
+        steps = np.round((np.asarray(periods) - min_period) / resolution)
+        steps = np.clip(steps, 0, np.ceil((max_period - min_period) / resolution) - 1)
+        return np.unique(min_period + steps * resolution)
+
+    num_octaves = np.log2(max_period / min_period)
+    coarse = snap(min_period * 2 ** (np.arange(0, num_octaves * periods_per_octave + 1) / periods_per_octave))
+
+    glbl_power = global_wavelet_power(np.atleast_2d(signal), dt, 1 / coarse, waveform)[0]
+
+    # Refine between the coarse neighbours of the most prominent peaks (of each signal)
+    refined = []
+    for power in glbl_power:
+        ind_peaks = find_peaks(power)[0]
+        prominence = peak_prominences(power, ind_peaks)[0]
+        candidates = ind_peaks[np.argsort(prominence)[::-1][:max_candidates]]
+        refined.extend(np.arange(coarse[i - 1], coarse[i + 1], resolution) for i in candidates)
+    return snap(np.concatenate([coarse, *refined]))
+
+
+def adaptive_freqs(signal, dt: float, min_period: float, max_period: float, waveform: str = "morlet"):
+    """Frequencies (1 / period) of the adaptive period grid, see adaptive_periods"""
+    return 1 / adaptive_periods(signal, dt, min_period, max_period, waveform)
+
+
+def share_kernel_cache(workers: int) -> None:
+    """Sets the kernel cache of a worker process to its share of the budget, with workers processes"""
+    KERNEL_CACHE.resize(int(KERNEL_CACHE_MB * 1024 ** 2 / max(1, workers)))
+
+
+def cache_report() -> dict:
+    """Returns the hit rates and sizes of the wavelet kernel and significance caches."""
+    return {'wavelet_kernels': KERNEL_CACHE.info(), 'significance': SIGNIFICANCE_CACHE.info()}
@@ -0,0 +1,297 @@
+import copy
+import itertools
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+import numpy as np
+
+from logger.logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+# Requests whose latency is kept for the /health percentiles
+LATENCY_WINDOW = 1000
+
+# Runtime of each worker process, created once by _init_worker and reused by every request
+_RUNTIME = None
+
+
+def _init_worker(outputs: List[str], parameters: Optional[str], cache_dir: Optional[str], cache_size: float,
+                 coverage_dir: Optional[str], workers: int) -> None:
+    """
+    Creates the runtime of a worker process and imports every stage it runs, so requests start warm.
+    Each worker keeps its share of the wavelet kernel cache.
+    """
+    global _RUNTIME  # pylint: disable=global-statement
+    from main import STAGES, Run, load_stage  # pylint: disable=import-outside-toplevel
+    from wavelet import share_kernel_cache  # pylint: disable=import-outside-toplevel
+
+    share_kernel_cache(workers)
+
+    _RUNTIME = Run([], outputs, parameters, cache_dir=cache_dir, cache_size=cache_size,
+                   coverage_dir=coverage_dir)
+    for name, step in STAGES:
+        if step <= _RUNTIME.step:
+            try:
+                load_stage(name)
+            except Exception as e:
+                logger.warning(f"Could not import stage {name} in worker {os.getpid()}: {e}")
+
+
+def _run_request(request_id: str, job: dict) -> dict:
+    """
+    Runs one request in a worker process: an input file (as the run command does) or inline data, with
+    parameter overrides
+
+    Returns
+    -------
+    dict of the response: status, error, duration, cycle_period, cycle_periods, future_phases and metrics
+    """
+    # pylint: disable=import-outside-toplevel,protected-access
+    import pandas as pd
+    from dataclass import FileResult
+    from instrumentation import Instrumentation
+    from utils import check_input
+
+    runtime = copy.copy(_RUNTIME)
+    runtime.parameters = replace(_RUNTIME.parameters, **job.get('parameters', {}))
+
+    with log_context(request_id):
+        if 'input' in job:
+            result = runtime._run_file(job['input'])
+        else:
+            started = time.perf_counter()
+            instrumentation = Instrumentation(request_id, runtime.trace_memory)
+            try:
+                rhythmo_inputs = pd.DataFrame(job['data'])
+                check_input(rhythmo_inputs)
+                rhythmo_inputs = rhythmo_inputs[['timestamp', 'value']]
+                rhythmo_outputs = runtime._run_rhythmo(rhythmo_inputs, instrumentation)
+                if rhythmo_outputs is None:
+                    result = FileResult(request_id, status='skipped', error='Insufficient data',
+                                        duration=time.perf_counter() - started, metrics=instrumentation.records)
+                else:
+                    runtime._run_output_handlers(rhythmo_inputs, rhythmo_outputs, instrumentation)
+                    result = FileResult(request_id, duration=time.perf_counter() - started,
+                                        rhythmo_outputs=rhythmo_outputs, metrics=instrumentation.records)
+            except Exception as e:
+                logger.error(f"[{request_id}] Failed to finish Rhythmo due to: {e}", exc_info=True)
+                result = FileResult(request_id, status='failed', duration=time.perf_counter() - started,
+                                    error=str(e), metrics=instrumentation.records)
+
+    response = {'status': result.status, 'error': result.error, 'duration': result.duration,
+                'cycle_period': None, 'cycle_periods': None, 'future_phases': None, 'metrics': result.metrics}
+    rhythmo_outputs = result.rhythmo_outputs
+    if rhythmo_outputs is not None:
+        response['cycle_period'] = rhythmo_outputs.cycle_period
+        response['cycle_periods'] = rhythmo_outputs.cycle_periods
+        future_phases = rhythmo_outputs.future_phases
+        if future_phases is not None:
+            # Timestamps in milliseconds since epoch, as in the inputs
+            response['future_phases'] = {
+                'timestamp': (pd.DatetimeIndex(future_phases['timestamp']).asi8 // 10 ** 6).tolist(),
+                'phase': future_phases['phase'].astype(float).tolist()}
+    return response
+
+
+class RhythmoServer:
+    """
+    Runs rhythmo requests on a pool of long-lived worker processes, which keep the stages imported and
+    their caches (filter designs, wavelet kernels and significance tables) warm between requests.
+
+    At most max_queue requests are pending (queued or running) at once: further requests are rejected
+    rather than queued, so callers can back off. Counts and latencies are kept for health().
+    """
+
+    def __init__(self, outputs: List[str], parameters: Optional[str] = None, workers: int = 1,
+                 max_queue: int = 64, cache_dir: Optional[str] = None, cache_size: float = 1024,
+                 coverage_dir: Optional[str] = None):
+        """
+        Parameters
+        ----------
+        outputs: list of str, outputs whose output handlers are run for every request (the last step
+            needed by them is run)
+        parameters: str, optional, parameters file, overridden per request
+        workers: int, number of worker processes
+        max_queue: int, maximum number of pending requests
+        cache_dir, cache_size, coverage_dir: see Run
+        """
+        self.workers = max(1, workers)
+        self.max_queue = max_queue
+        self.started = time.time()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                             initargs=(outputs, parameters, cache_dir, cache_size, coverage_dir,
+                                                       self.workers))
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = 0
+        self._counts = {'requests': 0, 'finished': 0, 'skipped': 0, 'failed': 0, 'rejected': 0}
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+
+        # Start every worker now rather than on the first requests
+        for future in [self._executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def run(self, job: dict) -> Optional[dict]:
+        """
+        Runs a request, waiting for a worker
+
+        Parameters
+        ----------
+        job: dict with either 'input' (path of an input file) or 'data' (dict of timestamp and value lists,
+            or a list of records), and optionally 'parameters' (dict of parameter overrides)
+
+        Returns
+        -------
+        dict of the response (see _run_request), or None if the request was rejected (too many pending)
+        """
+        with self._lock:
+            self._counts['requests'] += 1
+            if self._pending >= self.max_queue:
+                self._counts['rejected'] += 1
+                return None
+            self._pending += 1
+            # Numbered, so requests for the same input are told apart in the logs
+            request_id = f"request-{next(self._ids)}"
+            if 'input' in job:
+                request_id += f" {job['input']}"
+
+        started = time.perf_counter()
+        try:
+            response = self._executor.submit(_run_request, request_id, job).result()
+        except Exception as e:
+            # The worker itself died (e.g. killed for memory)
+            logger.error(f"[{request_id}] Worker failed to run Rhythmo due to: {e}", exc_info=True)
+            response = {'status': 'failed', 'error': str(e)}
+        latency = time.perf_counter() - started
+
+        with self._lock:
+            self._pending -= 1
+            self._counts[response['status']] = self._counts.get(response['status'], 0) + 1
+            self._latencies.append(latency)
+        response['latency'] = latency
+        return response
+
+    def health(self) -> dict:
+        """Gets the state of the server: pending requests, request counts and latency percentiles (s)"""
+        with self._lock:
+            latencies = np.array(self._latencies)
+            health = {'status': 'ok', 'uptime': time.time() - self.started, 'workers': self.workers,
+                      'queue_depth': self._pending, 'max_queue': self.max_queue, **self._counts}
+        health['latency'] = {'mean': float(latencies.mean()),
+                             'p50': float(np.percentile(latencies, 50)),
+                             'p95': float(np.percentile(latencies, 95)),
+                             'max': float(latencies.max())} if len(latencies) else None
+        return health
+
+    def close(self) -> None:
+        """Waits for the running requests, then stops the workers"""
+        self._executor.shutdown(wait=True)
+
+
+def validate_job(job) -> Optional[str]:
+    """Checks a request body, returning the reason it is invalid (or None)"""
+    from dataclass import Parameters  # pylint: disable=import-outside-toplevel
+
+    if not isinstance(job, dict):
+        return "Request body must be a json object"
+    if ('input' in job) == ('data' in job):
+        return "Request must contain one of input (path of an input file) or data (timestamp and value)"
+    if 'input' in job and not os.path.isfile(job['input']):
+        return f"Input {job['input']} does not exist"
+    overrides = job.get('parameters', {})
+    if not isinstance(overrides, dict):
+        return "parameters must be a json object of parameter overrides"
+    unknown = sorted(set(overrides) - {field.name for field in fields(Parameters)})
+    if unknown:
+        return f"Unknown parameters: {', '.join(unknown)}"
+    return None
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    """
+    HTTP interface of a RhythmoServer (self.server.rhythmo):
+
+        POST /predict   runs a request (see RhythmoServer.run), 503 if too many are pending
+        GET /health     server state (see RhythmoServer.health)
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        if self.path == '/health':
+            self._respond(200, self.server.rhythmo.health())
+        else:
+            self._respond(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self) -> None:  # pylint: disable=invalid-name
+        if self.path != '/predict':
+            self._respond(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            job = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError as e:
+            self._respond(400, {'error': f"Request body is not valid json: {e}"})
+            return
+        error = validate_job(job)
+        if error:
+            self._respond(400, {'error': error})
+            return
+
+        response = self.server.rhythmo.run(job)
+        if response is None:
+            self._respond(503, {'error': 'Too many pending requests'})
+        else:
+            self._respond(200, response)
+
+    def _respond(self, code: int, body: dict) -> None:
+        data = json.dumps(body, default=str).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix-socket'
+
+    def log_message(self, format, *args) -> None:  # pylint: disable=redefined-builtin
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket, handling each connection on its own thread"""
+    daemon_threads = True
+
+
+def serve(rhythmo: RhythmoServer, host: str = '127.0.0.1', port: int = 8350,
+          socket_path: Optional[str] = None) -> None:
+    """Serves requests on a local port (or a Unix socket) until interrupted, then stops the workers"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        http_server = UnixHTTPServer(socket_path, RequestHandler)
+        address = socket_path
+    else:
+        http_server = ThreadingHTTPServer((host, port), RequestHandler)
+        address = f"http://{host}:{http_server.server_address[1]}"
+    http_server.rhythmo = rhythmo
+
+    logger.info(f"Serving rhythmo on {address} with {rhythmo.workers} workers")
+    try:
+        http_server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping rhythmo server")
+    finally:
+        http_server.server_close()
+        rhythmo.close()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
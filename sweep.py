@@ -0,0 +1,140 @@
+import itertools
+from dataclasses import fields, replace
+from functools import partial
+from typing import Dict, List, Union
+
+import pandas as pd
+
+from cache import stage_parameters
+from dataclass import Parameters, RhythmoOutput
+from main import STAGES, load_stage
+from utils import check_input, read_input
+
+from logger.logger import get_logger, log_context
+
+logger = get_logger(__name__)
+
+
+def expand_grid(grid: Union[Dict[str, list], List[dict]]) -> List[dict]:
+    """
+    Expands a grid of parameter overrides into one dict of overrides per variant
+
+    Parameters
+    ----------
+    grid: dict of parameter name to the list of values to try (every combination is a variant),
+        or a list of dicts of overrides (one per variant)
+
+    Returns
+    -------
+    list of dict of parameter name to value
+    """
+    variants = grid if isinstance(grid, list) else [
+        dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+
+    names = {field.name for field in fields(Parameters)}
+    unknown = sorted({name for variant in variants for name in variant} - names)
+    if unknown:
+        raise ValueError(f"Unknown parameters in the sweep grid: {', '.join(unknown)}")
+    return variants
+
+
+def stage_key(stage: str, parameters: Parameters) -> tuple:
+    """Identifies the outputs of a stage by the parameters it and the earlier stages read"""
+    return (stage, tuple(sorted(stage_parameters(parameters, stage).items(), key=lambda item: item[0])))
+
+
+def sweep_input(rhythmo_inputs, base_parameters: Parameters, variants: List[dict], step: int):
+    """
+    Runs every variant on one input, computing each stage once per distinct set of the parameters it
+    depends on (see STAGE_PARAMETERS): e.g. decomp once per waveform. The inputs are resampled at every
+    rate of the grid in one pass.
+    Stage outputs are shared between the variants that need them.
+
+    Returns
+    -------
+    outputs: list of RhythmoOutput (None if a stage found insufficient data, or the exception that
+        stopped the variant), one per variant
+    num_runs: int, number of stages computed
+    """
+    stages = [(name, load_stage(name)) for name, stage_step in STAGES if stage_step <= step]
+
+    # Resample the inputs at every rate of the grid in one pass (see process.resample_pyramid)
+    rates = list(dict.fromkeys(replace(base_parameters, **overrides).data_resampling_rate for overrides in variants))
+    if len(rates) > 1:
+        from process import resample_pyramid # pylint: disable=import-outside-toplevel
+        pyramid = resample_pyramid(rhythmo_inputs, rates)
+        stages = [(name, partial(stage, pyramid=pyramid) if name == 'process' else stage) for name, stage in stages]
+
+    computed = {} # stage key to the stage's outputs, None (insufficient data) or the exception it raised
+    outputs = []
+    for overrides in variants:
+        parameters = replace(base_parameters, **overrides)
+        rhythmo_outputs = RhythmoOutput.build_empty()
+        for name, stage in stages:
+            key = stage_key(name, parameters)
+            if key not in computed:
+                try:
+                    # Stages update the outputs in place, so each one works on a copy of the shared outputs
+                    computed[key] = stage(rhythmo_inputs, rhythmo_outputs.copy(), parameters)
+                except Exception as e:
+                    computed[key] = e
+            rhythmo_outputs = computed[key]
+            if rhythmo_outputs is None or isinstance(rhythmo_outputs, Exception):
+                break
+        outputs.append(rhythmo_outputs)
+    return outputs, len(computed)
+
+
+def run_sweep(inputs: List[str], base_parameters: Parameters, grid, step: int) -> pd.DataFrame:
+    """
+    Runs every variant of the grid on every input
+
+    Parameters
+    ----------
+    inputs: list of str, input files
+    base_parameters: Parameters, values of the parameters the grid does not override
+    grid: dict of parameter name to list of values, or list of dicts of overrides (see expand_grid)
+    step: int, last step to run (see STEPS in main.py)
+
+    Returns
+    -------
+    dataframe with one row per (input file, variant): input_file, variant, the overridden parameters,
+    status ('finished', 'skipped' for insufficient data or 'failed'), cycle_period, num_future_phases, notes
+    and error
+    """
+    variants = expand_grid(grid)
+    override_names = list(dict.fromkeys(name for variant in variants for name in variant))
+    logger.info(f"Sweeping {len(variants)} variants of {', '.join(override_names)} over {len(inputs)} inputs")
+
+    rows = []
+    for input_file in inputs:
+        with log_context(input_file):
+            try:
+                rhythmo_inputs = read_input(input_file)
+                check_input(rhythmo_inputs)
+                outputs, num_runs = sweep_input(rhythmo_inputs, base_parameters, variants, step)
+                logger.info(f"[{input_file}] Ran {num_runs} stages for {len(variants)} variants "
+                            f"(instead of {len(variants) * len([s for s in STAGES if s[1] <= step])})")
+            except Exception as e:
+                logger.error(f"[{input_file}] Failed to sweep due to: {e}", exc_info=True)
+                outputs = [e] * len(variants)
+
+        for i, (overrides, rhythmo_outputs) in enumerate(zip(variants, outputs)):
+            parameters = replace(base_parameters, **overrides)
+            row = {'input_file': input_file, 'variant': i,
+                   **{name: getattr(parameters, name) for name in override_names}}
+            if rhythmo_outputs is None:
+                row.update(status='skipped', cycle_period=None, num_future_phases=None, notes=None,
+                           error='Insufficient data')
+            elif isinstance(rhythmo_outputs, Exception):
+                row.update(status='failed', cycle_period=None, num_future_phases=None, notes=None,
+                           error=str(rhythmo_outputs))
+            else:
+                future_phases = rhythmo_outputs.future_phases
+                row.update(status='finished', cycle_period=rhythmo_outputs.cycle_period,
+                           num_future_phases=None if future_phases is None else len(future_phases),
+                           notes=rhythmo_outputs.notes, error=None)
+            rows.append(row)
+
+    return pd.DataFrame(rows, columns=['input_file', 'variant', *override_names, 'status', 'cycle_period',
+                                       'num_future_phases', 'notes', 'error'])
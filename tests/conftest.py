@@ -0,0 +1,25 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# The top level modules and the stages (in rhythmo/) are imported by name, as the CLI does
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'rhythmo')]
+
+HOUR = 60 * 60 * 1000
+
+
+@pytest.fixture
+def rhythmo_inputs():
+    """Hourly inputs (timestamps in milliseconds since epoch) over 60 days with a 7 day cycle and gaps"""
+    rng = np.random.default_rng(0)
+    # One row within each hour, apart from the gaps
+    start = 1_600_000_000_000 // HOUR * HOUR
+    timestamps = start + np.arange(60 * 24) * HOUR + rng.integers(0, HOUR, 60 * 24)
+    days = (timestamps - timestamps[0]) / (24 * HOUR)
+    values = np.sin(2 * np.pi * days / 7) + 0.3 * rng.standard_normal(len(days))
+    keep = rng.random(len(days)) > 0.1
+    return pd.DataFrame({'timestamp': timestamps[keep], 'value': values[keep].astype(np.float32)})
@@ -0,0 +1,94 @@
+import os
+from dataclasses import replace
+
+import pandas as pd
+import pytest
+
+from cache import ResultCache
+from dataclass import Parameters, RhythmoOutput
+from main import STAGES, Run
+
+
+def outputs_of_size(num_rows: int) -> RhythmoOutput:
+    return RhythmoOutput(resampled_data=pd.DataFrame({'timestamp': pd.date_range('2020-01-01', periods=num_rows,
+                                                                                 freq='1H'),
+                                                      'value': range(num_rows)}), notes='cached')
+
+
+def test_cache_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024 ** 2)
+    key = cache.stage_key('input hash', Parameters(), 'process')
+    # Under budget, so puts don't scan the cache for entries to evict
+    cache.evict = lambda: pytest.fail('evicted under budget')
+
+    assert cache.get(key) is None
+    cache.put(key, outputs_of_size(10))
+    cached = cache.get(key)
+    assert cached.notes == 'cached'
+    pd.testing.assert_frame_equal(cached.resampled_data, outputs_of_size(10).resampled_data)
+    assert cache.get(cache.stage_key('other input hash', Parameters(), 'process')) is None
+
+
+def test_cache_keys_change_with_the_parameters_of_each_stage(tmp_path):
+    cache = ResultCache(str(tmp_path), 1024 ** 2)
+    parameters = Parameters()
+    changed = replace(parameters, bandpass_cutoff_percentage=20)
+
+    # Stages before track don't depend on the cutoff, track and the stages after it do
+    for stage in ['process', 'decomp', 'selection']:
+        assert cache.stage_key('hash', parameters, stage) == cache.stage_key('hash', changed, stage)
+    for stage in ['track', 'project', 'forecast']:
+        assert cache.stage_key('hash', parameters, stage) != cache.stage_key('hash', changed, stage)
+
+
+def test_run_reuses_cached_stages_until_parameters_change(tmp_path, rhythmo_inputs):
+    input_file = str(tmp_path / 'input.csv')
+    rhythmo_inputs.to_csv(input_file, index=False)
+    cache_dir = str(tmp_path / 'cache')
+
+    def stages_run(parameters=None):
+        runtime = Run([input_file], ['project_cycle'], parameters, cache_dir=cache_dir)
+        result = runtime.run()[0]
+        assert result.status == 'finished'
+        # Stages loaded from the cache are not run, so have no metrics
+        stage_names = [name for name, _ in STAGES]
+        return [record['stage'] for record in result.metrics if record['stage'] in stage_names], result
+
+    first_stages, first = stages_run()
+    assert first_stages == ['process', 'decomp', 'selection', 'track', 'project']
+    cached_stages, cached = stages_run()
+    assert not cached_stages
+    pd.testing.assert_frame_equal(cached.rhythmo_outputs.projected_cycle, first.rhythmo_outputs.projected_cycle)
+
+    # Changing the cutoff reruns track and project only
+    parameters_file = str(tmp_path / 'parameters.json')
+    with open(parameters_file, 'w') as f:
+        f.write('{"bandpass_cutoff_percentage": 20}')
+    changed_stages, _ = stages_run(parameters_file)
+    assert changed_stages == ['track', 'project']
+
+
+def test_cache_evicts_least_recently_used_once_over_budget(tmp_path):
+    size = os.path.getsize(_put(ResultCache(str(tmp_path / 'probe'), 10 ** 9), 'probe'))
+    cache = ResultCache(str(tmp_path / 'cache'), 3 * size)
+
+    for i, key in enumerate(['a', 'b', 'c']):
+        os.utime(_put(cache, key), (i, i))
+    assert cache.nbytes == 3 * size
+    # Using 'a' makes 'b' the least recently used
+    cache.get('a')
+
+    _put(cache, 'd')
+    assert cache.info() == {'items': 3, 'nbytes': 3 * size}
+    assert cache.nbytes == 3 * size
+    assert cache.get('b') is None
+    assert all(cache.get(key) is not None for key in ['a', 'c', 'd'])
+
+    # Replacing an entry doesn't count it twice
+    _put(cache, 'd')
+    assert cache.nbytes == 3 * size and cache.info()['items'] == 3
+
+
+def _put(cache: ResultCache, key: str) -> str:
+    cache.put(key, outputs_of_size(10))
+    return cache.path(key)
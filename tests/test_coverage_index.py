@@ -0,0 +1,72 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from coverage_index import build_coverage, load_coverage, resampled_coverage, save_coverage, sufficient_coverage
+from process import check_sufficient_data, resample_inputs
+
+MINUTE = 60 * 1000
+DAY = 24 * 60 * MINUTE
+
+
+def recording(num_days: int, kept_days, seed: int = 0):
+    """Inputs every 2 minutes (jittered) on the kept days of num_days from midnight, with 5% NaN values"""
+    rng = np.random.default_rng(seed)
+    start = 1_600_000_000_000 // DAY * DAY
+    num_rows = num_days * 24 * 30
+    timestamps = start + np.arange(num_rows) * 2 * MINUTE + rng.integers(0, 2 * MINUTE, num_rows)
+    timestamps = timestamps[np.isin((timestamps - start) // DAY, kept_days)]
+    values = 60 + 10 * rng.standard_normal(len(timestamps))
+    values[rng.random(len(values)) < 0.05] = np.nan
+    return pd.DataFrame({'timestamp': timestamps, 'value': values})
+
+
+RECORDINGS = {
+    # Under 30% NaN overall
+    'dense': lambda: recording(120, np.arange(120)),
+    # Over 30% NaN overall, but with a dense segment of more than 90 days
+    'dense_segment': lambda: recording(300, np.r_[np.arange(150), np.arange(150, 300, 5)]),
+    # Over 30% NaN overall, and in every segment
+    'sparse': lambda: recording(300, np.arange(0, 300, 3)),
+    'short_sparse': lambda: recording(20, np.arange(0, 20, 2)),
+}
+
+
+@pytest.mark.parametrize('data_resampling_rate', ['5Min', '1H', '1D'])
+def test_coverage_matches_resampled_inputs(data_resampling_rate):
+    sufficient = []
+    for make_recording in RECORDINGS.values():
+        rhythmo_inputs = make_recording()
+        coverage = build_coverage(rhythmo_inputs)
+        resampled_data = resample_inputs(rhythmo_inputs, data_resampling_rate)
+
+        timestamps, is_nan = resampled_coverage(coverage, data_resampling_rate)
+        np.testing.assert_array_equal(timestamps, resampled_data['timestamp'].to_numpy())
+        np.testing.assert_array_equal(is_nan, resampled_data['value'].isnull().to_numpy())
+
+        expected = check_sufficient_data(resampled_data)[0]
+        assert sufficient_coverage(coverage, data_resampling_rate) == expected
+        sufficient.append(expected)
+    # Both outcomes are covered
+    assert set(sufficient) == {True, False}
+
+
+def test_coverage_undecided_for_rates_finer_than_the_index():
+    assert sufficient_coverage(build_coverage(RECORDINGS['dense']()), '30s') is None
+
+
+def test_coverage_reloads_until_input_changes(tmp_path):
+    input_file = str(tmp_path / 'input.csv')
+    RECORDINGS['dense']().to_csv(input_file, index=False)
+    coverage = build_coverage(RECORDINGS['dense']())
+    save_coverage(input_file, coverage, str(tmp_path / 'coverage'))
+
+    loaded = load_coverage(input_file, str(tmp_path / 'coverage'))
+    assert loaded is not None
+    assert sufficient_coverage(loaded, '1H') == sufficient_coverage(coverage, '1H')
+
+    stat = os.stat(input_file)
+    os.utime(input_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert load_coverage(input_file, str(tmp_path / 'coverage')) is None
@@ -0,0 +1,82 @@
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataclass import RhythmoOutput
+
+
+@pytest.fixture
+def resampled_data():
+    """Hourly values over 10 days"""
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({'timestamp': pd.date_range('2020-01-01', periods=240, freq='1H'),
+                         'value': rng.standard_normal(240)})
+
+
+def test_frames_round_trip(resampled_data):
+    wavelet_data = pd.DataFrame({'period': np.arange(2, 10, 0.5), 'power': np.linspace(0, 1, 16),
+                                 'peak': np.arange(16) % 2}, index=np.arange(16) * 2)
+    rhythmo_outputs = RhythmoOutput(resampled_data=resampled_data, wavelet_data=wavelet_data)
+
+    # Values are stored as float32, other floats, integers and the index as they were
+    pd.testing.assert_frame_equal(rhythmo_outputs.resampled_data, resampled_data.astype({'value': np.float32}))
+    pd.testing.assert_frame_equal(rhythmo_outputs.wavelet_data, wavelet_data)
+    assert rhythmo_outputs.best_segment is None
+
+
+@pytest.mark.parametrize('tz', [None, 'UTC', 'Europe/London'])
+def test_frames_keep_timezones(resampled_data, tz):
+    # Across a daylight saving change
+    resampled_data['timestamp'] = pd.date_range('2020-03-25', periods=240, freq='1H', tz=tz)
+    rhythmo_outputs = RhythmoOutput(resampled_data=resampled_data)
+    pd.testing.assert_frame_equal(rhythmo_outputs.resampled_data, resampled_data.astype({'value': np.float32}))
+
+
+def test_frames_are_read_only_views(resampled_data):
+    rhythmo_outputs = RhythmoOutput(resampled_data=resampled_data)
+    first = rhythmo_outputs.resampled_data
+    second = rhythmo_outputs.resampled_data
+
+    # Every read is built over the same stored arrays
+    assert np.shares_memory(first['value'].to_numpy(), second['value'].to_numpy())
+    assert np.shares_memory(first['timestamp'].array._ndarray, second['timestamp'].array._ndarray)
+    with pytest.raises(ValueError, match='read-only'):
+        first.loc[0, 'value'] = 0
+
+
+def test_fields_share_timestamp_axes(resampled_data):
+    best_segment = resampled_data.iloc[24:120].reset_index(drop=True)
+    # Set before the field it is a run of, and after
+    rhythmo_outputs = RhythmoOutput(best_segment=best_segment)
+    rhythmo_outputs.resampled_data = resampled_data
+    rhythmo_outputs.filtered_cycle = resampled_data.iloc[48:].reset_index(drop=True)
+
+    axis = rhythmo_outputs.resampled_data['timestamp'].array._ndarray
+    for name in ['best_segment', 'filtered_cycle']:
+        assert np.shares_memory(getattr(rhythmo_outputs, name)['timestamp'].array._ndarray, axis)
+    pd.testing.assert_frame_equal(rhythmo_outputs.best_segment, best_segment.astype({'value': np.float32}))
+
+    # Timestamps that are not a run of another field keep their own array
+    rhythmo_outputs.future_phases = pd.DataFrame({'timestamp': resampled_data['timestamp'] + pd.Timedelta(days=10),
+                                                  'phase': np.zeros(240)})
+    assert not np.shares_memory(rhythmo_outputs.future_phases['timestamp'].array._ndarray, axis)
+
+
+def test_outputs_pickle(resampled_data):
+    rhythmo_outputs = RhythmoOutput(best_segment=resampled_data.iloc[24:], cycle_period=7, cycle_periods=[7],
+                                    notes='notes')
+    rhythmo_outputs.resampled_data = resampled_data
+    unpickled = pickle.loads(pickle.dumps(rhythmo_outputs))
+
+    for name in RhythmoOutput.FIELDS:
+        expected = getattr(rhythmo_outputs, name)
+        if isinstance(expected, pd.DataFrame):
+            pd.testing.assert_frame_equal(getattr(unpickled, name), expected)
+        else:
+            assert getattr(unpickled, name) == expected
+    # The stored arrays stay read-only, and the fields still share their timestamps
+    assert not unpickled._frames['resampled_data'][0]['value'].flags.writeable
+    assert np.shares_memory(unpickled.best_segment['timestamp'].array._ndarray,
+                            unpickled.resampled_data['timestamp'].array._ndarray)
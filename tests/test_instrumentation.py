@@ -0,0 +1,42 @@
+import os
+import threading
+
+from instrumentation import Instrumentation, profile
+
+
+def test_peak_memory_of_a_stage():
+    instrumentation = Instrumentation('input', trace_memory=True)
+    with instrumentation.measure('stage'):
+        data = bytearray(8 * 1024 ** 2)
+    del data
+    assert instrumentation.records[0]['peak_memory_mb'] >= 8
+
+
+def test_peak_memory_not_recorded_for_overlapping_threads():
+    started = threading.Event()
+    finish = threading.Event()
+    handlers = Instrumentation('handler', trace_memory=True)
+
+    def output_handler():
+        with handlers.measure('output', kind='output_handler'):
+            started.set()
+            finish.wait()
+
+    thread = threading.Thread(target=output_handler)
+    thread.start()
+    started.wait()
+    stages = Instrumentation('input', trace_memory=True)
+    with stages.measure('stage'):
+        finish.set()
+        thread.join()
+
+    assert handlers.records[0]['peak_memory_mb'] is None
+    assert stages.records[0]['peak_memory_mb'] is None
+
+
+def test_profiles_of_inputs_with_the_same_name_are_kept_apart(tmp_path):
+    for folder in ['a', 'b']:
+        with profile(os.path.join(folder, 'input.csv'), str(tmp_path)):
+            sum(range(1000))
+    profiles = sorted(os.listdir(tmp_path))
+    assert len(profiles) == 2 and all(name.startswith('input.csv.') for name in profiles)
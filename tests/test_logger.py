@@ -0,0 +1,18 @@
+import logging
+
+import pytest
+
+from logger.logger import log_level
+
+
+@pytest.mark.parametrize('name, level', [('DEBUG', logging.DEBUG), ('info', logging.INFO),
+                                         (' Warning ', logging.WARNING), ('warn', logging.WARNING),
+                                         ('error', logging.ERROR), ('CRITICAL', logging.CRITICAL)])
+def test_log_level_of_known_names(name, level):
+    assert log_level(name) == level
+
+
+@pytest.mark.parametrize('name', ['verbose', '', '10'])
+def test_unknown_log_level_falls_back_to_debug(name):
+    with pytest.warns(UserWarning, match='Unknown LOG_LEVEL'):
+        assert log_level(name) == logging.DEBUG
@@ -0,0 +1,69 @@
+import threading
+
+import pytest
+
+from main import Run
+from pipeline import OutputPipeline
+
+
+def test_jobs_finish_in_submission_order():
+    finished = []
+    with OutputPipeline(depth=2) as pipeline:
+        for i in range(20):
+            assert pipeline.submit(f'input_{i % 3}', lambda i=i: finished.append(i)) == i
+    assert finished == list(range(20))
+    assert not pipeline.errors
+
+
+def test_submit_blocks_while_the_queue_is_full():
+    running = threading.Event()
+    release = threading.Event()
+    pipeline = OutputPipeline(depth=1)
+
+    # The first job runs (and waits), the second fills the queue
+    pipeline.submit('first', lambda: (running.set(), release.wait()))
+    running.wait()
+    pipeline.submit('second', lambda: None)
+
+    third_submitted = threading.Event()
+    submitter = threading.Thread(target=lambda: (pipeline.submit('third', lambda: None), third_submitted.set()))
+    submitter.start()
+    assert not third_submitted.wait(0.2)
+
+    release.set()
+    assert third_submitted.wait(5)
+    submitter.join()
+    assert pipeline.close() == {}
+
+
+def test_close_returns_the_error_of_each_failed_job():
+    def fail():
+        raise ValueError('handler failed')
+
+    pipeline = OutputPipeline(depth=1)
+    # Jobs for the same input are kept apart
+    for job in [fail, lambda: None, fail]:
+        pipeline.submit('input', job)
+    assert pipeline.close() == {0: 'handler failed', 2: 'handler failed'}
+
+    with pytest.raises(RuntimeError, match='closed'):
+        pipeline.submit('input', lambda: None)
+
+
+def test_run_marks_files_whose_output_handlers_failed(tmp_path, rhythmo_inputs):
+    input_file = str(tmp_path / 'input.csv')
+    rhythmo_inputs.to_csv(input_file, index=False)
+    calls = []
+
+    def fail_second_call(*_):
+        calls.append(None)
+        if len(calls) == 2:
+            raise ValueError('handler failed')
+
+    # The same input twice, so only the submission index tells the two apart
+    runtime = Run([input_file, input_file], ['get_frequencies'], None, pipeline_depth=1)
+    runtime.outputs = [fail_second_call]
+    results = runtime.run()
+
+    assert [result.status for result in results] == ['finished', 'failed']
+    assert results[1].error == 'handler failed'
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from process import (RESAMPLING_RATES, check_sufficient_data, nearest_indices, resample_inputs,
+                     resample_pyramid)
+from utils import nearest
+
+MINUTE = 60 * 1000
+
+
+@pytest.fixture
+def irregular_inputs():
+    """Unsorted, irregularly sampled inputs over 20 days starting mid-day, with NaN values and gaps"""
+    rng = np.random.default_rng(1)
+    start = 1_600_000_000_000 + 13 * 60 * MINUTE + 17 * MINUTE + 123
+    timestamps = start + np.cumsum(rng.integers(1, 6 * MINUTE, 10_000))
+    values = 60 + 10 * rng.standard_normal(len(timestamps))
+    values[rng.random(len(values)) < 0.1] = np.nan
+    keep = (timestamps - start) % (3 * 24 * 60 * MINUTE) > 12 * 60 * MINUTE
+    order = rng.permutation(keep.sum())
+    return pd.DataFrame({'timestamp': timestamps[keep][order], 'value': values[keep][order]})
+
+
+def pandas_resample(rhythmo_inputs, data_resampling_rate):
+    """Mean of each bin by pandas resample (bins from midnight of the first day)"""
+    data = pd.Series(rhythmo_inputs['value'].to_numpy(dtype=float),
+                     index=pd.to_datetime(rhythmo_inputs['timestamp'], unit='ms'))
+    resampled = data.resample(data_resampling_rate).mean()
+    return pd.DataFrame({'timestamp': resampled.index.to_numpy(), 'value': resampled.to_numpy()})
+
+
+@pytest.mark.parametrize('data_resampling_rate', ['1Min', '5Min', '7Min', '1H', '1D'])
+def test_resample_inputs_matches_pandas_resample(irregular_inputs, data_resampling_rate):
+    pd.testing.assert_frame_equal(resample_inputs(irregular_inputs, data_resampling_rate),
+                                  pandas_resample(irregular_inputs, data_resampling_rate))
+
+
+def test_resample_pyramid_matches_each_rate(irregular_inputs):
+    # '7Min' is binned from the inputs, as no finer rate divides it
+    rates = RESAMPLING_RATES + ('7Min',)
+    pyramid = resample_pyramid(irregular_inputs, rates)
+    assert sorted(pyramid) == sorted(rates)
+    for rate in rates:
+        pd.testing.assert_frame_equal(pyramid[rate], pandas_resample(irregular_inputs, rate))
+
+
+def naive_check_sufficient_data(df):
+    """check_sufficient_data as a scan: the nearest timestamp to each anchor by a linear search, and the
+    NaNs of every (start, end) pair of anchors counted from its slice"""
+    if df.empty:
+        return False, df
+    if df['value'].isnull().mean() <= 0.3:
+        return True, df
+
+    starting_inds = []
+    k = 1
+    while (next_date := df['timestamp'].iloc[0] + k * pd.Timedelta(days=30)) < df['timestamp'].max():
+        closest = nearest(df['timestamp'], next_date)
+        starting_inds.append(df.index[df['timestamp'] == closest][0])
+        k += 1
+
+    max_duration = pd.Timedelta(0)
+    longest_start_ind = longest_end_ind = 0
+    for i, start_ind in enumerate(starting_inds):
+        for end_ind in starting_inds[i + 1:]:
+            segment = df.iloc[start_ind:end_ind + 1]
+            duration = segment['timestamp'].max() - segment['timestamp'].min()
+            if (duration > pd.Timedelta(days=90) and segment['value'].isnull().mean() <= 0.3
+                    and duration > max_duration):
+                max_duration = duration
+                longest_start_ind, longest_end_ind = start_ind, end_ind
+
+    longest_segment = df.iloc[longest_start_ind:longest_end_ind + 1].reset_index(drop=True)
+    return len(longest_segment) != 1, longest_segment
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_check_sufficient_data_matches_scan(seed):
+    # Hourly data with NaN gaps of up to 40 days, so some recordings only have a valid segment in part
+    rng = np.random.default_rng(seed)
+    num_hours = int(rng.integers(100, 400)) * 24
+    is_nan = np.zeros(num_hours, dtype=bool)
+    for start in rng.integers(0, num_hours, int(rng.integers(1, 12))):
+        is_nan[start:start + int(rng.integers(1, 40 * 24))] = True
+    resampled_data = pd.DataFrame({'timestamp': pd.date_range('2020-01-01', periods=num_hours, freq='1H'),
+                                   'value': np.where(is_nan, np.nan, rng.standard_normal(num_hours))})
+
+    sufficient, best_segment = check_sufficient_data(resampled_data)
+    expected_sufficient, expected_segment = naive_check_sufficient_data(resampled_data)
+    assert sufficient == expected_sufficient
+    pd.testing.assert_frame_equal(best_segment, expected_segment)
+
+
+def test_nearest_indices_match_nearest():
+    # Pivots before, between (including exactly halfway, where the earlier timestamp is nearest) and after
+    timestamps = np.array([0, 10, 20, 21, 40])
+    pivots = np.array([-5, 5, 14, 15, 16, 20, 30, 30.5, 50])
+    np.testing.assert_array_equal(timestamps[nearest_indices(timestamps, pivots)],
+                                  [nearest(timestamps, pivot) for pivot in pivots])
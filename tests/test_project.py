@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from project import fit_phase_line, unwrap_phases, wrap_phases
+
+HOUR = 60 * 60 * 1000
+
+
+@pytest.fixture
+def noisy_phases():
+    """Hourly phases (wrapped to -pi to pi) of a 7 day cycle with noise, and with gaps in the timestamps"""
+    rng = np.random.default_rng(0)
+    timestamps = 1_600_000_000_000 + np.arange(120 * 24) * HOUR
+    phases = 2 * np.pi * (timestamps - timestamps[0]) / (7 * 24 * HOUR) + 0.3 * rng.standard_normal(len(timestamps))
+    keep = np.ones(len(timestamps), dtype=bool)
+    for start in rng.integers(0, len(timestamps), 8):
+        keep[start:start + int(rng.integers(1, 5 * 24))] = False
+    return timestamps[keep].astype(float), np.angle(np.exp(1j * phases[keep]))
+
+
+def loop_unwrap_phases(cycle_phase):
+    """unwrap_phases as a loop over each phase"""
+    item_arr = []
+    n = 0
+    for i, _ in enumerate(cycle_phase):
+        item_arr.append(cycle_phase[i] + 2 * (n + 1) * np.pi)
+        if cycle_phase[i] > 0:
+            if i < len(cycle_phase) - 1 and cycle_phase[i + 1] > 0:
+                continue
+            n += 1
+    return np.array(item_arr)
+
+
+def loop_wrap_phases(phases):
+    """wrap_phases as a loop over each phase"""
+    round_phase = []
+    for future_phase in phases:
+        phase = future_phase - (future_phase // (2 * np.pi)) * (2 * np.pi)
+        round_phase.append(phase - (2 * np.pi) if phase > np.pi else phase)
+    return np.array(round_phase)
+
+
+def test_unwrap_phases_matches_loop(noisy_phases):
+    _, phases = noisy_phases
+    np.testing.assert_array_equal(unwrap_phases(phases), loop_unwrap_phases(phases))
+    # Including phases that are exactly 0 (not positive) and a single phase
+    edge_cases = np.array([0.5, 0.0, -1.0, 0.0, 2.0, 3.0, -3.0, 0.0])
+    np.testing.assert_array_equal(unwrap_phases(edge_cases), loop_unwrap_phases(edge_cases))
+    np.testing.assert_array_equal(unwrap_phases([1.0]), loop_unwrap_phases([1.0]))
+
+
+def test_fit_phase_line_matches_polyfit(noisy_phases):
+    timestamps, phases = noisy_phases
+    unwrapped = unwrap_phases(phases)
+    np.testing.assert_allclose(fit_phase_line(timestamps, unwrapped), np.polyfit(timestamps, unwrapped, 1),
+                               rtol=1e-6)
+
+
+def test_wrap_phases_matches_loop(noisy_phases):
+    timestamps, phases = noisy_phases
+    slope, intercept = fit_phase_line(timestamps, unwrap_phases(phases))
+    projected = slope * timestamps + intercept
+    wrapped = wrap_phases(projected)
+
+    np.testing.assert_array_equal(wrapped, loop_wrap_phases(projected))
+    assert np.all((wrapped > -np.pi) & (wrapped <= np.pi))
+    # Wrapping keeps the phase (up to whole cycles)
+    np.testing.assert_allclose(np.exp(1j * wrapped), np.exp(1j * projected), atol=1e-9)
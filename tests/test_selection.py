@@ -0,0 +1,34 @@
+import numpy as np
+
+from selection import best_segments
+
+
+def test_best_segments_matches_slice_averages():
+    rng = np.random.default_rng(1)
+    power = rng.random((4, 500))
+    window_lengths = np.array([10, 37, 120, 499])
+
+    best_starts, best_powers = best_segments(power, np.arange(4), window_lengths)
+
+    for row, window_length in enumerate(window_lengths):
+        averages = [power[row, start:start + window_length].mean()
+                    for start in range(len(power[row]) - window_length)]
+        assert best_starts[row] == np.argmax(averages)
+        assert np.isclose(best_powers[row], max(averages))
+
+
+def test_best_segments_takes_earliest_window_on_ties():
+    # Equal windows whose cumulative sums round differently (0.1 is not exact in binary)
+    power = np.full((2, 10000), 0.1)
+    power[1, :5000] = 0.3
+    power[1, 5000:] = 0.7
+
+    best_starts, _ = best_segments(power, [0, 1], [50, 50])
+
+    assert best_starts[0] == 0
+    assert best_starts[1] == 5000
+
+
+def test_best_segments_without_power():
+    best_starts, best_powers = best_segments(np.zeros((1, 100)), [0], [10])
+    assert best_starts[0] == 0 and best_powers[0] == 0
@@ -0,0 +1,101 @@
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+import server
+from server import RequestHandler, RhythmoServer, validate_job
+
+
+@pytest.fixture
+def inline_job(rhythmo_inputs):
+    return {'data': {'timestamp': rhythmo_inputs['timestamp'].tolist(),
+                     'value': rhythmo_inputs['value'].astype(float).tolist()},
+            'parameters': {'projection_duration': 7}}
+
+
+@pytest.fixture
+def http_server():
+    """A RhythmoServer with one worker, served on a free local port"""
+    rhythmo = RhythmoServer(['project_cycle'], workers=1, max_queue=4)
+    http_server = ThreadingHTTPServer(('127.0.0.1', 0), RequestHandler)
+    http_server.rhythmo = rhythmo
+    thread = threading.Thread(target=http_server.serve_forever, daemon=True)
+    thread.start()
+    yield http_server
+    http_server.shutdown()
+    http_server.server_close()
+    rhythmo.close()
+
+
+def request(http_server, method: str, path: str, body=None):
+    connection = http.client.HTTPConnection('127.0.0.1', http_server.server_address[1], timeout=120)
+    connection.request(method, path, body=None if body is None else json.dumps(body))
+    response = connection.getresponse()
+    data = json.loads(response.read())
+    connection.close()
+    return response.status, data
+
+
+def test_validate_job(tmp_path):
+    input_file = tmp_path / 'input.csv'
+    input_file.write_text('timestamp,value\n')
+
+    assert validate_job({'input': str(input_file)}) is None
+    assert validate_job({'data': {}, 'parameters': {'bandpass_cutoff_percentage': 20}}) is None
+    assert 'json object' in validate_job([])
+    assert 'one of input' in validate_job({})
+    assert 'one of input' in validate_job({'input': str(input_file), 'data': {}})
+    assert 'does not exist' in validate_job({'input': str(tmp_path / 'missing.csv')})
+    assert 'parameter overrides' in validate_job({'data': {}, 'parameters': [20]})
+    assert validate_job({'data': {}, 'parameters': {'cutoff': 20, 'bandpass_cutoff_percentage': 20}}) == \
+        'Unknown parameters: cutoff'
+
+
+def test_run_request_with_inline_data(inline_job):
+    server._init_worker(['project_cycle'], None, None, 1024, None, 1)
+    response = server._run_request('request-1', inline_job)
+
+    assert response['status'] == 'finished' and response['error'] is None
+    assert response['cycle_period'] == pytest.approx(7, rel=0.2)
+    # Phases from the last resampled hour of the inputs, with timestamps in milliseconds
+    future_phases = response['future_phases']
+    assert len(future_phases['timestamp']) == len(future_phases['phase']) > 0
+    assert 0 <= inline_job['data']['timestamp'][-1] - future_phases['timestamp'][0] < 60 * 60 * 1000
+    assert {record['stage'] for record in response['metrics']} >= {'process', 'track', 'project'}
+
+    # Too little data is skipped rather than failed
+    short_job = {'data': {name: values[:48] for name, values in inline_job['data'].items()}}
+    response = server._run_request('request-2', short_job)
+    assert response['status'] == 'skipped' and response['error'] == 'Insufficient data'
+    assert response['future_phases'] is None
+
+
+def test_predict_and_health(http_server, inline_job):
+    status, health = request(http_server, 'GET', '/health')
+    assert status == 200 and health['latency'] is None
+
+    for _ in range(3):
+        status, response = request(http_server, 'POST', '/predict', inline_job)
+        assert status == 200 and response['status'] == 'finished'
+    status, response = request(http_server, 'POST', '/predict', {'data': {}, 'parameters': {'cutoff': 20}})
+    assert status == 400 and response['error'] == 'Unknown parameters: cutoff'
+
+    status, health = request(http_server, 'GET', '/health')
+    assert status == 200
+    assert health['requests'] == health['finished'] == 3 and health['queue_depth'] == 0
+    latency = health['latency']
+    assert 0 < latency['p50'] <= latency['p95'] <= latency['max']
+
+
+def test_predict_is_rejected_once_the_queue_is_full(http_server, inline_job):
+    # Every request is pending until it finishes, so a full queue rejects the next one
+    http_server.rhythmo._pending = http_server.rhythmo.max_queue
+    status, response = request(http_server, 'POST', '/predict', inline_job)
+    assert status == 503 and response['error'] == 'Too many pending requests'
+
+    http_server.rhythmo._pending = 0
+    status, health = request(http_server, 'GET', '/health')
+    assert health['requests'] == health['rejected'] == 1 and health['latency'] is None
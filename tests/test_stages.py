@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch import run_batch
+from dataclass import Parameters, RhythmoOutput
+from main import STAGES, Run, load_stage
+
+HOUR = 60 * 60 * 1000
+
+
+@pytest.fixture
+def two_cycles():
+    """Hourly inputs over 200 days with 7 and 23 day cycles"""
+    rng = np.random.default_rng(2)
+    timestamps = 1_600_000_000_000 + np.arange(200 * 24) * HOUR
+    days = (timestamps - timestamps[0]) / (24 * HOUR)
+    values = (np.sin(2 * np.pi * days / 7) + 0.4 * np.sin(2 * np.pi * days / 23)
+              + 0.3 * rng.standard_normal(len(days)))
+    return pd.DataFrame({'timestamp': timestamps, 'value': values})
+
+
+def run_stages(rhythmo_inputs, parameters):
+    rhythmo_outputs = RhythmoOutput.build_empty()
+    for name, _ in STAGES:
+        rhythmo_outputs = load_stage(name)(rhythmo_inputs, rhythmo_outputs, parameters)
+    return rhythmo_outputs
+
+
+@pytest.mark.parametrize('method', ['prominence', 'power', 'relative power', 'segment_power'])
+def test_stages_find_strongest_cycle(two_cycles, method):
+    rhythmo_outputs = run_stages(two_cycles, Parameters(cycle_selection_method=method))
+
+    assert rhythmo_outputs.cycle_period == 7
+    assert rhythmo_outputs.cycle_periods == [7]
+    assert len(rhythmo_outputs.future_phases) == Parameters().number_of_future_phases
+
+
+def test_stages_track_number_of_cycles(two_cycles):
+    parameters = Parameters(number_of_cycles=2, period_grid='adaptive', timing_of_future_phases='peak_trough')
+    rhythmo_outputs = run_stages(two_cycles, parameters)
+
+    assert rhythmo_outputs.cycle_periods == [7, 23]
+    assert rhythmo_outputs.filtered_cycles.groupby('cycle_period').size().to_dict() == {
+        7: len(rhythmo_outputs.resampled_data), 23: len(rhythmo_outputs.resampled_data)}
+    # Phases are stored as float32
+    assert np.allclose(np.unique(rhythmo_outputs.future_phases['phase']), [0, np.pi])
+    assert rhythmo_outputs.cycle_future_phases.groupby('cycle_period').size().to_dict() == {7: 8, 23: 8}
+
+    # The predicted peaks of the 7 day cycle are a cycle apart
+    future_phases = rhythmo_outputs.future_phases
+    peaks = future_phases.loc[future_phases['phase'] == 0, 'timestamp']
+    assert np.allclose(np.diff(peaks) / pd.Timedelta(days=1), 7, atol=0.1)
+
+
+def test_stages_stop_without_sufficient_data(two_cycles):
+    rhythmo_outputs = load_stage('process')(two_cycles.iloc[:24], RhythmoOutput.build_empty(), Parameters())
+    assert load_stage('decomp')(two_cycles.iloc[:24], rhythmo_outputs, Parameters()) is None
+
+
+def test_batch_rejects_more_than_one_cycle(two_cycles):
+    with pytest.raises(ValueError, match='number_of_cycles'):
+        run_batch({'subject': two_cycles}, Parameters(number_of_cycles=2))
+
+
+def assert_frames_close(df, expected):
+    """Frames are equal up to rounding (e.g. project reads back the float32 filtered cycles), with times
+    (interpolated by forecast) within a millisecond"""
+    assert list(df.columns) == list(expected.columns) and len(df) == len(expected)
+    for name in expected.columns:
+        if pd.api.types.is_datetime64_any_dtype(expected[name]):
+            np.testing.assert_allclose(df[name].astype('int64'), expected[name].astype('int64'), rtol=0, atol=10 ** 6)
+        else:
+            np.testing.assert_allclose(df[name], expected[name], rtol=1e-4, atol=1e-4, err_msg=name)
+
+
+@pytest.mark.parametrize('period_grid', ['linear', 'adaptive'])
+def test_batch_matches_run_file(tmp_path, two_cycles, period_grid):
+    # Two series of the same length (analysed as one stack), and a longer one with over 30% NaNs, whose
+    # best segment is only the second half of the series
+    rng = np.random.default_rng(3)
+    noisier = two_cycles.assign(value=two_cycles['value'] + rng.standard_normal(len(two_cycles)))
+    longer = pd.concat([two_cycles, two_cycles.assign(timestamp=two_cycles['timestamp'] + 200 * 24 * HOUR)],
+                       ignore_index=True)
+    longer.loc[:len(two_cycles) - 1, 'value'] = np.where(rng.random(len(two_cycles)) < 0.9, np.nan,
+                                                         two_cycles['value'])
+    inputs = []
+    for name, data in [('first', two_cycles), ('noisier', noisier), ('longer', longer)]:
+        inputs.append(str(tmp_path / f'{name}.csv'))
+        data.to_csv(inputs[-1], index=False)
+    parameters_file = str(tmp_path / 'parameters.json')
+    with open(parameters_file, 'w') as f:
+        f.write(f'{{"period_grid": "{period_grid}"}}')
+
+    expected = Run(inputs, ['predict_future_phases'], parameters_file).run()
+    results = Run(inputs, ['predict_future_phases'], parameters_file, batch=True).run()
+
+    for result, expected_result in zip(results, expected):
+        assert result.input_file == expected_result.input_file
+        assert result.status == expected_result.status == 'finished'
+        rhythmo_outputs, expected_outputs = result.rhythmo_outputs, expected_result.rhythmo_outputs
+        assert rhythmo_outputs.cycle_periods == expected_outputs.cycle_periods
+        for name in RhythmoOutput.FIELDS:
+            value, expected_value = getattr(rhythmo_outputs, name), getattr(expected_outputs, name)
+            if isinstance(expected_value, pd.DataFrame):
+                assert_frames_close(value, expected_value)
+            else:
+                assert value == expected_value, name
+
+
+def test_parallel_run_matches_sequential(tmp_path, two_cycles):
+    inputs = []
+    for i in range(3):
+        inputs.append(str(tmp_path / f'input_{i}.csv'))
+        two_cycles.iloc[i * 24:].to_csv(inputs[-1], index=False)
+
+    sequential = Run(inputs, ['project_cycle'], None).run()
+    parallel = Run(inputs, ['project_cycle'], None, workers=2).run()
+
+    assert [result.input_file for result in parallel] == inputs
+    for result, expected in zip(parallel, sequential):
+        assert result.status == expected.status == 'finished'
+        pd.testing.assert_frame_equal(result.rhythmo_outputs.projected_cycle,
+                                      expected.rhythmo_outputs.projected_cycle)
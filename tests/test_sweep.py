@@ -0,0 +1,51 @@
+from dataclasses import replace
+
+import pandas as pd
+import pytest
+
+from dataclass import Parameters, RhythmoOutput
+from main import STAGES, STEPS, load_stage
+from sweep import expand_grid, run_sweep, sweep_input
+
+
+def test_expand_grid():
+    assert expand_grid({'bandpass_cutoff_percentage': [20, 33], 'wavelet_waveform': ['morlet', 'paul']}) == [
+        {'bandpass_cutoff_percentage': 20, 'wavelet_waveform': 'morlet'},
+        {'bandpass_cutoff_percentage': 20, 'wavelet_waveform': 'paul'},
+        {'bandpass_cutoff_percentage': 33, 'wavelet_waveform': 'morlet'},
+        {'bandpass_cutoff_percentage': 33, 'wavelet_waveform': 'paul'}]
+    variants = [{'cycle_period': 7}, {'data_resampling_rate': '1D', 'cycle_period': 7}]
+    assert expand_grid(variants) == variants
+
+    with pytest.raises(ValueError, match='cutoff'):
+        expand_grid({'cutoff': [20]})
+
+
+def test_sweep_shares_stage_outputs_between_variants(rhythmo_inputs):
+    variants = expand_grid({'bandpass_cutoff_percentage': [20, 33], 'projection_duration': [7, 14]})
+    step = STEPS['project_cycle']
+    outputs, num_runs = sweep_input(rhythmo_inputs, Parameters(), variants, step)
+
+    # process, decomp and selection once, track once per cutoff and project once per variant
+    assert num_runs == 3 + 2 + 4
+    for overrides, rhythmo_outputs in zip(variants, outputs):
+        expected = RhythmoOutput.build_empty()
+        parameters = replace(Parameters(), **overrides)
+        for name, stage_step in STAGES:
+            if stage_step <= step:
+                expected = load_stage(name)(rhythmo_inputs, expected, parameters)
+        assert rhythmo_outputs.cycle_period == expected.cycle_period
+        pd.testing.assert_frame_equal(rhythmo_outputs.filtered_cycle, expected.filtered_cycle)
+        pd.testing.assert_frame_equal(rhythmo_outputs.projected_cycle, expected.projected_cycle)
+
+
+def test_sweep_reports_insufficient_data_as_skipped(tmp_path, rhythmo_inputs):
+    inputs = [str(tmp_path / 'input.csv'), str(tmp_path / 'short.csv')]
+    rhythmo_inputs.to_csv(inputs[0], index=False)
+    rhythmo_inputs.iloc[:48].to_csv(inputs[1], index=False)
+
+    table = run_sweep(inputs, Parameters(), {'bandpass_cutoff_percentage': [20, 33]}, STEPS['track_cycle'])
+
+    assert table['status'].tolist() == ['finished', 'finished', 'skipped', 'skipped']
+    assert table['error'].tolist()[2:] == ['Insufficient data'] * 2
+    assert table['cycle_period'].iloc[0] == table['cycle_period'].iloc[1]
@@ -0,0 +1,75 @@
+import math
+
+import numpy as np
+import pytest
+from scipy.signal import hilbert, sosfilt
+
+from track import (FILTER_TOLERANCE, chunked_cycle_filter, chunked_phases, cycle_bandpass_sos, cycle_filter,
+                   filter_bank, filter_settle_length)
+
+# Small blocks, so series of a few thousand samples are filtered and transformed in many blocks
+BLOCK_LENGTH = 2000
+CYCLE_PERIOD = 24.0 # in samples
+
+
+@pytest.fixture
+def noisy_cycle():
+    """30000 samples of a 24 sample cycle with a slowly varying amplitude, plus white noise"""
+    rng = np.random.default_rng(0)
+    time = np.arange(30_000)
+    amplitude = 1 + 0.5 * np.sin(2 * np.pi * time / 2000)
+    return amplitude * np.sin(2 * np.pi * time / CYCLE_PERIOD) + rng.standard_normal(len(time))
+
+
+@pytest.mark.parametrize('cutoff_percentage', [10, 33])
+def test_chunked_cycle_filter_matches_whole_series(noisy_cycle, cutoff_percentage):
+    expected = cycle_filter(noisy_cycle, CYCLE_PERIOD, cutoff_percentage)
+    filtered = chunked_cycle_filter(noisy_cycle, CYCLE_PERIOD, cutoff_percentage, block_length=BLOCK_LENGTH)
+    # Within FILTER_TOLERANCE of the peak of the signal
+    assert np.abs(filtered - expected).max() <= FILTER_TOLERANCE * np.abs(noisy_cycle).max()
+
+
+@pytest.mark.parametrize('cycle_period, cutoff_percentage', [(3, 33), (24, 1), (24, 10), (168, 33), (720, 20)])
+def test_filter_settle_length_matches_impulse_response(cycle_period, cutoff_percentage):
+    # Last sample of the whole impulse response above FILTER_TOLERANCE of its peak (over 10 times the
+    # expected settle length, as filters with an edge close to the Nyquist frequency ring for longer)
+    impulse = np.zeros(math.ceil(cycle_period * 40000 / cutoff_percentage) + 1)
+    impulse[0] = 1
+    response = np.abs(sosfilt(cycle_bandpass_sos(cycle_period, cutoff_percentage), impulse))
+    expected = np.flatnonzero(response > FILTER_TOLERANCE * response.max())[-1] + 1
+
+    settle_length = filter_settle_length(cycle_period, cutoff_percentage)
+    assert expected <= settle_length <= 1.1 * expected
+
+
+def test_blocks_are_longer_than_their_padding(noisy_cycle):
+    # Blocks shorter than the padding are lengthened, so the series is still filtered in a few blocks
+    expected = cycle_filter(noisy_cycle, CYCLE_PERIOD, 10)
+    filtered = chunked_cycle_filter(noisy_cycle, CYCLE_PERIOD, 10, block_length=10)
+    assert np.abs(filtered - expected).max() <= FILTER_TOLERANCE * np.abs(noisy_cycle).max()
+    np.testing.assert_array_equal(chunked_phases(filtered, CYCLE_PERIOD, block_length=10),
+                                  chunked_phases(filtered, CYCLE_PERIOD, block_length=8 * 32 * 24))
+
+
+def test_filter_bank_matches_each_cycle_filter(noisy_cycle):
+    cycle_periods = [CYCLE_PERIOD, 50.0]
+    filtered = filter_bank(noisy_cycle, cycle_periods, 33, block_length=BLOCK_LENGTH)
+    for row, cycle_period in zip(filtered, cycle_periods):
+        expected = cycle_filter(noisy_cycle, cycle_period, 33)
+        assert np.abs(row - expected).max() <= FILTER_TOLERANCE * np.abs(noisy_cycle).max()
+
+
+def test_chunked_phases_match_whole_series_hilbert(noisy_cycle):
+    filtered = cycle_filter(noisy_cycle, CYCLE_PERIOD, 10)
+    analytic = hilbert(filtered)
+    phases = chunked_phases(filtered, CYCLE_PERIOD, block_length=BLOCK_LENGTH)
+
+    # Within 0.002 radians (see HILBERT_PAD_CYCLES) wherever the amplitude is at least half the RMS
+    difference = np.abs(np.angle(np.exp(1j * (phases - np.angle(analytic)))))
+    defined = np.abs(analytic) >= np.sqrt(np.mean(filtered ** 2)) / 2
+    assert defined.mean() > 0.5
+    assert difference[defined].max() < 0.002
+
+    # 2D arrays (e.g., a filter bank) are transformed row by row
+    np.testing.assert_array_equal(chunked_phases(np.vstack([filtered, filtered]), CYCLE_PERIOD,
+                                                 block_length=BLOCK_LENGTH)[1], phases)
@@ -0,0 +1,66 @@
+import os
+from dataclasses import replace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataclass import Parameters
+from main import Run
+from process import resample_inputs
+from update import build_state, matches_parameters, state_path, update_state
+
+
+def test_update_keeps_mean_of_all_values(rhythmo_inputs):
+    parameters = Parameters()
+    split = len(rhythmo_inputs) // 2
+    state = build_state(rhythmo_inputs.iloc[:split], 7, parameters)
+
+    last_bin_start = state.resampled_data['timestamp'].iloc[-1].value // 10 ** 6
+    assert update_state(state, rhythmo_inputs[rhythmo_inputs['timestamp'] >= last_bin_start], parameters)
+
+    resampled = resample_inputs(rhythmo_inputs, parameters.data_resampling_rate)
+    assert state.num_samples == len(resampled)
+    assert np.isclose(state.value_mean, np.nanmean(resampled['value']))
+
+
+def test_state_rebuilt_when_parameters_change(rhythmo_inputs):
+    parameters = Parameters()
+    state = build_state(rhythmo_inputs, 7, parameters)
+
+    assert matches_parameters(state, parameters)
+    assert not matches_parameters(state, replace(parameters, cycle_period=7))
+    assert not matches_parameters(state, replace(parameters, bandpass_cutoff_percentage=20))
+    assert matches_parameters(state, replace(parameters, projection_duration=10))
+
+
+@pytest.mark.parametrize('full_inputs', [False, True])
+def test_update_runs_output_handlers(tmp_path, rhythmo_inputs, full_inputs):
+    input_file = str(tmp_path / 'input.csv')
+    split = len(rhythmo_inputs) - 48
+    rhythmo_inputs.iloc[:split].to_csv(input_file, index=False)
+
+    handled = []
+    runtime = Run([input_file], ['predict_future_phases'], None)
+    runtime.outputs = [lambda inputs, outputs, _parameters: handled.append((inputs, outputs))]
+    result = runtime.update(str(tmp_path / 'state'))[0]
+    assert result.status == 'finished'
+    # The full run reads the input once, for both the stages and the state
+    assert [record['stage'] for record in result.metrics].count('read_input') == 1
+
+    rhythmo_inputs.to_csv(input_file, index=False)
+    result = runtime.update(str(tmp_path / 'state'), full_inputs)[0]
+
+    assert result.rhythmo_outputs.notes == 'Updated from saved state'
+    inputs, outputs = handled[-1]
+    # Without full_inputs, the handlers get the rows from the start of the last resampled bin of the state
+    expected = rhythmo_inputs if full_inputs else rhythmo_inputs.iloc[-len(inputs):]
+    assert full_inputs or 48 < len(inputs) < split
+    pd.testing.assert_frame_equal(inputs.reset_index(drop=True),
+                                  expected.reset_index(drop=True).astype(inputs.dtypes.to_dict()))
+    assert len(outputs.future_phases) == Parameters().number_of_future_phases
+
+
+def test_state_path_is_unique_per_input(tmp_path):
+    paths = {state_path(str(tmp_path), os.path.join(folder, 'input.csv')) for folder in ['a', 'b', 'a/../b']}
+    assert len(paths) == 2
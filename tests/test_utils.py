@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils import LRUCache, convert_input, read_input
+
+START = 1_600_000_000_000 + 10 * 24 * 60 * 60 * 1000
+END = START + 20 * 24 * 60 * 60 * 1000
+
+
+@pytest.mark.parametrize('start, end', [(None, None), (START, END)])
+def test_input_formats_read_identical_frames(tmp_path, rhythmo_inputs, start, end):
+    rhythmo_inputs.to_csv(tmp_path / 'input.csv', index=False)
+    rhythmo_inputs.to_parquet(tmp_path / 'input.parquet', index=False)
+    rhythmo_inputs.to_json(tmp_path / 'input.json', orient='records')
+    convert_input(str(tmp_path / 'input.json'), str(tmp_path / 'input.rhy'))
+
+    # Timestamps stay in milliseconds since epoch
+    expected = read_input(str(tmp_path / 'input.csv'), start, end)
+    timestamps = rhythmo_inputs['timestamp']
+    assert expected['timestamp'].tolist() == timestamps[(timestamps >= (start or 0))
+                                                        & (timestamps < (end or timestamps.max() + 1))].tolist()
+    for extension in ['parquet', 'json', 'rhy']:
+        pd.testing.assert_frame_equal(read_input(str(tmp_path / f'input.{extension}'), start, end), expected)
+
+
+def test_lru_cache_resize_evicts_least_recently_used():
+    cache = LRUCache(max_bytes=3 * 800)
+    for key in range(3):
+        cache.get_or_compute(key, lambda: np.zeros(100))
+    cache.get_or_compute(0, lambda: np.zeros(100))
+
+    cache.resize(2 * 800)
+
+    assert cache.info()['items'] == 2 and cache.nbytes == 1600
+    assert cache.get_or_compute(0, lambda: None) is not None
+    assert cache.get_or_compute(1, lambda: None) is None
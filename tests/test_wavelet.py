@@ -0,0 +1,67 @@
+import numpy as np
+import pycwt
+import pytest
+
+from wavelet import KERNEL_CACHE, SIGNIFICANCE_CACHE, WAVEFORMS, get_wavelet, significance, wavelet_transform
+
+DT = 1 / 24 # hourly, in days
+FREQS = 1 / np.arange(2, 20, 0.5)
+
+
+@pytest.fixture
+def signal():
+    """60 days of hourly samples of a 7 day cycle plus white noise"""
+    rng = np.random.default_rng(0)
+    days = np.arange(60 * 24) * DT
+    return np.sin(2 * np.pi * days / 7) + 0.3 * rng.standard_normal(len(days))
+
+
+@pytest.mark.parametrize('waveform', list(WAVEFORMS))
+def test_wavelet_transform_matches_pycwt(signal, waveform):
+    expected = pycwt.cwt(signal, DT, wavelet=get_wavelet(waveform), freqs=FREQS)
+    for value, expected_value in zip(wavelet_transform(signal, DT, FREQS, waveform), expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-10, atol=1e-12)
+
+
+@pytest.mark.parametrize('sigma_test, dof', [(0, -1), (1, 100)])
+def test_significance_matches_pycwt(signal, sigma_test, dof):
+    scales = wavelet_transform(signal, DT, FREQS)[1]
+    if sigma_test == 1:
+        # The time-averaged test takes the degrees of freedom of each scale
+        dof = np.full(len(scales), dof, dtype=float)
+    alpha, _, _ = pycwt.ar1(signal)
+    variance = signal.std() ** 2
+
+    expected = pycwt.significance(variance, DT, scales, sigma_test, alpha, significance_level=0.95,
+                                  dof=dof, wavelet=get_wavelet('morlet'))
+    for value, expected_value in zip(significance(variance, DT, scales, sigma_test, alpha, dof=dof), expected):
+        np.testing.assert_allclose(value, expected_value, rtol=1e-12)
+
+
+def test_repeated_transforms_hit_the_kernel_cache(signal):
+    KERNEL_CACHE.clear()
+
+    first = wavelet_transform(signal, DT, FREQS)
+    # Same length, sampling interval and frequencies, so the daughter wavelets are reused
+    second = wavelet_transform(signal[::-1], DT, FREQS)
+    assert KERNEL_CACHE.info()['misses'] == 1 and KERNEL_CACHE.info()['hits'] == 1
+    np.testing.assert_array_equal(first[1], second[1])
+
+    # A different (padded) length needs new daughter wavelets
+    wavelet_transform(signal[:1000], DT, FREQS)
+    assert KERNEL_CACHE.info()['misses'] == 2
+
+
+def test_repeated_significance_hits_the_cache(signal):
+    SIGNIFICANCE_CACHE.clear()
+    scales = wavelet_transform(signal, DT, FREQS)[1]
+
+    # The significance tables are for unit variance, so other variances rescale the cached table
+    signif, _ = significance(1.0, DT, scales, alpha=0.5)
+    rescaled, _ = significance(4.0, DT, scales, alpha=0.5)
+    assert SIGNIFICANCE_CACHE.info()['misses'] == 1 and SIGNIFICANCE_CACHE.info()['hits'] == 1
+    np.testing.assert_allclose(rescaled, 4 * signif)
+
+    # Alphas that round to the same alpha_decimals share a table
+    significance(1.0, DT, scales, alpha=0.501, alpha_decimals=2)
+    assert SIGNIFICANCE_CACHE.info()['misses'] == 1
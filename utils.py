@@ -1,5 +1,8 @@
 import json
 import os
+import threading
+from collections import OrderedDict
+from typing import Optional
 
 import numpy as np
 import pandas as pd
@@ -18,34 +21,188 @@ def write_json(data, file_path: str):
         json.dump(data, f, indent=True)
     return data
 
-def read_csv(file_path: str):
-    """Reads a csv file and returns a pandas dataframe."""
-    return pd.read_csv(file_path)
+# Only the columns rhythmo uses are read from input files, with compact dtypes
+INPUT_COLUMNS = ['timestamp', 'value']
+INPUT_DTYPES = {'timestamp': 'int64', 'value': 'float32'}
+CSV_CHUNK_SIZE = 1_000_000 # rows parsed at a time when reading csv files
+
+def filter_timestamps(data: pd.DataFrame, start: Optional[int] = None, end: Optional[int] = None):
+    """Keeps the rows with start <= timestamp < end (either bound can be None)."""
+    if start is not None:
+        data = data[data['timestamp'] >= start]
+    if end is not None:
+        data = data[data['timestamp'] < end]
+    return data
+
+def concat_chunks(chunks: list, columns: Optional[list], dtypes: Optional[dict]) -> pd.DataFrame:
+    """Concatenates filtered chunks, returning an empty dataframe with the expected columns if none are left."""
+    if chunks:
+        return pd.concat(chunks, ignore_index=True)
+    empty = pd.DataFrame(columns=columns)
+    return empty.astype(dtypes) if dtypes else empty
+
+def read_csv(file_path: str, columns: Optional[list] = None, dtypes: Optional[dict] = None,
+             start: Optional[int] = None, end: Optional[int] = None, chunksize: int = CSV_CHUNK_SIZE):
+    """Reads a csv file and returns a pandas dataframe.
+
+    Only the given columns are parsed (all by default), and the file is read in chunks of rows so that
+    rows outside the [start, end) timestamp range are dropped before the next chunk is parsed.
+    """
+    if columns is None and start is None and end is None:
+        return pd.read_csv(file_path, dtype=dtypes)
+
+    chunks = [filter_timestamps(chunk, start, end)
+              for chunk in pd.read_csv(file_path, usecols=columns, dtype=dtypes, chunksize=chunksize)]
+    return concat_chunks(chunks, columns, dtypes)
 
 def write_csv(data: pd.DataFrame, file_path: str):
     """Writes a pandas dataframe to a csv file."""
     data.to_csv(file_path, index=False)
     return data
 
-def read_parquet(file_path: str):
-    """Reads a parquet file and returns a pandas dataframe."""
-    return pd.read_parquet(file_path)
+def read_parquet(file_path: str, columns: Optional[list] = None, dtypes: Optional[dict] = None,
+                 start: Optional[int] = None, end: Optional[int] = None):
+    """Reads a parquet file and returns a pandas dataframe.
 
-def read_json(file_path: str):
+    Only the given columns are read (all by default). The file is streamed one row group at a time, and
+    row groups whose timestamp statistics fall outside the [start, end) range are skipped without reading.
+    """
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    parquet_file = pq.ParquetFile(file_path)
+    timestamp_index = parquet_file.schema_arrow.get_field_index('timestamp')
+
+    chunks = []
+    for row_group in range(parquet_file.num_row_groups):
+        if timestamp_index >= 0 and (start is not None or end is not None):
+            statistics = parquet_file.metadata.row_group(row_group).column(timestamp_index).statistics
+            if statistics is not None and statistics.has_min_max and (
+                    (start is not None and statistics.max < start) or (end is not None and statistics.min >= end)):
+                continue
+
+        chunk = parquet_file.read_row_group(row_group, columns=columns).to_pandas()
+        if dtypes:
+            chunk = chunk.astype(dtypes, copy=False)
+        chunks.append(filter_timestamps(chunk, start, end))
+    return concat_chunks(chunks, columns, dtypes)
+
+def read_json_data(file_path: str, columns: Optional[list] = None, dtypes: Optional[dict] = None,
+                   start: Optional[int] = None, end: Optional[int] = None):
     """Reads a json file and returns a pandas dataframe."""
-    return pd.read_json(file_path)
+    # Without date inference, which would parse the timestamp column (milliseconds since epoch) as datetimes
+    data = pd.read_json(file_path, dtype=dtypes, convert_dates=False, keep_default_dates=False)
+    if columns is not None:
+        data = data[columns]
+    if dtypes:
+        data = data.astype(dtypes, copy=False)
+    return filter_timestamps(data, start, end).reset_index(drop=True)
+
+# Binary input format (.rhy): a header, then every int64 timestamp (milliseconds since epoch), then every
+# float32 value. The arrays are memory-mapped, so reading a file doesn't parse or copy it
+RHY_MAGIC = b'RHYTHMO\x01'
+RHY_HEADER = np.dtype([('magic', 'S8'), ('num_rows', '<i8'), ('sorted', 'u1'), ('padding', 'V15')]) # 32 bytes
+
+def write_rhy(data: pd.DataFrame, file_path: str):
+    """Writes the timestamp and value columns of a dataframe to a .rhy file."""
+    timestamps = np.ascontiguousarray(data['timestamp'], dtype='<i8')
+    values = np.ascontiguousarray(data['value'], dtype='<f4')
+    header = np.zeros(1, dtype=RHY_HEADER)
+    header['magic'] = RHY_MAGIC
+    header['num_rows'] = len(timestamps)
+    header['sorted'] = bool(np.all(timestamps[1:] >= timestamps[:-1]))
+
+    # Written next to the destination, then moved into place, so readers never see a partial file
+    with open(file_path + '.tmp', 'wb') as f:
+        f.write(header.tobytes())
+        f.write(timestamps.tobytes())
+        f.write(values.tobytes())
+    os.replace(file_path + '.tmp', file_path)
+    return data
+
+def read_rhy(file_path: str, columns: Optional[list] = None, dtypes: Optional[dict] = None,
+             start: Optional[int] = None, end: Optional[int] = None):
+    """Reads a .rhy file and returns a pandas dataframe backed by read-only memory-mapped arrays.
+
+    Rows outside the [start, end) timestamp range are sliced off without copying if the timestamps are
+    sorted (as written by convert_input).
+    """
+    if columns is not None and not set(columns) <= set(INPUT_COLUMNS):
+        raise ValueError(f"{file_path} only has the columns {', '.join(INPUT_COLUMNS)}")
+    header = np.fromfile(file_path, dtype=RHY_HEADER, count=1)
+    if len(header) == 0 or header['magic'][0] != RHY_MAGIC:
+        raise ValueError(f"{file_path} is not a rhythmo binary (.rhy) file")
+
+    num_rows = int(header['num_rows'][0])
+    if num_rows == 0:
+        timestamps, values = np.empty(0, dtype='<i8'), np.empty(0, dtype='<f4')
+    else:
+        timestamps = np.memmap(file_path, dtype='<i8', mode='r', offset=RHY_HEADER.itemsize, shape=(num_rows,))
+        values = np.memmap(file_path, dtype='<f4', mode='r', offset=RHY_HEADER.itemsize + 8 * num_rows,
+                           shape=(num_rows,))
+
+    if header['sorted'][0]:
+        first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+        last = num_rows if end is None else np.searchsorted(timestamps, end, side='left')
+        timestamps, values = timestamps[first:last], values[first:last]
+    elif start is not None or end is not None:
+        keep = np.ones(num_rows, dtype=bool)
+        if start is not None:
+            keep &= timestamps >= start
+        if end is not None:
+            keep &= timestamps < end
+        timestamps, values = timestamps[keep], values[keep]
+
+    arrays = {'timestamp': timestamps, 'value': values}
+    return pd.DataFrame({column: arrays[column] for column in columns or INPUT_COLUMNS}, copy=False)
+
+def convert_input(input_file: str, output_file: Optional[str] = None) -> str:
+    """Converts a csv, parquet or json input file to a .rhy file, sorted by timestamp.
+
+    Parameters
+    ----------
+    input_file: str
+        csv, parquet or json file
+    output_file: str, optional
+        location of the .rhy file (default input_file with the extension replaced by .rhy)
 
-def read_input(input_file: str) -> pd.DataFrame:
+    Returns
+    -------
+    output_file: str
+    """
+    output_file = output_file or os.path.splitext(input_file)[0] + '.rhy'
+    data = read_input(input_file)
+    order = np.argsort(data['timestamp'].to_numpy(), kind='stable')
+    write_rhy(data.iloc[order], output_file)
+    return output_file
 
-    """Reads an input file and returns a pandas dataframe."""
+def read_input(input_file: str, start: Optional[int] = None, end: Optional[int] = None,
+               columns: Optional[list] = None) -> pd.DataFrame:
+
+    """Reads the timestamp and value columns of an input file and returns a pandas dataframe.
+
+    Parameters
+    ----------
+    input_file: str
+        csv, parquet, json or rhythmo binary (.rhy) file
+    start: int, optional
+        only keep rows with timestamps (milliseconds since epoch) at or after start
+    end: int, optional
+        only keep rows with timestamps (milliseconds since epoch) before end
+    columns: list of str, optional
+        columns to read (default timestamp and value), e.g. to also read a subject column
+    """
+    columns = columns or INPUT_COLUMNS
     if input_file.endswith('.csv'):
-        return read_csv(input_file)
+        return read_csv(input_file, columns, INPUT_DTYPES, start, end)
 
     elif input_file.endswith('.parquet'):
-        return read_parquet(input_file)
+        return read_parquet(input_file, columns, INPUT_DTYPES, start, end)
 
     elif input_file.endswith('.json'):
-        return read_json(input_file)
+        return read_json_data(input_file, columns, INPUT_DTYPES, start, end)
+
+    elif input_file.endswith('.rhy'):
+        return read_rhy(input_file, columns, INPUT_DTYPES, start, end)
     else:
         raise ValueError(f"Unsupported file type: {input_file}")
 
@@ -76,3 +233,74 @@ def nearest(items, pivot):
     # Inputs: list of items and pivot point.
     # Ouputs: closest value in list to pivot point.
     return min(items, key=lambda x: abs(x - pivot)) # takes minimum value. Lambda function calcuates absolute difference between each item x in items and the pivot value
+
+
+def nbytes(value) -> int:
+    """Gets the memory used by an array, or a tuple/list of arrays, in bytes."""
+    if isinstance(value, (tuple, list)):
+        return sum(nbytes(item) for item in value)
+    return getattr(value, 'nbytes', 0)
+
+class LRUCache:
+    """
+    Least-recently-used cache bounded by the total size of its values in bytes.
+    Values that are arrays (or tuples of arrays) should be treated as read-only by callers.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, calling compute() to create it on a miss."""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return self._items[key]
+            self.misses += 1
+
+        value = compute()
+        size = nbytes(value)
+        if size > self.max_bytes:
+            # Too large to ever fit, so don't evict everything else for it
+            return value
+
+        with self._lock:
+            if key not in self._items:
+                self._items[key] = value
+                self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= nbytes(evicted)
+        return value
+
+    def resize(self, max_bytes: int) -> None:
+        """Changes the maximum size of the cache, evicting the least recently used values over it."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= nbytes(evicted)
+
+    def clear(self) -> None:
+        """Removes all cached values and resets the hit counts."""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict:
+        """Returns the number of hits, misses, hit rate, items and bytes held by the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / lookups if lookups else 0.0,
+                    'items': len(self._items),
+                    'nbytes': self.nbytes}